@@ -1,10 +1,65 @@
 # isoboost/__init__.py
 
+# the regression functions only need numpy and are imported eagerly. the
+# estimators need sklearn, which dominates import time, so they are only
+# imported on first access through __getattr__ below.
+
+import importlib
+
 from .isotonic1d import regress_isotonic_1d
-from .isotonic2d import Isotonic2dRegression
+from .isotonic1d import regress_isotonic_1d_external
 from .isotonic2d import regress_isotonic_2d
+from .isotonic2d import regress_isotonic_2d_grid
 from .isotonic2d import regress_isotonic_2d_l1
 from .isotonic2d import regress_isotonic_2d_l2
-from .isotonicboost import IsotonicBoostRegressor
-from .isotonickd import IsotonicKdRegression
+from .isotonic2d import regress_isotonic_2d_linf
+from .isotonicbatch import IsotonicBatch
+from .isotonicbatch import regress_isotonic_1d_batch
+from .isotonicbatch import regress_isotonic_2d_l2_batch
 from .isotonicreduce import reduce_isotonic
+from .isotonicsketch import IsotonicSketch
+from .modelfile import load_model
+from .modelfile import save_model
+
+_LAZY = {
+    "Isotonic1dRegression": "isotonic1dmodel",
+    "Isotonic1dStreamingRegression": "isotonic1dmodel",
+    "Isotonic2dRegression": "isotonic2dmodel",
+    "IsotonicBoostRegressor": "isotonicboost",
+    "IsotonicKdRegression": "isotonickd",
+}
+
+__all__ = [
+    "Isotonic1dRegression",
+    "Isotonic1dStreamingRegression",
+    "Isotonic2dRegression",
+    "IsotonicBatch",
+    "IsotonicBoostRegressor",
+    "IsotonicKdRegression",
+    "IsotonicSketch",
+    "load_model",
+    "reduce_isotonic",
+    "regress_isotonic_1d",
+    "regress_isotonic_1d_batch",
+    "regress_isotonic_1d_external",
+    "regress_isotonic_2d",
+    "regress_isotonic_2d_grid",
+    "regress_isotonic_2d_l1",
+    "regress_isotonic_2d_l2",
+    "regress_isotonic_2d_l2_batch",
+    "regress_isotonic_2d_linf",
+    "save_model",
+]
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module("." + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,84 @@
+# checkpoint.py
+
+# Append-only checkpoints for fits adding one stage at a time.
+#
+# Each completed stage i is saved as stage-<i>.pkl holding the pickled
+# stage and its training score, so earlier stages are never written
+# again. The training predictions after stage i are saved before it as
+# predictions-<i>.npy, and the predictions of stage i - 1 are only
+# removed after stage i is saved. All files are written to a temporary
+# name first and renamed into place, so a preempted fit leaves either
+# the whole file or nothing.
+
+import os
+import pickle
+import tempfile
+
+from numpy import load
+from numpy import save
+
+
+def _stage_path(directory, i):
+    return os.path.join(directory, "stage-%05d.pkl" % i)
+
+
+def _predictions_path(directory, i):
+    return os.path.join(directory, "predictions-%05d.npy" % i)
+
+
+def _write_atomic(path, write):
+    """
+    Helper function writing a file with write(file) under a temporary
+    name, and renaming it to path once complete.
+    """
+
+    (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def save_stage(directory, i, stage, predictions, score):
+    # directory = checkpoint directory. created if missing.
+    # i = index of the completed stage. stages 0 to i-1 must already be
+    #   saved.
+    # stage = picklable object describing the stage.
+    # predictions = training predictions after this stage.
+    # score = training score after this stage.
+
+    os.makedirs(directory, exist_ok=True)
+
+    _write_atomic(_predictions_path(directory, i), lambda f: save(f, predictions))
+    _write_atomic(
+        _stage_path(directory, i),
+        lambda f: pickle.dump((stage, score), f, protocol=pickle.HIGHEST_PROTOCOL),
+    )
+
+    if i > 0 and os.path.exists(_predictions_path(directory, i - 1)):
+        os.remove(_predictions_path(directory, i - 1))
+
+
+def load_stages(directory):
+    # directory = checkpoint directory written by save_stage.
+    #
+    # returns (stages, predictions, scores) for the completed stages,
+    # where predictions are the training predictions after the last
+    # stage, or None if there are no stages or they are missing.
+
+    stages = []
+    scores = []
+    while os.path.exists(_stage_path(directory, len(stages))):
+        with open(_stage_path(directory, len(stages)), "rb") as f:
+            (stage, score) = pickle.load(f)
+        stages.append(stage)
+        scores.append(score)
+
+    predictions = None
+    if stages and os.path.exists(_predictions_path(directory, len(stages) - 1)):
+        predictions = load(_predictions_path(directory, len(stages) - 1))
+
+    return (stages, predictions, scores)
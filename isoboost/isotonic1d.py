@@ -1,27 +1,41 @@
 # isotonic1d.py
 
+import heapq
 import itertools
+import os
+import tempfile
+
+from numpy import add
+from numpy import argsort
+from numpy import asarray
+from numpy import column_stack
+from numpy import concatenate
+from numpy import empty
+from numpy import flatnonzero
+from numpy import load
+from numpy import memmap
+from numpy import ones
+from numpy import searchsorted
 
 from .isotonicreduce import reduce_isotonic_l2
 from .piecewise import PiecewiseLinear
 
+# out-of-core fits read this many rows at a time by default, and merge
+# at most this many sorted runs at once.
+_CHUNK_SIZE = 1 << 20
+_FAN_IN = 64
 
-def regress_isotonic_1d(xs, vs, ws=None, *, n_values=None):
-    # xs/vs/ws = iterators of values for respective parameters below.
-    # x = independent variable
-    # v = dependent variable
-    # w = weight. defaults to 1 if ws is None.
-    # where regressed estimates must be isotonic in x
 
-    if ws is None:
-        ws = itertools.repeat(1.0)
+def _combine_inputs(xs, vs, ws):
+    """
+    Helper function sorting inputs and merging repeated independent
+    variables. Returns a list of [x, sum(v*w), sum(w)] lists.
+    """
 
-    # consume input iterators and match their values.
     inputs = zip(xs, vs, ws)
     inputs = list(inputs)
-
-    # sort and merge repeated independent variables.
-    # also converting to (x, sum(v*w), sum(w)) representation
+    if not inputs:
+        return inputs
 
     inputs.sort()
 
@@ -43,44 +57,52 @@ def regress_isotonic_1d(xs, vs, ws=None, *, n_values=None):
 
     inputs[distinct_xs:] = []
 
-    # run Principal Adjacent Violators Algorithm
+    return inputs
 
-    bucket_starts = []
-    bucket_ends = []
-    bucket_sums = []
-    bucket_values = []
-    bucket_weights = []
 
-    inputs.sort()
-    for (x, vw, w) in inputs:
-        if w == 0.0:
-            continue
+def _push_bucket(buckets, start, end, vw, w):
+    """
+    Helper function for the Principal Adjacent Violators Algorithm.
+    Adds a new bucket after the existing buckets, and merges buckets
+    as long as isotonicity is violated. Returns the number of merges.
+
+    buckets is a tuple of lists (starts, ends, sums, weights).
+    """
+
+    (bucket_starts, bucket_ends, bucket_sums, bucket_weights) = buckets
+
+    bucket_starts.append(start)
+    bucket_ends.append(end)
+    bucket_sums.append(vw)
+    bucket_weights.append(w)
+
+    merges = 0
+    while len(bucket_sums) > 1 and (
+        bucket_ends[-2] >= bucket_starts[-1]
+        or bucket_sums[-2] / bucket_weights[-2] > bucket_sums[-1] / bucket_weights[-1]
+    ):
+        bucket_sums[-2] += bucket_sums[-1]
+        bucket_weights[-2] += bucket_weights[-1]
+        bucket_ends[-2] = bucket_ends[-1]
 
-        # add new data point as a new bucket
-        bucket_starts.append(x)
-        bucket_ends.append(x)
-        bucket_sums.append(vw)
-        bucket_values.append(vw / w)
-        bucket_weights.append(w)
+        bucket_starts.pop()
+        bucket_ends.pop()
+        bucket_sums.pop()
+        bucket_weights.pop()
 
-        # merge buckets as long as isotonicity is violated.
+        merges += 1
 
-        while len(bucket_values) > 1 and (
-            bucket_ends[-2] >= bucket_starts[-1]
-            or bucket_values[-2] > bucket_values[-1]
-        ):
-            bucket_sums[-2] += bucket_sums[-1]
-            bucket_weights[-2] += bucket_weights[-1]
-            if bucket_weights[-2] > 0:
-                bucket_values[-2] = bucket_sums[-2] / bucket_weights[-2]
+    return merges
 
-            bucket_ends[-2] = bucket_ends[-1]
 
-            bucket_starts.pop()
-            bucket_ends.pop()
-            bucket_sums.pop()
-            bucket_values.pop()
-            bucket_weights.pop()
+def _build_output_function(buckets, n_values=None):
+    """
+    Helper function returning output function interpolating between
+    PAVA buckets.
+    """
+
+    (bucket_starts, bucket_ends, bucket_sums, bucket_weights) = buckets
+    bucket_values = [s / w for (s, w) in zip(bucket_sums, bucket_weights)]
 
     if n_values:
         reduced = reduce_isotonic_l2(bucket_values, bucket_weights, n_values)
@@ -94,3 +116,306 @@ def regress_isotonic_1d(xs, vs, ws=None, *, n_values=None):
             points.append((bucket_ends[i], bucket_values[i]))
 
     return PiecewiseLinear(points).interpolate
+
+
+def _regress_isotonic_1d_l1(xs, vs, ws):
+    """
+    Helper function for weighted L1 isotonic regression. Returns the
+    sorted distinct xs with positive weight and their regressed values.
+
+    Uses the "slope trick": a max-heap keeps the breakpoints of the
+    optimal cost as a function of the regressed value at the current
+    x, left of its minimum, so each input costs O(log n) amortized.
+    Ties are resolved towards the lower weighted median.
+    """
+
+    xs = asarray(xs, dtype=float)
+    vs = asarray(vs, dtype=float)
+    ws = asarray(ws, dtype=float)
+
+    keep = ws != 0.0
+    (xs, vs, ws) = (xs[keep], vs[keep], ws[keep])
+
+    order = argsort(xs, kind="stable")
+    (xs, vs, ws) = (xs[order].tolist(), vs[order].tolist(), ws[order].tolist())
+
+    # heap of [-v, slope change at v]
+    heap = []
+
+    group_xs = []
+    group_values = []
+
+    i = 0
+    while i < len(xs):
+        # each input adds w * |r - v|, adding slope 2 * w at v.
+        x = xs[i]
+        excess = 0.0
+        while i < len(xs) and xs[i] == x:
+            heapq.heappush(heap, [-vs[i], 2.0 * ws[i]])
+            excess += ws[i]
+            i += 1
+
+        # later x values may use any smaller regressed value, so drop
+        # the positive slope right of the minimum.
+        while excess > 0.0:
+            top = heap[0]
+            if top[1] <= excess:
+                excess -= top[1]
+                heapq.heappop(heap)
+            else:
+                top[1] -= excess
+                excess = 0.0
+
+        group_xs.append(x)
+        group_values.append(-heap[0][0])
+
+    # the minimum at the last x is optimal, and earlier values are the
+    # minimum of their cost below the next regressed value.
+    for i in range(len(group_values) - 2, -1, -1):
+        group_values[i] = min(group_values[i], group_values[i + 1])
+
+    return (group_xs, group_values)
+
+
+def regress_isotonic_1d(xs, vs, ws=None, *, n_values=None, p=2):
+    # xs/vs/ws = iterators of values for respective parameters below.
+    # x = independent variable
+    # v = dependent variable
+    # w = weight. defaults to 1 if ws is None.
+    # where regressed estimates must be isotonic in x
+    #
+    # p = 1 for L1 regression, or 2 for L2 regression.
+
+    if p == 1:
+        if n_values is not None:
+            raise NotImplementedError("n_values is not implemented for p=1")
+
+        xs = list(xs)
+        vs = list(vs)
+        ws = [1.0] * len(xs) if ws is None else list(ws)
+        if len(xs) != len(vs) or len(vs) != len(ws):
+            raise ValueError("input lengths do not match")
+
+        (group_xs, group_values) = _regress_isotonic_1d_l1(xs, vs, ws)
+
+        # only keep the ends of runs of equal values.
+        points = []
+        for i in range(len(group_xs)):
+            if (
+                i <= 0
+                or i + 1 >= len(group_xs)
+                or group_values[i] != group_values[i - 1]
+                or group_values[i] != group_values[i + 1]
+            ):
+                points.append((group_xs[i], group_values[i]))
+
+        return PiecewiseLinear(points).interpolate
+    elif p != 2:
+        raise ValueError("only L1 and L2 norms supported")
+
+    if ws is None:
+        ws = itertools.repeat(1.0)
+
+    # consume input iterators and match their values.
+    # sort and merge repeated independent variables.
+    # also converting to (x, sum(v*w), sum(w)) representation
+
+    inputs = _combine_inputs(xs, vs, ws)
+
+    # run Principal Adjacent Violators Algorithm
+
+    buckets = ([], [], [], [])
+    for (x, vw, w) in inputs:
+        if w == 0.0:
+            continue
+
+        _push_bucket(buckets, x, x, vw, w)
+
+    return _build_output_function(buckets, n_values)
+
+
+def _open_array(a):
+    """
+    Helper function opening .npy file names as memory-mapped arrays.
+    """
+
+    if isinstance(a, (str, os.PathLike)):
+        return load(a, mmap_mode="r")
+
+    return a
+
+
+def _merge_rows(xs, vws, ws):
+    """
+    Helper function sorting numpy inputs and merging repeated
+    independent variables. Returns an array of (x, sum(v*w), sum(w))
+    rows.
+    """
+
+    if len(xs) <= 0:
+        return empty((0, 3))
+
+    order = argsort(xs, kind="stable")
+    (xs, vws, ws) = (xs[order], vws[order], ws[order])
+
+    starts = flatnonzero(concatenate(([True], xs[1:] != xs[:-1])))
+
+    return column_stack(
+        (xs[starts], add.reduceat(vws, starts), add.reduceat(ws, starts))
+    )
+
+
+def _merge_runs(runs, block_size):
+    """
+    Helper function merging sorted runs of (x, sum(v*w), sum(w)) rows
+    without repeated x values. Yields sorted blocks of merged rows,
+    reading at most block_size rows from each run at a time.
+    """
+
+    positions = [0] * len(runs)
+    while True:
+        blocks = [
+            run[position : position + block_size]
+            for (run, position) in zip(runs, positions)
+        ]
+        active = [i for i in range(len(runs)) if len(blocks[i]) > 0]
+        if not active:
+            return
+
+        # every row up to the smallest last x of the blocks is available,
+        # including all rows with that x since runs do not repeat x.
+        threshold = min(blocks[i][-1, 0] for i in active)
+
+        parts = []
+        for i in active:
+            count = searchsorted(blocks[i][:, 0], threshold, side="right")
+            parts.append(asarray(blocks[i][:count]))
+            positions[i] += count
+
+        rows = concatenate(parts)
+        yield _merge_rows(rows[:, 0], rows[:, 1], rows[:, 2])
+
+
+def _spill_runs(runs, directory, block_size):
+    """
+    Helper function merging runs into a new run file. Returns the new
+    run as a memory-mapped array.
+    """
+
+    (handle, path) = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(handle, "wb") as f:
+        for rows in _merge_runs(runs, block_size):
+            rows.tofile(f)
+
+    return memmap(path, dtype=float, mode="r").reshape((-1, 3))
+
+
+def _push_block(buckets, rows):
+    """
+    Helper function adding sorted rows to PAVA buckets. The rows are
+    regressed on their own first since their level sets are always
+    contained in level sets of the full regression.
+    """
+
+    from sklearn.isotonic import isotonic_regression
+
+    (xs, sums, weights) = (rows[:, 0], rows[:, 1], rows[:, 2])
+
+    regressed = isotonic_regression(sums / weights, sample_weight=weights)
+
+    starts = flatnonzero(concatenate(([True], regressed[1:] != regressed[:-1])))
+    ends = concatenate((starts[1:], [len(xs)])) - 1
+
+    for (start, end, vw, w) in zip(
+        xs[starts].tolist(),
+        xs[ends].tolist(),
+        add.reduceat(sums, starts).tolist(),
+        add.reduceat(weights, starts).tolist(),
+    ):
+        _push_bucket(buckets, start, end, vw, w)
+
+
+def regress_isotonic_1d_external(
+    xs, vs, ws=None, *, n_values=None, chunk_size=None, temp_dir=None
+):
+    # xs/vs/ws = arrays, memory-mapped arrays, or .npy file names.
+    # same parameters and result as regress_isotonic_1d.
+    #
+    # chunk_size = rows read into memory at a time.
+    # temp_dir = directory for temporary sorted runs.
+    #
+    # memory use is bounded by chunk_size plus the output function.
+
+    if chunk_size is None:
+        chunk_size = _CHUNK_SIZE
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+
+    xs = _open_array(xs)
+    vs = _open_array(vs)
+    ws = None if ws is None else _open_array(ws)
+
+    n = len(xs)
+    if len(vs) != n or (ws is not None and len(ws) != n):
+        raise ValueError("input lengths do not match")
+
+    block_size = max(chunk_size // _FAN_IN, 1)
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+        # sort chunks into runs, spilling them to files unless the whole
+        # input fits in one chunk.
+        runs = []
+        for i in range(0, n, chunk_size):
+            chunk_xs = asarray(xs[i : i + chunk_size], dtype=float)
+            chunk_vs = asarray(vs[i : i + chunk_size], dtype=float)
+            if ws is None:
+                chunk_ws = ones(len(chunk_xs))
+            else:
+                chunk_ws = asarray(ws[i : i + chunk_size], dtype=float)
+
+            keep = chunk_ws != 0.0
+            (chunk_xs, chunk_vs, chunk_ws) = (
+                chunk_xs[keep],
+                chunk_vs[keep],
+                chunk_ws[keep],
+            )
+
+            rows = _merge_rows(chunk_xs, chunk_vs * chunk_ws, chunk_ws)
+            if len(rows) <= 0:
+                continue
+            if n <= chunk_size:
+                runs.append(rows)
+                continue
+
+            (handle, path) = tempfile.mkstemp(suffix=".run", dir=directory)
+            with os.fdopen(handle, "wb") as f:
+                rows.tofile(f)
+            runs.append(memmap(path, dtype=float, mode="r").reshape((-1, 3)))
+
+        # merge runs in passes until few enough remain to merge at once.
+        while len(runs) > _FAN_IN:
+            runs = [
+                _spill_runs(runs[i : i + _FAN_IN], directory, block_size)
+                for i in range(0, len(runs), _FAN_IN)
+            ]
+
+        # run Principal Adjacent Violators Algorithm on merged blocks.
+        buckets = ([], [], [], [])
+        for rows in _merge_runs(runs, block_size):
+            _push_block(buckets, rows)
+
+        del runs
+
+    return _build_output_function(buckets, n_values)
+
+
+def __getattr__(name):
+    # the estimators live in isotonic1dmodel.py so this module imports
+    # without sklearn, but stay importable from here.
+
+    if name in ("Isotonic1dRegression", "Isotonic1dStreamingRegression"):
+        from . import isotonic1dmodel
+
+        return getattr(isotonic1dmodel, name)
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
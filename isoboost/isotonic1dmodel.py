@@ -0,0 +1,502 @@
+# isotonic1dmodel.py
+
+# sklearn estimators for 1d isotonic regression, kept apart from the
+# regression functions in isotonic1d.py so those import without sklearn.
+
+import bisect
+import collections
+import heapq
+import itertools
+
+from numpy import add
+from numpy import asarray
+from numpy import concatenate
+from numpy import flatnonzero
+from numpy import isin
+from sklearn.base import RegressorMixin
+from sklearn.base import TransformerMixin
+from sklearn.isotonic import isotonic_regression
+from sklearn.utils import check_array
+
+from .isotonic1d import _build_output_function
+from .isotonic1d import _combine_inputs
+from .isotonic1d import _push_bucket
+
+# buckets are rebuilt from scratch instead of repaired once repairs
+# would replay more than 1 / this of the x values.
+_REPLAY_FRACTION = 4
+
+# streaming weights are rescaled before the decay scale drops below this,
+# and x values with smaller weights after rescaling are dropped.
+_MIN_SCALE = 1e-100
+
+
+class Isotonic1dRegression(RegressorMixin, TransformerMixin):
+    """Isotonic 1d regression model supporting incremental fitting.
+
+    Keeps the sufficient statistics of each distinct x value and the
+    PAVA buckets over them, so partial_fit only re-merges buckets near
+    new data.
+
+    Interface based on sklearn.isotonic.IsotonicRegression
+    https://github.com/scikit-learn/scikit-learn/blob/main/sklearn/isotonic.py
+    """
+
+    def __init__(self, n_values=None):
+        self.f_ = None
+        self.n_values = n_values
+
+        # sufficient statistics of each distinct x value.
+        self.xs_ = []
+        self.sums_ = []
+        self.weights_ = []
+
+        # PAVA buckets over the distinct x values.
+        self.bucket_starts_ = []
+        self.bucket_ends_ = []
+        self.bucket_sums_ = []
+        self.bucket_weights_ = []
+
+    def fit(self, X, y, sample_weight=None):
+        self.xs_ = []
+        self.sums_ = []
+        self.weights_ = []
+
+        self.bucket_starts_ = []
+        self.bucket_ends_ = []
+        self.bucket_sums_ = []
+        self.bucket_weights_ = []
+
+        self.partial_fit(X, y, sample_weight=sample_weight)
+
+    def partial_fit(self, X, y, sample_weight=None):
+        """Add more training data to the model.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples,) or (n_samples, 1)
+            Training data.
+        y : array-like of shape (n_samples,)
+            Training target.
+        sample_weight : array-like of shape (n_samples,), default=None
+            Weights. Defaults to 1.
+        """
+
+        inputs = self._check_fit_inputs(X, y, sample_weight)
+        if not inputs:
+            return
+
+        self.f_ = None
+        self._add(inputs)
+
+    def _check_fit_inputs(self, X, y, sample_weight):
+        """Helper function returning training data as sorted [x, sum(v*w),
+        sum(w)] lists with positive weights.
+        """
+
+        X = self._check_input(X)
+        y = check_array(y, ensure_2d=False, ensure_min_samples=0)
+        if len(X) != len(y):
+            raise ValueError("input lengths do not match")
+
+        ws = itertools.repeat(1.0) if sample_weight is None else sample_weight
+        return [r for r in _combine_inputs(X.tolist(), y.tolist(), ws) if r[2] != 0.0]
+
+    def _add(self, inputs):
+        """Helper function adding inputs to the statistics for each x
+        value and updating the buckets.
+        """
+
+        if len(inputs) > len(self.xs_) // 16:
+            self._merge_stats(inputs)
+        else:
+            self._insert_stats(inputs)
+
+        self._update_buckets([x for (x, _, _) in inputs])
+
+    def _update_buckets(self, dirty_xs):
+        """Helper function updating the buckets after the statistics of
+        the sorted dirty_xs changed.
+        """
+
+        if not dirty_xs:
+            return
+
+        # repairs replay the x values of each bucket holding a dirty x
+        # value, and push other dirty x values as new buckets. once that
+        # is a large part of all x values, one full pass is cheaper.
+        n = len(self.xs_)
+        if len(dirty_xs) * _REPLAY_FRACTION > n:
+            self._rebuild()
+            return
+
+        replayed = 0
+        k_replayed = None
+        for x in dirty_xs:
+            k = bisect.bisect_right(self.bucket_starts_, x) - 1
+            if k < 0 or self.bucket_ends_[k] < x:
+                replayed += 1
+            elif k != k_replayed:
+                replayed += bisect.bisect_right(
+                    self.xs_, self.bucket_ends_[k]
+                ) - bisect.bisect_left(self.xs_, self.bucket_starts_[k])
+                k_replayed = k
+
+        if replayed * _REPLAY_FRACTION > n:
+            self._rebuild()
+        else:
+            self._repair(dirty_xs)
+
+    def _merge_stats(self, inputs):
+        """Helper function merging many inputs into the statistics for
+        each x value.
+        """
+
+        combined = []
+        for (x, vw, w) in heapq.merge(
+            zip(self.xs_, self.sums_, self.weights_), inputs, key=lambda r: r[0]
+        ):
+            if combined and combined[-1][0] == x:
+                combined[-1][1] += vw
+                combined[-1][2] += w
+            else:
+                combined.append([x, vw, w])
+
+        self.xs_ = [x for (x, _, _) in combined]
+        self.sums_ = [vw for (_, vw, _) in combined]
+        self.weights_ = [w for (_, _, w) in combined]
+
+    def _insert_stats(self, inputs):
+        """Helper function merging a few inputs into the statistics for
+        each x value.
+        """
+
+        for (x, vw, w) in inputs:
+            i = bisect.bisect_left(self.xs_, x)
+            if i < len(self.xs_) and self.xs_[i] == x:
+                self.sums_[i] += vw
+                self.weights_[i] += w
+            else:
+                self.xs_.insert(i, x)
+                self.sums_.insert(i, vw)
+                self.weights_.insert(i, w)
+
+    def _rebuild(self):
+        """Helper function rebuilding the buckets from scratch."""
+
+        xs = asarray(self.xs_, dtype=float)
+        sums = asarray(self.sums_, dtype=float)
+        weights = asarray(self.weights_, dtype=float)
+
+        if len(xs) <= 0:
+            self.bucket_starts_ = []
+            self.bucket_ends_ = []
+            self.bucket_sums_ = []
+            self.bucket_weights_ = []
+            return
+
+        # compiled PAVA from sklearn, with buckets recovered from runs of
+        # equal regressed values.
+        regressed = isotonic_regression(sums / weights, sample_weight=weights)
+
+        starts = flatnonzero(concatenate(([True], regressed[1:] != regressed[:-1])))
+        ends = concatenate((starts[1:], [len(xs)])) - 1
+
+        self.bucket_starts_ = xs[starts].tolist()
+        self.bucket_ends_ = xs[ends].tolist()
+        self.bucket_sums_ = add.reduceat(sums, starts).tolist()
+        self.bucket_weights_ = add.reduceat(weights, starts).tolist()
+
+    def _repair(self, dirty_xs):
+        """Helper function repairing the buckets after the statistics of
+        the sorted dirty_xs changed.
+        """
+
+        # buckets before the first dirty x value are not affected,
+        # except by merging with later buckets.
+
+        buckets = (
+            self.bucket_starts_,
+            self.bucket_ends_,
+            self.bucket_sums_,
+            self.bucket_weights_,
+        )
+
+        k = bisect.bisect_right(self.bucket_starts_, dirty_xs[0]) - 1
+        if k < 0 or self.bucket_ends_[k] < dirty_xs[0]:
+            k += 1
+
+        old_buckets = tuple(b[k:] for b in buckets)
+        for b in buckets:
+            del b[k:]
+
+        (old_starts, old_ends, old_sums, old_weights) = old_buckets
+
+        # replay the remaining data. buckets without dirty data stay
+        # merged, and once one of those does not merge after the last
+        # dirty x value, the rest are unchanged.
+
+        j = 0
+        for t in range(len(old_starts)):
+            while j < len(dirty_xs) and dirty_xs[j] < old_starts[t]:
+                # new x value between buckets
+                self._push_x(buckets, dirty_xs[j])
+                j += 1
+
+            if j < len(dirty_xs) and dirty_xs[j] <= old_ends[t]:
+                # dirty data inside this bucket, so replay its x values.
+                i_start = bisect.bisect_left(self.xs_, old_starts[t])
+                i_end = bisect.bisect_right(self.xs_, old_ends[t])
+                for i in range(i_start, i_end):
+                    _push_bucket(
+                        buckets,
+                        self.xs_[i],
+                        self.xs_[i],
+                        self.sums_[i],
+                        self.weights_[i],
+                    )
+
+                while j < len(dirty_xs) and dirty_xs[j] <= old_ends[t]:
+                    j += 1
+                continue
+
+            merges = _push_bucket(
+                buckets, old_starts[t], old_ends[t], old_sums[t], old_weights[t]
+            )
+            if merges == 0 and j >= len(dirty_xs):
+                for (b, old_b) in zip(buckets, old_buckets):
+                    b.extend(old_b[t + 1 :])
+                break
+
+        # new x values after all the old buckets
+
+        for x in dirty_xs[j:]:
+            self._push_x(buckets, x)
+
+    def _push_x(self, buckets, x):
+        """Helper function pushing the statistics of x as a new bucket, if
+        x still has statistics.
+        """
+
+        i = bisect.bisect_left(self.xs_, x)
+        if i < len(self.xs_) and self.xs_[i] == x:
+            _push_bucket(buckets, x, x, self.sums_[i], self.weights_[i])
+
+    def piecewise(self):
+        """Return the PiecewiseLinear function behind the current
+        predictions. Cached until the model changes.
+        """
+
+        if self.f_ is None:
+            buckets = (
+                self.bucket_starts_,
+                self.bucket_ends_,
+                self.bucket_sums_,
+                self.bucket_weights_,
+            )
+            self.f_ = _build_output_function(buckets, self.n_values)
+
+        return self.f_.__self__
+
+    def _check_input(self, X):
+        X = check_array(X, ensure_2d=False, ensure_min_samples=0)
+        if X.ndim == 2:
+            if X.shape[1] != 1:
+                raise ValueError("wrong shape")
+            X = X[:, 0]
+
+        return X
+
+    def predict(self, T):
+        """Predict new data by linear interpolation.
+
+        Parameters
+        ----------
+        T : array-like of shape (n_samples,) or (n_samples, 1)
+            Data to transform.
+
+        Returns
+        -------
+        y_pred : ndarray of shape (n_samples,)
+            Transformed data.
+        """
+        return self.transform(T)
+
+    def transform(self, T):
+        """Transform new data by linear interpolation.
+
+        Parameters
+        ----------
+        T : array-like of shape (n_samples,) or (n_samples, 1)
+            Data to transform.
+
+        Returns
+        -------
+        y_pred : ndarray of shape (n_samples,)
+            Transformed data.
+        """
+
+        T = self._check_input(T)
+        return self.piecewise().interpolate_array(T)
+
+
+class Isotonic1dStreamingRegression(Isotonic1dRegression):
+    """Isotonic 1d regression model for streaming calibration.
+
+    Each call to partial_fit is one tick. Older data can be forgotten
+    gradually with decay, or completely once it is older than window
+    ticks. Both are applied incrementally instead of refitting.
+
+    Parameters
+    ----------
+    decay : float, default=None
+        Factor applied to the weights of existing data each tick.
+    window : int, default=None
+        Number of most recent ticks whose data is kept.
+    n_values : int, default=None
+        Number of distinct output values to reduce to.
+    """
+
+    def __init__(self, decay=None, window=None, n_values=None):
+        super().__init__(n_values=n_values)
+        self.decay = decay
+        self.window = window
+
+        # stored weights are divided by scale_, so decaying all of them
+        # only updates scale_. scaling all weights does not change the
+        # PAVA buckets.
+        self.scale_ = 1.0
+
+        # statistics added each tick within the window, and the number
+        # of those ticks with data for each x value.
+        self.ticks_ = collections.deque()
+        self.counts_ = {}
+
+    def fit(self, X, y, sample_weight=None):
+        self.scale_ = 1.0
+        self.ticks_ = collections.deque()
+        self.counts_ = {}
+
+        super().fit(X, y, sample_weight=sample_weight)
+
+    def partial_fit(self, X, y, sample_weight=None):
+        """Add the training data of the next tick to the model.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples,) or (n_samples, 1)
+            Training data.
+        y : array-like of shape (n_samples,)
+            Training target.
+        sample_weight : array-like of shape (n_samples,), default=None
+            Weights. Defaults to 1.
+        """
+
+        inputs = self._check_fit_inputs(X, y, sample_weight)
+
+        if self.decay is not None:
+            if not 0.0 < self.decay <= 1.0:
+                raise ValueError("decay must be in (0, 1]")
+
+            self.scale_ *= self.decay
+            if self.scale_ < _MIN_SCALE:
+                self._rescale()
+
+            for r in inputs:
+                r[1] /= self.scale_
+                r[2] /= self.scale_
+
+        if inputs:
+            self.f_ = None
+            self._add(inputs)
+
+        if self.window is not None:
+            if self.window < 1:
+                raise ValueError("window must be positive")
+
+            self.ticks_.append(
+                tuple(asarray(c, dtype=float) for c in zip(*inputs)) if inputs else None
+            )
+            for (x, _, _) in inputs:
+                self.counts_[x] = self.counts_.get(x, 0) + 1
+
+            while len(self.ticks_) > self.window:
+                expired = self.ticks_.popleft()
+                if expired is not None:
+                    self.f_ = None
+                    self._remove(*expired)
+
+    def _rescale(self):
+        """Helper function applying scale_ to all stored weights before
+        they grow too large. x values whose weights fall below _MIN_SCALE
+        are dropped, before they underflow to 0.
+        """
+
+        scale = self.scale_
+        self.scale_ = 1.0
+
+        self.sums_ = [vw * scale for vw in self.sums_]
+        self.weights_ = [w * scale for w in self.weights_]
+        self.ticks_ = collections.deque(
+            None if t is None else (t[0], t[1] * scale, t[2] * scale)
+            for t in self.ticks_
+        )
+
+        dropped = [x for (x, w) in zip(self.xs_, self.weights_) if w < _MIN_SCALE]
+        if not dropped:
+            self.bucket_sums_ = [vw * scale for vw in self.bucket_sums_]
+            self.bucket_weights_ = [w * scale for w in self.bucket_weights_]
+            return
+
+        kept = [w >= _MIN_SCALE for w in self.weights_]
+        (self.xs_, self.sums_, self.weights_) = (
+            list(itertools.compress(c, kept))
+            for c in (self.xs_, self.sums_, self.weights_)
+        )
+
+        # forget dropped x values in the window too.
+        for x in dropped:
+            self.counts_.pop(x, None)
+        if self.window is not None:
+            ticks = [
+                None if t is None else tuple(c[~isin(t[0], dropped)] for c in t)
+                for t in self.ticks_
+            ]
+            self.ticks_ = collections.deque(
+                None if t is None or len(t[0]) <= 0 else t for t in ticks
+            )
+
+        self.f_ = None
+        self._rebuild()
+
+    def _remove(self, xs, sums, weights):
+        """Helper function subtracting the statistics of an expired tick
+        and updating the buckets.
+        """
+
+        xs = xs.tolist()
+
+        dead = []
+        for (x, vw, w) in zip(xs, sums.tolist(), weights.tolist()):
+            i = bisect.bisect_left(self.xs_, x)
+
+            self.counts_[x] -= 1
+            if self.counts_[x] > 0:
+                self.sums_[i] -= vw
+                self.weights_[i] -= w
+            else:
+                # remove exactly instead of leaving rounding errors.
+                del self.counts_[x]
+                dead.append(i)
+
+        if dead:
+            # copy the slices between dead entries.
+            bounds = list(zip([-1] + dead, dead + [len(self.xs_)]))
+            (self.xs_, self.sums_, self.weights_) = (
+                list(
+                    itertools.chain.from_iterable(c[i0 + 1 : i1] for (i0, i1) in bounds)
+                )
+                for c in (self.xs_, self.sums_, self.weights_)
+            )
+
+        self._update_buckets(xs)
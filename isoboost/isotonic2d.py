@@ -9,16 +9,50 @@ import bisect
 import itertools
 import math
 import statistics
+import time
 
+from numpy import arange
+from numpy import array
+from numpy import argsort
 from numpy import asarray
-from sklearn.base import RegressorMixin
-from sklearn.base import TransformerMixin
-from sklearn.utils import check_array
+from numpy import bincount
+from numpy import column_stack
+from numpy import empty
+from numpy import flatnonzero
+from numpy import inf
+from numpy import int64
+from numpy import lexsort
+from numpy import linspace
+from numpy import maximum
+from numpy import nextafter
+from numpy import ones
+from numpy import quantile
+from numpy import searchsorted
+from numpy import unique
+from numpy import where
+from numpy import zeros
 
 from . import rangemap
+from .isotonicgrid import _regress_isotonic_grid_binary
+from .isotonicgrid import regress_isotonic_grid_l2
+from .isotonicgrid import regress_isotonic_grid_l2_dykstra
 from .piecewise import PiecewiseBilinear
 from .isotonicreduce import reduce_isotonic_l2
 
+# inputs with at most this many distinct values use the few level
+# fast path for L2 regression.
+_FEW_LEVELS = 16
+
+# binary splits of L2 partitions use dense grids up to this many cells.
+_DENSE_CELLS = 1 << 20
+
+# alternating projections use dense grids up to this many cells.
+_DYKSTRA_CELLS = 1 << 24
+
+# weighted L-infinity regression raises its error at most this many
+# times before bisecting for it instead.
+_LINF_PASSES = 16
+
 
 def _build_output_function(regressed):
     """
@@ -74,24 +108,29 @@ def _build_output_function(regressed):
         merged.extend(x_batch[i:])
         merged.extend(previous[j:])
 
-        # filter out redundant / degenerate values
+        # filter out redundant / degenerate values. points carried from
+        # previous rows only bound values from below, so matching y
+        # values keep the larger value, and smaller values after larger
+        # ones are dropped. the level sets must be filtered after that,
+        # or replacing the end of a level set loses where it ends.
 
-        filtered = [merged[0]]
+        increasing = [merged[0]]
         for i in range(1, len(merged)):
-            if filtered[-1][0] == merged[i][0]:
+            if increasing[-1][0] == merged[i][0]:
                 # matching y value, so replace smaller value
-                filtered[-1] = merged[i]
-            elif filtered[-1][1] == merged[i][1]:
-                # same value, but growing level set
-                if (len(filtered) < 2) or filtered[-2][1] < merged[i][1]:
-                    # expanding from a single y value
-                    filtered.append(merged[i])
-                else:
-                    # expanding a proper range of y values
-                    filtered[-1] = merged[i]
-            elif filtered[-1][1] < merged[i][1]:
-                # increasing value
-                filtered.append(merged[i])
+                increasing[-1] = merged[i]
+            elif increasing[-1][1] <= merged[i][1]:
+                increasing.append(merged[i])
+
+        # only keep the ends of level sets
+        filtered = [
+            increasing[i]
+            for i in range(len(increasing))
+            if i <= 0
+            or i + 1 >= len(increasing)
+            or increasing[i - 1][1] != increasing[i][1]
+            or increasing[i][1] != increasing[i + 1][1]
+        ]
 
         # finished for this row
 
@@ -196,15 +235,684 @@ def _regress_isotonic_2d_l1_binary(inputs, a, b):
     return regressed
 
 
-def regress_isotonic_2d(xs, ys, vs, ws=None, *, n_values=None, p=2):
-    if p == 1:
+def _is_complete_grid(inputs):
+    """
+    Helper function checking if combined inputs fill a complete
+    rectangular grid of distinct x and y values.
+    """
+
+    x_values = set(x for (x, _, _, _) in inputs)
+    y_values = set(y for (_, y, _, _) in inputs)
+
+    return len(inputs) > 1 and len(inputs) == len(x_values) * len(y_values)
+
+
+def _regress_isotonic_2d_l2_grid(inputs):
+    """
+    Helper function for L2 regression of combined inputs filling a
+    complete grid, using the dense array solver.
+    """
+
+    x_values = sorted(set(x for (x, _, _, _) in inputs))
+    y_values = sorted(set(y for (_, y, _, _) in inputs))
+
+    x_indexes = {x: u for (u, x) in enumerate(x_values)}
+    y_indexes = {y: v for (v, y) in enumerate(y_values)}
+
+    grid_values = empty((len(x_values), len(y_values)))
+    grid_weights = empty((len(x_values), len(y_values)))
+    for (x, y, v, w) in inputs:
+        grid_values[x_indexes[x], y_indexes[y]] = v
+        grid_weights[x_indexes[x], y_indexes[y]] = w
+
+    grid_regressed = regress_isotonic_grid_l2(grid_values, grid_weights)
+
+    return {
+        (x, y): grid_regressed[u, v]
+        for (u, x) in enumerate(x_values)
+        for (v, y) in enumerate(y_values)
+    }
+
+
+def _split_isotonic_2d_l2(partition_inputs, v_split):
+    """
+    Helper function for L2 regression. Splits a partition into the
+    vertexes with regression values at most v_split, and those with
+    regression values above v_split.
+    """
+
+    # Using epsilon-partitioning from
+    #
+    # Isotonic Regression via Partitioning, section 5.1.
+
+    binary_inputs = []
+    for (x, y, v, w) in partition_inputs:
+        # no pow() in weight formulas since this is L2, so
+        # power would be one.
+        if v <= v_split:
+            binary_inputs.append((x, y, 0.0, w * (v_split - v)))
+        else:
+            binary_inputs.append((x, y, 1.0, w * (v - v_split)))
+
+    binary_values = _regress_isotonic_2d_l1_binary(binary_inputs, 0.0, 1.0)
+
+    low = [r for r in partition_inputs if binary_values[(r[0], r[1])] < 1.0]
+    high = [r for r in partition_inputs if binary_values[(r[0], r[1])] >= 1.0]
+
+    return (low, high)
+
+
+def _split_isotonic_2d_l2_dense(partition_inputs, v_split):
+    """
+    Helper function for L2 regression. Same as _split_isotonic_2d_l2,
+    but solves the binary problem over a dense grid of the distinct x
+    and y values of the partition, with zero errors for empty cells.
+    """
+
+    xs = asarray([x for (x, _, _, _) in partition_inputs], dtype=float)
+    ys = asarray([y for (_, y, _, _) in partition_inputs], dtype=float)
+    vs = asarray([v for (_, _, v, _) in partition_inputs], dtype=float)
+    ws = asarray([w for (_, _, _, w) in partition_inputs], dtype=float)
+
+    (_, rows) = unique(xs, return_inverse=True)
+    (_, cols) = unique(ys, return_inverse=True)
+
+    # epsilon-partitioning as in _split_isotonic_2d_l2.
+    deltas = ws * (vs - v_split)
+
+    a_errors = zeros((rows.max() + 1, cols.max() + 1))
+    b_errors = zeros((rows.max() + 1, cols.max() + 1))
+    a_errors[rows, cols] = maximum(deltas, 0.0)
+    b_errors[rows, cols] = maximum(-deltas, 0.0)
+
+    high = _regress_isotonic_grid_binary(a_errors, b_errors)[rows, cols]
+
+    low = [r for (i, r) in enumerate(partition_inputs) if not high[i]]
+    high = [r for (i, r) in enumerate(partition_inputs) if high[i]]
+
+    return (low, high)
+
+
+def _partition_norm(partition_inputs):
+    """
+    Helper function returning the weighted mean of a partition.
+    """
+
+    return sum(v * w for (_, _, v, w) in partition_inputs) / sum(
+        w for (_, _, _, w) in partition_inputs
+    )
+
+
+def _dominance_free(xs, ys, blockers):
+    """
+    Helper function returning which vertexes are not dominated by any
+    blocker, where (x, y) is dominated by (x', y') if x <= x' and y <= y'.
+    """
+
+    # sweep x from high to low, tracking the highest blocker y seen so
+    # far. vertexes sharing an x value see each other.
+
+    order = argsort(-xs, kind="stable")
+    sorted_xs = -xs[order]
+
+    blocker_ys = where(blockers[order], ys[order], -inf)
+    max_blocker_ys = maximum.accumulate(blocker_ys)
+    x_ends = searchsorted(sorted_xs, sorted_xs, side="right") - 1
+
+    free = empty(len(xs), dtype=bool)
+    free[order] = max_blocker_ys[x_ends] < ys[order]
+
+    return free
+
+
+def _prune_extreme_levels(partition_inputs):
+    """
+    Helper function for L2 regression of inputs with few distinct
+    values. Returns (pruned, remaining) where pruned maps vertexes
+    with known regression values to those values.
+
+    A vertex whose upper set only holds the highest value of the
+    partition must be regressed to that value, and removing it does
+    not change the regression of the remaining vertexes. Likewise for
+    lower sets and the lowest value.
+    """
+
+    xs = asarray([x for (x, _, _, _) in partition_inputs], dtype=float)
+    ys = asarray([y for (_, y, _, _) in partition_inputs], dtype=float)
+    vs = asarray([v for (_, _, v, _) in partition_inputs], dtype=float)
+
+    v_min = vs.min()
+    v_max = vs.max()
+
+    top = _dominance_free(xs, ys, vs < v_max)
+    bottom = _dominance_free(-xs, -ys, vs > v_min)
+
+    pruned = {}
+    remaining = []
+    for (i, r) in enumerate(partition_inputs):
+        if top[i]:
+            pruned[(r[0], r[1])] = v_max
+        elif bottom[i]:
+            pruned[(r[0], r[1])] = v_min
+        else:
+            remaining.append(r)
+
+    return (pruned, remaining)
+
+
+def _assign_partition_norm(regressed, partition_inputs, v_low, v_high):
+    """
+    Helper function assigning the weighted mean of a partition to all
+    its vertexes before the partition is fully split. Returns a bound
+    on the resulting increase in weighted squared error, given that
+    the optimal regressed values are in [v_low, v_high].
+    """
+
+    partition_norm = _partition_norm(partition_inputs)
+    for (x, y, _, _) in partition_inputs:
+        regressed[(x, y)] = partition_norm
+
+    # regressed values are averages of input values, so they are also
+    # limited by the partition's input values.
+    v_low = max(v_low, min(r[2] for r in partition_inputs))
+    v_high = min(v_high, max(r[2] for r in partition_inputs))
+
+    # the partition norm is the weighted average of the optimal
+    # regressed values, so replacing them costs at most the variance of
+    # values limited to [v_low, v_high].
+    partition_weight = sum(r[3] for r in partition_inputs)
+
+    return partition_weight * (v_high - v_low) ** 2 / 4.0
+
+
+def _regress_isotonic_2d_l2_partition(
+    inputs,
+    *,
+    few_levels=False,
+    estimates=None,
+    tol=None,
+    max_rounds=None,
+    deadline=None,
+    stats=None,
+):
+    """
+    Helper function for L2 regression of combined inputs using the
+    general partitioning approach.
+
+    Partitions spanning small grids are split using dense arrays. If
+    few_levels is set, vertexes forced to the highest or lowest value
+    of each partition are also pruned before each binary split. This
+    pays off for inputs with few distinct values like binary labels.
+
+    If estimates maps vertexes to estimated regression values,
+    partitions are split near the median of their estimates until
+    that stops making progress, and then split on their means.
+
+    If tol is set, splits are kept in the middle of each partition's
+    range of possible regression values, and partitions stop splitting
+    once that range is smaller than tol.
+
+    Splitting stops early after max_rounds rounds, or once
+    time.monotonic() passes deadline. Partitions still open are
+    assigned their weighted means, which is still isotonic.
+
+    If stats is a dict, it is updated with the number of rounds
+    started, the number of partitions left open, and a bound on the
+    increase in weighted mean squared error from stopping early.
+    """
+
+    # Optimal L2 regressions can not be restricted to input values, so
+    # we can not use the same binary search over input values used for
+    # L1. As noted by Stout, we can split on the L2 norm of the
+    # current partition, and get a split unless there is only one
+    # regression value remaining. This split choice may require n-1
+    # rounds.
+    #
+    # Splitting on any other value still splits the regression
+    # exactly, so good estimates of the regression values can balance
+    # the splits when the means would be lopsided, and keeping splits
+    # in the middle of the range of regression values limits the
+    # rounds to log(range / tol).
+
+    regressed = {}
+    gap = 0.0
+
+    v_min = min(r[2] for r in inputs)
+    v_max = max(r[2] for r in inputs)
+
+    # splits are processed in rounds so max_rounds limits the depth of
+    # the partitioning.
+    partitions = []
+    next_partitions = [(list(inputs), estimates is not None, v_min, v_max)]
+    n_rounds = 0
+    while partitions or next_partitions:
+        if not partitions:
+            if max_rounds is not None and n_rounds >= max_rounds:
+                break
+            (partitions, next_partitions) = (next_partitions, [])
+            n_rounds += 1
+
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+
+        (partition_inputs, seeded, v_low, v_high) = partitions.pop()
+
+        if few_levels:
+            (pruned, partition_inputs) = _prune_extreme_levels(partition_inputs)
+            regressed.update(pruned)
+
+        if len(partition_inputs) <= 0:
+            continue
+        if len(partition_inputs) == 1:
+            ((x, y, v, _),) = partition_inputs
+            regressed[(x, y)] = v
+            continue
+
+        partition_norm = _partition_norm(partition_inputs)
+
+        if tol is not None:
+            # regressed values are averages of input values, so they
+            # are also limited by the partition's input values.
+            v_low = max(v_low, min(r[2] for r in partition_inputs))
+            v_high = min(v_high, max(r[2] for r in partition_inputs))
+
+            if v_high - v_low < tol:
+                gap += _assign_partition_norm(
+                    regressed, partition_inputs, v_low, v_high
+                )
+                continue
+
+        # dense splits are much faster than the sparse dynamic program
+        # once the grid spanned by the partition is small.
+        split = _split_isotonic_2d_l2
+        n_cells = len(set(r[0] for r in partition_inputs)) * len(
+            set(r[1] for r in partition_inputs)
+        )
+        if n_cells <= _DENSE_CELLS:
+            split = _split_isotonic_2d_l2_dense
+
+        v_split = None
+        if seeded:
+            partition_estimates = [
+                estimates[(x, y)] for (x, y, _, _) in partition_inputs
+            ]
+            levels = sorted(set(partition_estimates))
+            if len(levels) > 1:
+                # split between the median estimate and its neighbor
+                k = bisect.bisect_left(
+                    levels, statistics.median_low(partition_estimates)
+                )
+                k = min(k, len(levels) - 2)
+                v_split = (levels[k] + levels[k + 1]) / 2.0
+        elif tol is not None:
+            # split on the norm, but keep it in the middle half of the
+            # range so each split shrinks the range by at least 1/4.
+            v_quarter = (v_high - v_low) / 4.0
+            v_split = min(max(partition_norm, v_low + v_quarter), v_high - v_quarter)
+
+        if v_split is not None:
+            (low, high) = split(partition_inputs, v_split)
+            if low and high:
+                next_partitions.append((low, seeded, v_low, v_split))
+                next_partitions.append((high, seeded, v_split, v_high))
+                continue
+
+            # all regressed values are on one side of v_split.
+            if low:
+                v_high = min(v_high, v_split)
+            else:
+                v_low = max(v_low, v_split)
+
+            # fall back to splitting on the norm.
+
+        if v_split != partition_norm:
+            (low, high) = split(partition_inputs, partition_norm)
+        if not low or not high:
+            # no more splits
+            for (x, y, _, _) in partition_inputs:
+                regressed[(x, y)] = partition_norm
+            continue
+
+        # keep splitting based on the binary regression
+
+        next_partitions.append((low, False, v_low, partition_norm))
+        next_partitions.append((high, False, partition_norm, v_high))
+
+    # stopped early, so settle for the norms of the open partitions.
+
+    open_partitions = partitions + next_partitions
+    for (partition_inputs, _, v_low, v_high) in open_partitions:
+        gap += _assign_partition_norm(regressed, partition_inputs, v_low, v_high)
+
+    if stats is not None:
+        stats["gap"] = float(gap / sum(r[3] for r in inputs))
+        stats["n_rounds"] = n_rounds
+        stats["n_open_partitions"] = len(open_partitions)
+
+    return regressed
+
+
+def _coarse_estimates(inputs, coarse_bins):
+    """
+    Helper function for coarse to fine L2 regression. Solves a binned
+    version of the problem, and returns its regression values at each
+    input vertex as estimates for the full problem.
+    """
+
+    (xs, ys, vs, ws) = (asarray(c, dtype=float) for c in zip(*inputs))
+    coarse_inputs = list(zip(*_bin_isotonic_2d(xs, ys, vs, ws, coarse_bins)))
+
+    coarse_regressed = _regress_isotonic_2d_l2_inputs(coarse_inputs)
+    coarse_f = _build_output_function(coarse_regressed)
+
+    coarse_values = coarse_f.__self__.interpolate_array(xs, ys)
+    return {(r[0], r[1]): v for (r, v) in zip(inputs, coarse_values.tolist())}
+
+
+def _regress_isotonic_2d_l2_inputs(
+    inputs, *, coarse_bins=None, tol=None, max_rounds=None, deadline=None, stats=None
+):
+    """
+    Helper function for L2 regression of combined inputs, picking the
+    best available solver.
+    """
+
+    # the grid solver is fast enough to always be exact, but can not
+    # stop early.
+    if max_rounds is None and deadline is None and _is_complete_grid(inputs):
+        if stats is not None:
+            stats["gap"] = 0.0
+            stats["n_open_partitions"] = 0
+        return _regress_isotonic_2d_l2_grid(inputs)
+
+    few_levels = len(set(v for (_, _, v, _) in inputs)) <= _FEW_LEVELS
+
+    estimates = None
+    if coarse_bins is not None and len(inputs) > 1:
+        estimates = _coarse_estimates(inputs, coarse_bins)
+
+    return _regress_isotonic_2d_l2_partition(
+        inputs,
+        few_levels=few_levels,
+        estimates=estimates,
+        tol=tol,
+        max_rounds=max_rounds,
+        deadline=deadline,
+        stats=stats,
+    )
+
+
+def _regress_isotonic_2d_l2_dykstra(
+    inputs, *, tol=None, max_rounds=None, deadline=None, stats=None
+):
+    """
+    Helper function for approximate L2 regression of combined inputs
+    by alternating projections on the grid of distinct x and y values.
+    """
+
+    x_values = sorted(set(x for (x, _, _, _) in inputs))
+    y_values = sorted(set(y for (_, y, _, _) in inputs))
+    if len(x_values) * len(y_values) > _DYKSTRA_CELLS:
+        raise ValueError(
+            "too many grid cells for dykstra; bin inputs with max_bins first"
+        )
+
+    x_indexes = {x: u for (u, x) in enumerate(x_values)}
+    y_indexes = {y: v for (v, y) in enumerate(y_values)}
+
+    grid_values = zeros((len(x_values), len(y_values)))
+    grid_weights = zeros((len(x_values), len(y_values)))
+    for (x, y, v, w) in inputs:
+        grid_values[x_indexes[x], y_indexes[y]] = v
+        grid_weights[x_indexes[x], y_indexes[y]] = w
+
+    (grid_regressed, gaps) = regress_isotonic_grid_l2_dykstra(
+        grid_values, grid_weights, tol=tol, max_iter=max_rounds, deadline=deadline
+    )
+
+    if stats is not None:
+        stats["gap"] = gaps[-1]
+        stats["gaps"] = gaps
+        stats["n_rounds"] = len(gaps)
+
+    return {
+        (x, y): grid_regressed[x_indexes[x], y_indexes[y]] for (x, y, _, _) in inputs
+    }
+
+
+def _quantile_bins(values, max_bins):
+    """
+    Helper function assigning values to at most max_bins quantile
+    bins. Returns the bin index of each value, and the mean value of
+    each bin.
+    """
+
+    (distinct, bins) = unique(values, return_inverse=True)
+    if len(distinct) > max_bins:
+        edges = unique(quantile(values, linspace(0.0, 1.0, max_bins + 1)[1:-1]))
+        bins = searchsorted(edges, values, side="right")
+        (_, bins) = unique(bins, return_inverse=True)
+
+    means = bincount(bins, values) / bincount(bins)
+
+    return (bins, means)
+
+
+def _bin_isotonic_2d(xs, ys, vs, ws, max_bins):
+    """
+    Helper function for approximate regression. Quantile bins x and y
+    values, and combines the inputs in each grid cell into one
+    weighted input at the mean coordinates of its bins.
+    """
+
+    (x_bins, x_means) = _quantile_bins(xs, max_bins)
+    (y_bins, y_means) = _quantile_bins(ys, max_bins)
+
+    n_cells = len(x_means) * len(y_means)
+    cells = x_bins * len(y_means) + y_bins
+
+    cell_weights = bincount(cells, ws, minlength=n_cells)
+    cell_sums = bincount(cells, vs * ws, minlength=n_cells)
+
+    occupied = flatnonzero(cell_weights > 0.0)
+    (cell_xs, cell_ys) = divmod(occupied, len(y_means))
+
+    return (
+        x_means[cell_xs],
+        y_means[cell_ys],
+        cell_sums[occupied] / cell_weights[occupied],
+        cell_weights[occupied],
+    )
+
+
+def _weighted_error(f, xs, ys, vs, ws):
+    """
+    Helper function returning the weighted mean squared error of an
+    output function over the inputs.
+    """
+
+    fitted = f.__self__.interpolate_array(xs, ys)
+
+    return float((ws * (vs - fitted) ** 2).sum() / ws.sum())
+
+
+def _dominance_levels(xs, ys):
+    """
+    Helper function preparing maximums over the dominance order.
+    Vertexes sorted by (x, y) are split into halves recursively, and
+    each vertex in a right half looks up the vertexes in the left half
+    of the same block with y values at most its own. Returns a list of
+    (left, left_blocks, right, lookups) index arrays for each level.
+    """
+
+    n = len(xs)
+    if n <= 0:
+        return []
+
+    order = lexsort((ys, xs))
+    y_ranks = unique(ys, return_inverse=True)[1].reshape(-1)[order]
+    n_ys = y_ranks.max() + 1
+
+    positions = arange(n)
+
+    levels = []
+    half = 1
+    while half < n:
+        blocks = positions // (2 * half)
+        is_right = (positions // half) % 2 == 1
+
+        # left halves sorted by y within each block
+        left = flatnonzero(~is_right)
+        left = left[lexsort((y_ranks[left], blocks[left]))]
+        keys = blocks[left] * n_ys + y_ranks[left]
+
+        right = flatnonzero(is_right)
+        lookups = searchsorted(keys, blocks[right] * n_ys + y_ranks[right], "right")
+        lookups -= 1
+
+        found = lookups >= 0
+        found[found] = keys[lookups[found]] >= blocks[right[found]] * n_ys
+
+        levels.append((order[left], blocks[left], order[right[found]], lookups[found]))
+
+        half *= 2
+
+    return levels
+
+
+def _dominance_argmax(levels, vertexes, values):
+    """
+    Helper function returning the index of the largest value among the
+    inputs dominated by each input, including itself and other inputs
+    at the same vertex.
+    """
+
+    n = len(values)
+
+    by_rank = argsort(values, kind="stable")
+    ranks = empty(n, dtype=int)
+    ranks[by_rank] = arange(n)
+
+    best = ranks.copy()
+    for (left, left_blocks, right, lookups) in levels:
+        # running maximum within each block, kept apart by offsets.
+        offsets = left_blocks * n
+        prefix = maximum.accumulate(ranks[left] + offsets) - offsets
+        best[right] = maximum(best[right], prefix[lookups])
+
+    vertex_best = zeros(vertexes.max() + 1, dtype=int)
+    maximum.at(vertex_best, vertexes, best)
+
+    return by_rank[vertex_best[vertexes]]
+
+
+def regress_isotonic_2d(
+    xs,
+    ys,
+    vs,
+    ws=None,
+    *,
+    n_values=None,
+    p=2,
+    max_bins=None,
+    coarse_bins=None,
+    tol=None,
+    max_rounds=None,
+    time_budget=None,
+    return_stats=False,
+    method="partition",
+):
+    # max_bins = if set, quantile bin x and y values into at most
+    #   max_bins bins each, and regress one weighted input per grid
+    #   cell. approximate, but caps the problem size at max_bins ** 2.
+    # coarse_bins/tol/max_rounds/time_budget/method = see
+    #   regress_isotonic_2d_l2.
+    # return_stats = if set, return (f, stats) where stats is a dict
+    #   of fit statistics:
+    #     error = weighted mean squared error over the inputs.
+    #     gap = bound on how much error exceeds the optimum of the
+    #       (binned) problem due to tol and stopping early, for p=2.
+    #     n_open_partitions/n_rounds/gaps = see regress_isotonic_2d_l2.
+    #     n_cells = number of occupied grid cells when binning.
+
+    if p != 2 and method != "partition":
+        raise NotImplementedError("method is only implemented for p=2")
+
+    stats = {}
+
+    if max_bins is not None or return_stats:
+        xs = asarray(xs, dtype=float)
+        ys = asarray(ys, dtype=float)
+        vs = asarray(vs, dtype=float)
+        ws = ones(len(xs)) if ws is None else asarray(ws, dtype=float)
+
+        if len(xs) != len(ys) or len(ys) != len(vs) or len(vs) != len(ws):
+            raise ValueError("input lengths do not match")
+
+    if max_bins is not None:
+        if p != 2:
+            raise NotImplementedError("max_bins is only implemented for p=2")
+
+        (bin_xs, bin_ys, bin_vs, bin_ws) = _bin_isotonic_2d(xs, ys, vs, ws, max_bins)
+        stats["n_cells"] = len(bin_vs)
+
+        # the error is computed over the inputs below, not the bins.
+        f = _regress_isotonic_2d_l2_lists(
+            list(bin_xs),
+            list(bin_ys),
+            list(bin_vs),
+            list(bin_ws),
+            n_values=n_values,
+            coarse_bins=coarse_bins,
+            tol=tol,
+            max_rounds=max_rounds,
+            time_budget=time_budget,
+            method=method,
+            stats=stats,
+        )
+    elif p == 1:
         if n_values is not None:
             raise NotImplementedError("n_values is not implemented for p=1")
-        return regress_isotonic_2d_l1(xs=xs, ys=ys, vs=vs, ws=ws)
-    if p == 2:
-        return regress_isotonic_2d_l2(xs=xs, ys=ys, vs=vs, ws=ws, n_values=n_values)
+        if coarse_bins is not None:
+            raise NotImplementedError("coarse_bins is not implemented for p=1")
+        if tol is not None or max_rounds is not None or time_budget is not None:
+            raise NotImplementedError("early stopping is not implemented for p=1")
+        f = regress_isotonic_2d_l1(xs=xs, ys=ys, vs=vs, ws=ws)
+    elif p == inf:
+        if n_values is not None:
+            raise NotImplementedError("n_values is not implemented for p=inf")
+        if coarse_bins is not None:
+            raise NotImplementedError("coarse_bins is not implemented for p=inf")
+        if tol is not None or max_rounds is not None or time_budget is not None:
+            raise NotImplementedError("early stopping is not implemented for p=inf")
+        f = regress_isotonic_2d_linf(xs=xs, ys=ys, vs=vs, ws=ws)
+    elif p == 2:
+        f = regress_isotonic_2d_l2(
+            xs=xs,
+            ys=ys,
+            vs=vs,
+            ws=ws,
+            n_values=n_values,
+            coarse_bins=coarse_bins,
+            tol=tol,
+            max_rounds=max_rounds,
+            time_budget=time_budget,
+            return_stats=return_stats,
+            method=method,
+        )
+        if return_stats:
+            (f, l2_stats) = f
+            stats.update(l2_stats)
+    else:
+        raise ValueError("only L1, L2 and L-infinity norms supported")
+
+    if not return_stats:
+        return f
 
-    raise ValueError("only L1 and L2 norms supported")
+    if "error" not in stats:
+        stats["error"] = _weighted_error(f, xs, ys, vs, ws)
+
+    return (f, stats)
 
 
 def regress_isotonic_2d_l1(xs, ys, vs, ws=None):
@@ -283,12 +991,56 @@ def regress_isotonic_2d_l1(xs, ys, vs, ws=None):
     return _build_output_function(regressed)
 
 
-def regress_isotonic_2d_l2(xs, ys, vs, ws=None, *, n_values=None):
+def regress_isotonic_2d_l2(
+    xs,
+    ys,
+    vs,
+    ws=None,
+    *,
+    n_values=None,
+    coarse_bins=None,
+    tol=None,
+    max_rounds=None,
+    time_budget=None,
+    return_stats=False,
+    method="partition",
+):
     # xs/ys/vs/ws = iterators of values for respective parameters below.
     # x,y = independent variables
     # v = dependent variable
     # w = weight. defaults to 1 if ws is None.
     # where regressed estimates must be isotonic in x and y
+    #
+    # method = "partition" for the partitioning solver below, or
+    #   "dykstra" for Dykstra's alternating projections on the grid of
+    #   distinct x and y values. dykstra is approximate, but each
+    #   iteration is a few vectorized passes over the grid. it stops
+    #   once the gap is at most tol (default 1e-6 times the weighted
+    #   variance of vs), after max_rounds iterations (default 1000), or
+    #   after time_budget seconds. coarse_bins is not supported. it is
+    #   not faster than partition for exact answers, but gives an
+    #   isotonic answer with a bounded gap whenever it is stopped.
+    # coarse_bins = if set, first solve a version binned like
+    #   regress_isotonic_2d(max_bins=coarse_bins), and use its levels
+    #   to guide the exact solution. still exact.
+    # tol = if set, stop refining once regressed values are known
+    #   within tol. approximate, but needs at most log2(range / tol)
+    #   rounds of binary splits.
+    # max_rounds/time_budget = if set, stop splitting after max_rounds
+    #   rounds of binary splits or time_budget seconds, and assign each
+    #   partition still open its weighted mean. approximate, but still
+    #   isotonic. time_budget is checked between binary splits, so one
+    #   slow split can overrun it.
+    # return_stats = if set, return (f, stats) where stats is a dict
+    #   of fit statistics:
+    #     error = weighted mean squared error over the inputs.
+    #     gap = bound on how much error exceeds the optimum due to
+    #       tol and stopping early, before any n_values reduction.
+    #     n_open_partitions = number of partitions still open when
+    #       stopping early.
+    #     n_rounds = number of rounds of binary splits started, unless
+    #       solved as a complete grid, or iterations for dykstra.
+    #     gaps = gap after each iteration for dykstra.
 
     if ws is None:
         ws = itertools.repeat(1.0, len(xs))
@@ -302,7 +1054,58 @@ def regress_isotonic_2d_l2(xs, ys, vs, ws=None, *, n_values=None):
     if len(xs) != len(ys) or len(ys) != len(vs) or len(vs) != len(ws):
         raise ValueError("input lengths do not match")
 
-    # consume input iterators and match their values.
+    stats = {}
+    f = _regress_isotonic_2d_l2_lists(
+        xs,
+        ys,
+        vs,
+        ws,
+        n_values=n_values,
+        coarse_bins=coarse_bins,
+        tol=tol,
+        max_rounds=max_rounds,
+        time_budget=time_budget,
+        method=method,
+        stats=stats,
+    )
+    if not return_stats:
+        return f
+
+    stats["error"] = _weighted_error(
+        f, asarray(xs, dtype=float), asarray(ys, dtype=float), asarray(vs), asarray(ws)
+    )
+
+    return (f, stats)
+
+
+def _regress_isotonic_2d_l2_lists(
+    xs,
+    ys,
+    vs,
+    ws,
+    *,
+    n_values=None,
+    coarse_bins=None,
+    tol=None,
+    max_rounds=None,
+    time_budget=None,
+    method="partition",
+    stats,
+):
+    """
+    Helper function for regress_isotonic_2d_l2 on matching lists of
+    inputs, adding its statistics except the error to stats.
+    """
+
+    if method not in ("partition", "dykstra"):
+        raise ValueError("method must be 'partition' or 'dykstra'")
+    if method == "dykstra" and coarse_bins is not None:
+        raise NotImplementedError("coarse_bins is not implemented for dykstra")
+
+    deadline = None
+    if time_budget is not None:
+        deadline = time.monotonic() + time_budget
+
     inputs = zip(xs, ys, vs, ws)
     inputs = list(inputs)
 
@@ -321,117 +1124,160 @@ def regress_isotonic_2d_l2(xs, ys, vs, ws=None, *, n_values=None):
 
     inputs = [(x, y, values[(x, y)], weights[(x, y)]) for (x, y) in values.keys()]
 
-    # Optimal L2 regressions can not be restricted to input values, so
-    # we can not use the same binary search over input values used for
-    # L1. As noted by Stout, we can split on the L2 norm of the
-    # current partition, and get a split unless there is only one
-    # regression value remaining. This split choice may require n-1
-    # rounds.
+    if method == "dykstra":
+        regressed = _regress_isotonic_2d_l2_dykstra(
+            inputs, tol=tol, max_rounds=max_rounds, deadline=deadline, stats=stats
+        )
+    else:
+        regressed = _regress_isotonic_2d_l2_inputs(
+            inputs,
+            coarse_bins=coarse_bins,
+            tol=tol,
+            max_rounds=max_rounds,
+            deadline=deadline,
+            stats=stats,
+        )
 
-    regressed = {}
+    if n_values is not None:
+        (r_vs, r_ws) = zip(*((regressed[(x, y)], w) for (x, y, v, w) in inputs))
+        reduced = reduce_isotonic_l2(r_vs, r_ws, n_values)
+        regressed = {(x, y): reduced[v] for ((x, y), v) in regressed.items()}
 
-    def partition(partition_inputs):
-        partition_inputs = list(partition_inputs)
+    return _build_output_function(regressed)
 
-        if len(partition_inputs) <= 0:
-            raise RuntimeError("empty partition inputs")
-        if len(partition_inputs) == 1:
-            ((x, y, v, _),) = partition_inputs
-            regressed[(x, y)] = v
-            return
-
-        def try_binary(v_split):
-            # Using epsilon-partitioning from
-            #
-            # Isotonic Regression via Partitioning, section 5.1.
-
-            binary_inputs = []
-            for (x, y, v, w) in partition_inputs:
-                # no pow() in weight formulas since this is L2, so
-                # power would be one.
-                if v <= v_split:
-                    binary_inputs.append((x, y, 0.0, w * (v_split - v)))
-                else:
-                    binary_inputs.append((x, y, 1.0, w * (v - v_split)))
-
-            return _regress_isotonic_2d_l1_binary(binary_inputs, 0.0, 1.0)
-
-        partition_norm = sum(v * w for (_, _, v, w) in partition_inputs) / sum(
-            w for (_, _, _, w) in partition_inputs
-        )
 
-        binary_values = try_binary(partition_norm)
-        if len(set(binary_values.values())) == 1:
-            # no more splits
-            for (x, y, _, _) in partition_inputs:
-                regressed[(x, y)] = partition_norm
-            return
+def regress_isotonic_2d_linf(xs, ys, vs, ws=None):
+    # xs/ys/vs/ws = arrays of values for respective parameters below.
+    # x,y = independent variables
+    # v = dependent variable
+    # w = weight. defaults to 1 if ws is None.
+    # where regressed estimates must be isotonic in x and y
+    #
+    # minimizes the largest w * |r - v|, returning the midpoint of the
+    # smallest and largest optimal regressions.
+    #
+    # the solve takes about 1s for 100k inputs with unequal weights.
+    # building the output function for as many distinct vertexes takes
+    # over 10s more, and dominates the total.
 
-        # recursively split based on the binary regression
+    xs = asarray(xs, dtype=float)
+    ys = asarray(ys, dtype=float)
+    vs = asarray(vs, dtype=float)
+    ws = ones(len(xs)) if ws is None else asarray(ws, dtype=float)
 
-        # low partition
-        partition(r for r in partition_inputs if binary_values[(r[0], r[1])] < 1.0)
+    if len(xs) != len(ys) or len(ys) != len(vs) or len(vs) != len(ws):
+        raise ValueError("input lengths do not match")
 
-        # high partition
-        partition(r for r in partition_inputs if binary_values[(r[0], r[1])] >= 1.0)
+    # zero weights do not constrain the regression.
+    keep = ws != 0.0
+    (xs, ys, vs, ws) = (xs[keep], ys[keep], vs[keep], ws[keep])
+    if len(xs) <= 0:
+        raise ValueError("no regressed values")
 
-    partition(list(inputs))
+    vertexes = unique(column_stack((xs, ys)), axis=0, return_inverse=True)[1]
+    vertexes = vertexes.reshape(-1)
+
+    lower_levels = _dominance_levels(xs, ys)
+    upper_levels = _dominance_levels(-xs, -ys)
+
+    def extremes(eps):
+        lows = vs - eps / ws
+        highs = vs + eps / ws
+
+        t = _dominance_argmax(lower_levels, vertexes, lows)
+        u = _dominance_argmax(upper_levels, vertexes, -highs)
+
+        return (lows, highs, t, u, lows[t] > highs[u])
+
+    # with error eps, each regressed value must be between the largest
+    # v - eps / w below it and the smallest v + eps / w above it. the
+    # optimal eps is the largest eps forced by a pair of inputs t below
+    # u, so raise eps to the largest forced by a violated pair until
+    # none remain. equal weights do not change the midpoints.
+    eps = 0.0
+    equal_weights = (ws == ws[0]).all()
+    for _ in range(_LINF_PASSES):
+        (lows, highs, t, u, violated) = extremes(eps)
+        if equal_weights or not violated.any():
+            break
+
+        (t, u) = (t[violated], u[violated])
+        forced = ((vs[t] - vs[u]) / (1.0 / ws[t] + 1.0 / ws[u])).max()
+        eps = max(forced, nextafter(eps, inf))
+    else:
+        # each pass settles at least one more pair, which is usually
+        # enough after a few passes but has no useful bound. fall back
+        # to bisecting the bits of eps between the infeasible eps and
+        # an eps making every regression value feasible, which takes
+        # at most 64 more passes.
+        low = eps
+        high = max((vs.max() - vs.min()) * ws.max(), nextafter(eps, inf))
+        if not extremes(low)[4].any():
+            high = low
+
+        while nextafter(low, inf) < high:
+            middle = float(
+                array((array(low).view(int64) + array(high).view(int64)) // 2).view(
+                    float
+                )
+            )
+            if extremes(middle)[4].any():
+                low = middle
+            else:
+                high = middle
+
+        (lows, highs, t, u, _) = extremes(high)
+
+    regressed = (lows[t] + highs[u]) / 2.0
+
+    return _build_output_function(
+        dict(zip(zip(xs.tolist(), ys.tolist()), regressed.tolist()))
+    )
+
+
+def regress_isotonic_2d_grid(vs, ws=None, *, xs=None, ys=None, n_values=None):
+    # vs/ws = 2D arrays of values and weights with vs[i][j] at (xs[i], ys[j]).
+    # xs/ys = increasing grid coordinates. default to 0, 1, 2, ...
+    # w = positive weight. defaults to 1 if ws is None.
+    # where regressed estimates must be isotonic in x and y
+
+    vs = asarray(vs, dtype=float)
+    if vs.ndim != 2:
+        raise ValueError("vs must be a 2D array")
+
+    xs = list(range(vs.shape[0])) if xs is None else list(xs)
+    ys = list(range(vs.shape[1])) if ys is None else list(ys)
+
+    if (len(xs), len(ys)) != vs.shape:
+        raise ValueError("grid coordinates do not match vs shape")
+    if any(xs[i] >= xs[i + 1] for i in range(len(xs) - 1)) or any(
+        ys[j] >= ys[j + 1] for j in range(len(ys) - 1)
+    ):
+        raise ValueError("grid coordinates must be increasing")
+
+    grid_regressed = regress_isotonic_grid_l2(vs, ws)
+
+    regressed = {
+        (x, y): grid_regressed[i, j]
+        for (i, x) in enumerate(xs)
+        for (j, y) in enumerate(ys)
+    }
 
     if n_values is not None:
-        (vs, ws) = zip(*((regressed[(x, y)], w) for (x, y, v, w) in inputs))
-        reduced = reduce_isotonic_l2(vs, ws, n_values)
+        grid_weights = [1.0] * vs.size if ws is None else asarray(ws).ravel()
+        reduced = reduce_isotonic_l2(grid_regressed.ravel(), grid_weights, n_values)
         regressed = {(x, y): reduced[v] for ((x, y), v) in regressed.items()}
 
     return _build_output_function(regressed)
 
 
-class Isotonic2dRegression(RegressorMixin, TransformerMixin):
-    """Isotonic 2d regression model.
+def __getattr__(name):
+    # the estimator lives in isotonic2dmodel.py so this module imports
+    # without sklearn, but stays importable from here.
 
-    Interface based on sklearn.isotonic.IsotonicRegression
-    https://github.com/scikit-learn/scikit-learn/blob/main/sklearn/isotonic.py
-    """
-
-    def __init__(self, n_values=None):
-        self.f_ = None
-        self.n_values = n_values
+    if name == "Isotonic2dRegression":
+        from . import isotonic2dmodel
 
-    def fit(self, X, y, sample_weight=None):
-        # TODO: shape checks
-        X = check_array(X)
-        y = check_array(y, ensure_2d=False)
-        self.f_ = regress_isotonic_2d_l2(
-            xs=X[:, 0], ys=X[:, 1], vs=y, ws=sample_weight, n_values=self.n_values
-        )
+        return isotonic2dmodel.Isotonic2dRegression
 
-    def predict(self, T):
-        """Predict new data by bilinear interpolation.
-
-        Parameters
-        ----------
-        T : array-like of shape (n_samples, 2)
-            Data to transform.
-
-        Returns
-        -------
-        y_pred : ndarray of shape (n_samples,)
-            Transformed data.
-        """
-        return self.transform(T)
-
-    def transform(self, T):
-        """Transform new data by bilinear interpolation.
-
-        Parameters
-        ----------
-        T : array-like of shape (n_samples, 2)
-            Data to transform.
-
-        Returns
-        -------
-        y_pred : ndarray of shape (n_samples,)
-            Transformed data.
-        """
-
-        T = check_array(T)
-        return asarray([self.f_(T[i, 0], T[i, 1]) for i in range(T.shape[0])])
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
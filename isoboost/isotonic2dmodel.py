@@ -0,0 +1,121 @@
+# isotonic2dmodel.py
+
+# sklearn estimator for 2d isotonic regression, kept apart from the
+# regression functions in isotonic2d.py so those import without sklearn.
+
+from sklearn.base import RegressorMixin
+from sklearn.base import TransformerMixin
+from sklearn.utils import check_array
+
+from .isotonic2d import regress_isotonic_2d
+
+
+class Isotonic2dRegression(RegressorMixin, TransformerMixin):
+    """Isotonic 2d regression model.
+
+    Interface based on sklearn.isotonic.IsotonicRegression
+    https://github.com/scikit-learn/scikit-learn/blob/main/sklearn/isotonic.py
+    """
+
+    def __init__(
+        self,
+        n_values=None,
+        max_bins=None,
+        tol=None,
+        max_rounds=None,
+        time_budget=None,
+        method="partition",
+    ):
+        self.f_ = None
+        self.stats_ = None
+        self.n_values = n_values
+        self.max_bins = max_bins
+        self.tol = tol
+        self.max_rounds = max_rounds
+        self.time_budget = time_budget
+        self.method = method
+
+    def fit(self, X, y, sample_weight=None):
+        # TODO: shape checks
+        X = check_array(X)
+        y = check_array(y, ensure_2d=False)
+
+        # stats_ reports the accuracy cost of approximate fits. exact fits,
+        # such as the combiners of boosted models, skip the error pass
+        # over the training data and leave stats_ None.
+        approximate = self.method != "partition" or any(
+            a is not None
+            for a in (self.max_bins, self.tol, self.max_rounds, self.time_budget)
+        )
+        result = regress_isotonic_2d(
+            xs=X[:, 0],
+            ys=X[:, 1],
+            vs=y,
+            ws=sample_weight,
+            n_values=self.n_values,
+            max_bins=self.max_bins,
+            tol=self.tol,
+            max_rounds=self.max_rounds,
+            time_budget=self.time_budget,
+            return_stats=approximate,
+            method=self.method,
+        )
+        (self.f_, self.stats_) = result if approximate else (result, None)
+
+    def predict(self, T):
+        """Predict new data by bilinear interpolation.
+
+        Parameters
+        ----------
+        T : array-like of shape (n_samples, 2)
+            Data to transform.
+
+        Returns
+        -------
+        y_pred : ndarray of shape (n_samples,)
+            Transformed data.
+        """
+        return self.transform(T)
+
+    def predict_one(self, x, y):
+        """Predict one point without input validation.
+
+        Returns the same value as predict for the row [x, y], with much
+        less overhead for a single point.
+
+        Parameters
+        ----------
+        x, y : float
+            Features of the point.
+
+        Returns
+        -------
+        y_pred : float
+            Predicted value.
+        """
+
+        return float(self.f_(x, y))
+
+    def predict_row(self, row):
+        """Predict one row without input validation, like
+        predict_one(*row).
+        """
+
+        return self.predict_one(*row)
+
+    def transform(self, T):
+        """Transform new data by bilinear interpolation.
+
+        Parameters
+        ----------
+        T : array-like of shape (n_samples, 2)
+            Data to transform.
+
+        Returns
+        -------
+        y_pred : ndarray of shape (n_samples,)
+            Transformed data.
+        """
+
+        T = check_array(T)
+        return self.f_.__self__.interpolate_array(T[:, 0], T[:, 1])
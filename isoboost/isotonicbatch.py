@@ -0,0 +1,341 @@
+# isotonicbatch.py
+
+# Fitting many independent isotonic regressions at once.
+#
+# Inputs are tagged with a group id, sorted once by group, and each
+# group gets its own regression. 1D groups are regressed together in a
+# few compiled PAVA passes, shifted apart so that no level set spans two
+# groups. 2D groups are regressed separately, optionally in a pool of
+# worker processes.
+
+import concurrent.futures
+import os
+
+from numpy import add
+from numpy import arange
+from numpy import argsort
+from numpy import asarray
+from numpy import concatenate
+from numpy import diff
+from numpy import empty
+from numpy import flatnonzero
+from numpy import lexsort
+from numpy import maximum
+from numpy import minimum
+from numpy import ones
+from numpy import repeat
+from numpy import searchsorted
+from numpy import unique
+
+from .isotonic2d import regress_isotonic_2d_l2
+from .piecewise import PiecewiseLinear
+
+# each compiled PAVA pass covers at most this many 1D groups, bounding
+# rounding errors from shifting the groups apart.
+_PAVA_GROUPS = 1024
+
+
+def _check_batch_inputs(groups, columns, ws):
+    """
+    Helper function converting batch inputs to arrays of the same
+    length, and dropping inputs with zero weight. Returns (keys, codes,
+    columns, ws) where keys are the sorted distinct groups left, and
+    codes index keys for each input left.
+    """
+
+    groups = asarray(groups)
+    columns = [asarray(c, dtype=float) for c in columns]
+    ws = ones(len(groups)) if ws is None else asarray(ws, dtype=float)
+
+    if groups.ndim != 1 or any(c.shape != groups.shape for c in columns + [ws]):
+        raise ValueError("input lengths do not match")
+
+    keep = ws != 0.0
+    (keys, codes) = unique(groups[keep], return_inverse=True)
+
+    return (keys, codes.reshape(-1), [c[keep] for c in columns], ws[keep])
+
+
+def _group_starts(codes):
+    """
+    Helper function returning where each run of equal codes starts,
+    followed by the total length.
+    """
+
+    if len(codes) == 0:
+        return asarray([0])
+
+    return concatenate(([0], flatnonzero(diff(codes)) + 1, [len(codes)]))
+
+
+def _regress_groups_1d(starts, values, weights):
+    """
+    Helper function for weighted L2 isotonic regression of consecutive
+    groups of values separately. Group i covers starts[i]:starts[i+1].
+    """
+
+    from sklearn.isotonic import isotonic_regression
+
+    output = empty(len(values))
+    for i in range(0, len(starts) - 1, _PAVA_GROUPS):
+        chunk = starts[i : i + _PAVA_GROUPS + 1]
+        (start, end) = (chunk[0], chunk[-1])
+        chunk_values = values[start:end]
+
+        # scale each group to [0, 1] and shift it above the previous one,
+        # so PAVA never pools values from different groups, and groups
+        # with small ranges keep their precision next to wide ones.
+        lows = minimum.reduceat(chunk_values, chunk[:-1] - start)
+        spans = maximum.reduceat(chunk_values, chunk[:-1] - start) - lows
+        spans[spans <= 0.0] = 1.0
+        (lows, spans) = (repeat(lows, diff(chunk)), repeat(spans, diff(chunk)))
+        shifts = repeat(2.0 * arange(len(chunk) - 1), diff(chunk))
+
+        regressed = isotonic_regression(
+            (chunk_values - lows) / spans + shifts, sample_weight=weights[start:end]
+        )
+        output[start:end] = (regressed - shifts) * spans + lows
+
+    return output
+
+
+def _regress_group_2d(inputs):
+    """
+    Helper function regressing one 2D group in a worker process.
+    """
+
+    return regress_isotonic_2d_l2(*inputs)
+
+
+def _effective_n_jobs(n_jobs):
+    """
+    Helper function resolving n_jobs like scikit-learn. None means 1,
+    and negative values count back from the number of CPUs.
+    """
+
+    if n_jobs is None:
+        return 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs must not be zero")
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+
+    return n_jobs
+
+
+class IsotonicBatch:
+    """Independent isotonic regressions, one for each group.
+
+    Returned by regress_isotonic_1d_batch and
+    regress_isotonic_2d_l2_batch. batch[group] is the output function of
+    one group, and predict evaluates many groups in one call.
+
+    Attributes
+    ----------
+    ndim : int
+        Number of independent variables.
+    keys : ndarray of shape (n_groups,)
+        Sorted groups with a regression.
+    """
+
+    def __init__(self, ndim, keys, models):
+        # models = for ndim=1, (starts, xs, values) arrays of the knots
+        #   of all groups, with group i using knots starts[i]:starts[i+1].
+        #   for ndim=2, list of output functions in the order of keys.
+
+        self.ndim = ndim
+        self.keys = keys
+        self.models_ = models
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __contains__(self, group):
+        i = searchsorted(self.keys, group)
+        return bool(i < len(self.keys) and self.keys[i] == group)
+
+    def __getitem__(self, group):
+        if group not in self:
+            raise KeyError(group)
+
+        i = int(searchsorted(self.keys, group))
+        if self.ndim == 2:
+            return self.models_[i]
+
+        (starts, xs, values) = self.models_
+        (start, end) = (starts[i], starts[i + 1])
+
+        return PiecewiseLinear(zip(xs[start:end], values[start:end])).interpolate
+
+    def _group_codes(self, groups):
+        """Helper function returning the index in keys of each group."""
+
+        groups = asarray(groups)
+        codes = minimum(searchsorted(self.keys, groups), max(len(self.keys) - 1, 0))
+        if len(groups) and (len(self.keys) == 0 or (self.keys[codes] != groups).any()):
+            raise ValueError("unknown group")
+
+        return codes
+
+    def predict(self, groups, xs, ys=None):
+        """Predict new data with the regression of each group.
+
+        Parameters
+        ----------
+        groups : array-like of shape (n_samples,)
+            Group of each sample. Every group must have a regression.
+        xs : array-like of shape (n_samples,)
+            First independent variable of each sample.
+        ys : array-like of shape (n_samples,), default=None
+            Second independent variable of each sample. Required if and
+            only if ndim is 2.
+
+        Returns
+        -------
+        y_pred : ndarray of shape (n_samples,)
+            Predicted values, matching batch[group](x) or
+            batch[group](x, y).
+        """
+
+        codes = self._group_codes(groups)
+        xs = asarray(xs, dtype=float)
+        if (ys is None) != (self.ndim == 1):
+            raise ValueError("ys must be given exactly for 2D regressions")
+        if xs.shape != codes.shape:
+            raise ValueError("input lengths do not match")
+
+        if self.ndim == 2:
+            ys = asarray(ys, dtype=float)
+            if ys.shape != codes.shape:
+                raise ValueError("input lengths do not match")
+
+            output = empty(len(xs))
+            order = argsort(codes, kind="stable")
+            bounds = _group_starts(codes[order])
+            for i in range(len(bounds) - 1):
+                indexes = order[bounds[i] : bounds[i + 1]]
+                f = self.models_[codes[indexes[0]]]
+                output[indexes] = f.__self__.interpolate_array(xs[indexes], ys[indexes])
+
+            return output
+
+        (starts, knot_xs, knot_values) = self.models_
+        knot_codes = repeat(arange(len(self.keys)), diff(starts))
+
+        # find the knots at or below each x within its group, by ranking
+        # all xs together and searching (group, rank) keys.
+        (_, ranks) = unique(concatenate((knot_xs, xs)), return_inverse=True)
+        ranks = ranks.reshape(-1)
+        n_ranks = len(ranks) + 1
+        i = searchsorted(
+            knot_codes * n_ranks + ranks[: len(knot_xs)],
+            codes * n_ranks + ranks[len(knot_xs) :],
+            side="right",
+        )
+
+        (start, end) = (starts[codes], starts[codes + 1])
+        lower = maximum(i - 1, start)
+        upper = minimum(i, end - 1)
+
+        output = knot_values[lower]
+        inner = lower != upper
+        (x0, x1) = (knot_xs[lower[inner]], knot_xs[upper[inner]])
+        (v0, v1) = (output[inner], knot_values[upper[inner]])
+        output[inner] = v0 + (v1 - v0) * (xs[inner] - x0) / (x1 - x0)
+
+        return output
+
+
+def regress_isotonic_1d_batch(groups, xs, vs, ws=None):
+    # groups = iterator of the group of each input. any sortable values.
+    # xs/vs/ws = iterators of values for respective parameters below.
+    # x = independent variable
+    # v = dependent variable
+    # w = weight. defaults to 1 if ws is None.
+    # where regressed estimates must be isotonic in x within each group
+    #
+    # returns an IsotonicBatch whose output function for each group
+    # matches regress_isotonic_1d on the inputs of that group. inputs
+    # with zero weight are ignored, and groups without other inputs
+    # have no regression.
+
+    (keys, codes, (xs, vs), ws) = _check_batch_inputs(groups, (xs, vs), ws)
+
+    # sort once by group and x, and merge repeated independent variables.
+
+    order = lexsort((xs, codes))
+    (codes, xs, vws, ws) = (codes[order], xs[order], (vs * ws)[order], ws[order])
+
+    is_new = ones(len(xs), dtype=bool)
+    is_new[1:] = (codes[1:] != codes[:-1]) | (xs[1:] != xs[:-1])
+    distinct = flatnonzero(is_new)
+    if len(distinct) > 0:
+        (vws, ws) = (add.reduceat(vws, distinct), add.reduceat(ws, distinct))
+    (codes, xs) = (codes[distinct], xs[distinct])
+
+    keep = ws != 0.0
+    (codes, xs, vws, ws) = (codes[keep], xs[keep], vws[keep], ws[keep])
+
+    (used, codes) = unique(codes, return_inverse=True)
+    keys = keys[used]
+    codes = codes.reshape(-1)
+
+    starts = _group_starts(codes)
+    values = _regress_groups_1d(starts, vws / ws, ws)
+
+    # only keep the ends of level sets.
+    is_knot = ones(len(values), dtype=bool)
+    is_knot[1:-1] = (values[1:-1] != values[:-2]) | (values[1:-1] != values[2:])
+    is_knot[starts[:-1]] = True
+    is_knot[starts[1:] - 1] = True
+
+    knot_starts = searchsorted(flatnonzero(is_knot), starts)
+
+    return IsotonicBatch(1, keys, (knot_starts, xs[is_knot], values[is_knot]))
+
+
+def regress_isotonic_2d_l2_batch(groups, xs, ys, vs, ws=None, *, n_jobs=None):
+    # groups = iterator of the group of each input. any sortable values.
+    # xs/ys/vs/ws = iterators of values for respective parameters below.
+    # x,y = independent variables
+    # v = dependent variable
+    # w = weight. defaults to 1 if ws is None.
+    # where regressed estimates must be isotonic in x and y within each
+    # group
+    #
+    # n_jobs = number of worker processes regressing groups. None means
+    #   1, regressing in this process, and -1 means one per CPU.
+    #
+    # returns an IsotonicBatch whose output function for each group
+    # matches regress_isotonic_2d_l2 on the inputs of that group. inputs
+    # with zero weight are ignored, and groups without other inputs
+    # have no regression.
+
+    (keys, codes, (xs, ys, vs), ws) = _check_batch_inputs(groups, (xs, ys, vs), ws)
+    n_jobs = _effective_n_jobs(n_jobs)
+
+    order = argsort(codes, kind="stable")
+    starts = _group_starts(codes[order])
+    tasks = []
+    for i in range(len(starts) - 1):
+        indexes = order[starts[i] : starts[i + 1]]
+        tasks.append(
+            (
+                xs[indexes].tolist(),
+                ys[indexes].tolist(),
+                vs[indexes].tolist(),
+                ws[indexes].tolist(),
+            )
+        )
+
+    if n_jobs == 1 or len(tasks) <= 1:
+        models = [_regress_group_2d(t) for t in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_jobs) as executor:
+            chunksize = max(len(tasks) // (4 * n_jobs), 1)
+            models = list(executor.map(_regress_group_2d, tasks, chunksize=chunksize))
+
+    return IsotonicBatch(2, keys, models)
@@ -1,14 +1,73 @@
 # isotonicboost.py
 
+import concurrent.futures
+import hashlib
 import logging
+import warnings
+from itertools import islice
+from numbers import Integral
 
+from numpy import ascontiguousarray
 from numpy import asarray
-from numpy import hstack
+from numpy import column_stack
+from numpy import inf
+from numpy import ones
+from numpy import sort
+from numpy.random import RandomState
+from scipy.sparse import issparse
 from sklearn.base import RegressorMixin
 from sklearn.ensemble import BaseEnsemble
 from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.utils import _safe_indexing
+from sklearn.utils import check_random_state
 
-from .isotonic2d import Isotonic2dRegression
+from . import checkpoint
+from .isotonic2dmodel import Isotonic2dRegression
+from .isotonicbatch import _effective_n_jobs
+from .piecewise import PiecewiseBilinearChain
+
+
+def _weighted_mse(y, predictions, weights):
+    """
+    Helper function returning the weighted mean squared error of
+    predictions.
+    """
+
+    return float((weights * (y - predictions) ** 2).sum() / weights.sum())
+
+
+def _fingerprint(*arrays):
+    """
+    Helper function returning a digest of the contents of arrays, or
+    None if they are not all dense numeric arrays or None.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        if a is not None:
+            if issparse(a):
+                return None
+            a = ascontiguousarray(a)
+            if a.dtype.hasobject:
+                return None
+            digest.update(repr((a.dtype.str, a.shape)).encode())
+            digest.update(a.view("u1").ravel())
+        digest.update(repr(a is None).encode())
+
+    return digest.hexdigest()
+
+
+def _take_rows(rows, *arrays):
+    """
+    Helper function selecting rows of each array, or all rows if rows is
+    None. None arrays are passed through.
+    """
+
+    if rows is None:
+        return arrays
+
+    return tuple(None if a is None else _safe_indexing(a, rows) for a in arrays)
 
 
 class IsotonicBoostRegressor(RegressorMixin, BaseEnsemble):
@@ -23,67 +82,452 @@ class IsotonicBoostRegressor(RegressorMixin, BaseEnsemble):
     Code loosely based on AdaBoostRegressor at
     https://github.com/scikit-learn/scikit-learn/blob/main/sklearn/ensemble/_weight_boosting.py
 
+    Parameters
+    ----------
+    estimator : object, default=None
+        Base estimator fitted to the residuals of each stage.
+    n_estimators : int, default=50
+        Maximum number of stages, counting the initial model.
+    estimator_params : tuple of str, default=tuple()
+        Attributes of this model copied to each base estimator.
+    warm_start : bool, default=False
+        If set, fit keeps the stages of the previous fit and adds more
+        until there are n_estimators. The training predictions of the
+        previous fit are reused if the training data is the same, and
+        recomputed otherwise.
+    validation_fraction : float, default=0.1
+        Fraction of the training data held out for early stopping. Only
+        used if n_iter_no_change is set.
+    n_iter_no_change : int, default=None
+        If set, stop adding stages once the weighted mean squared error
+        on the held out data has not improved by more than tol for
+        n_iter_no_change stages, and keep the stages up to the best one.
+    tol : float, default=1e-4
+        Minimum improvement of the validation error for early stopping.
+    subsample : float, default=1.0
+        Fraction of the training rows used to fit the base estimator and
+        the combiner of each stage, sampled without replacement. All rows
+        are still predicted. Below 1, the training loss may increase.
+    random_state : int, RandomState instance or None, default=None
+        Controls the held out data and the subsamples. An int seeds the
+        subsample of each stage from the stage index. Use an int with
+        warm_start or checkpoint_dir, so that the same rows are held out
+        and subsampled as in one uninterrupted fit.
+    checkpoint_dir : str, default=None
+        If set, each completed stage is saved in this directory with
+        the training predictions, score and validation error after it,
+        and fit resumes after the last saved stage, like warm_start. The
+        training data must be the same as in the interrupted fit. Early
+        stopping is replayed over the saved validation errors. Stages
+        after the best one for early stopping are kept in the directory.
+    n_jobs : int, default=None
+        Number of threads predicting with the base estimators, before
+        the combiners run in sequence. None means 1, and -1 means one
+        per CPU.
+    base_estimator : object, default="deprecated"
+        Deprecated alias of estimator, used if estimator is None.
     """
 
     def __init__(
-        self, base_estimator=None, *, n_estimators=50, estimator_params=tuple(),
+        self,
+        estimator=None,
+        *,
+        n_estimators=50,
+        estimator_params=tuple(),
+        warm_start=False,
+        validation_fraction=0.1,
+        n_iter_no_change=None,
+        tol=1e-4,
+        subsample=1.0,
+        random_state=None,
+        checkpoint_dir=None,
+        n_jobs=None,
+        base_estimator="deprecated",
     ):
         super().__init__(
-            base_estimator=base_estimator,
+            estimator=estimator,
             n_estimators=n_estimators,
             estimator_params=estimator_params,
         )
+        self.warm_start = warm_start
+        self.validation_fraction = validation_fraction
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.subsample = subsample
+        self.random_state = random_state
+        self.checkpoint_dir = checkpoint_dir
+        self.n_jobs = n_jobs
+        self.base_estimator = base_estimator
+
+    def _validate_estimator(self, default=None):
+        """Helper function setting estimator_, falling back to the
+        deprecated base_estimator.
+        """
+
+        if isinstance(self.base_estimator, str) and self.base_estimator == "deprecated":
+            return super()._validate_estimator(default)
+        if self.estimator is not None:
+            raise ValueError("set only estimator, not base_estimator")
+
+        warnings.warn(
+            "base_estimator is deprecated, use estimator instead", FutureWarning
+        )
+        self.estimator_ = self.base_estimator
 
     def fit(self, X, y, sample_weight=None):
         self._validate_estimator()
+        if not 0.0 < self.subsample <= 1.0:
+            raise ValueError("subsample must be in (0, 1]")
+        y = asarray(y, dtype=float)
+        self.chain_ = None
+
+        if not self.warm_start or not hasattr(self, "estimators_"):
+            self.estimators_ = []
+            self.isotonic_regressions = []
+            self.train_predictions_ = None
+            self.train_scores_ = []
+            self._train_fingerprint = None
+        elif self.n_estimators < len(self.estimators_):
+            raise ValueError(
+                "n_estimators must be at least the number of fitted stages "
+                "with warm_start"
+            )
+
+        validation = None
+        if self.n_iter_no_change is not None:
+            (X, y, sample_weight, validation) = self._split_validation(
+                X, y, sample_weight
+            )
 
-        self.estimators_ = []
-        self.isotonic_regressions = []
+        fingerprint = _fingerprint(X, y, sample_weight)
+        resumed_errors = None
+        if self.checkpoint_dir is not None and not self.estimators_:
+            resumed_errors = self._resume_checkpoint(len(y))
+            # checkpoints are only resumed with the same training data.
+            self._train_fingerprint = fingerprint
 
         predictions = 0.0
-        for iboost in range(self.n_estimators):
+        if self.estimators_:
+            # cached predictions only match the same training rows.
+            predictions = self.train_predictions_
+            if (
+                predictions is None
+                or fingerprint is None
+                or fingerprint != getattr(self, "_train_fingerprint", None)
+            ):
+                predictions = self.predict(X)
+        self._train_fingerprint = fingerprint
+
+        if validation:
+            (X_val, y_val, w_val) = validation
+            val_predictions = self.predict(X_val) if self.estimators_ else None
+
+            self.validation_errors_ = []
+            best_error = inf
+            best_stages = len(self.estimators_)
+            best_predictions = predictions
+            stopped = False
+            if resumed_errors and None not in resumed_errors:
+                # replay early stopping over the resumed stages, so the fit
+                # can still stop and cut back like an uninterrupted one.
+                for (i, error) in enumerate(resumed_errors):
+                    self.validation_errors_.append(error)
+                    if error < best_error - self.tol:
+                        best_error = error
+                        best_stages = i + 1
+                    elif i + 1 - best_stages >= self.n_iter_no_change:
+                        stopped = True
+                        break
+                if best_stages < len(self.estimators_):
+                    best_predictions = None
+            elif self.estimators_:
+                best_error = _weighted_mse(y_val, val_predictions, w_val)
+
+        start = len(self.estimators_)
+        if self.train_scores_ and self.train_scores_[-1] >= 1.0:
+            start = self.n_estimators
+        if validation and stopped:
+            start = self.n_estimators
+
+        for iboost in range(start, self.n_estimators):
             previous_predictions = asarray(predictions)
 
+            # fit this stage on a subsample, but predict all rows.
+            rows = self._subsample_rows(iboost, len(y))
+
             delta_estimator = self._make_estimator()
-            delta_estimator.fit(
-                X, y - previous_predictions, sample_weight=sample_weight
+            (X_fit, residuals_fit, w_fit) = _take_rows(
+                rows, X, y - previous_predictions, sample_weight
             )
+            delta_estimator.fit(X_fit, residuals_fit, sample_weight=w_fit)
             delta_predictions = delta_estimator.predict(X)
+            isotonic_regression = None
             if iboost == 0:
                 predictions = delta_predictions
-                logging.info(
-                    "IsotonicBoostRegressor.fit() score %.6f after initial model",
-                    r2_score(predictions, y),
-                )
-                continue
+            else:
+                isotonic_X = column_stack((previous_predictions, delta_predictions))
+                isotonic_regression = Isotonic2dRegression()
+                isotonic_regression.fit(*_take_rows(rows, isotonic_X, y, sample_weight))
+                self.isotonic_regressions.append(isotonic_regression)
 
-            isotonic_X = hstack((previous_predictions, delta_predictions))
-            isotonic_regression = Isotonic2dRegression()
-            isotonic_regression.fit(isotonic_X, y, sample_weight)
-            self.isotonic_regressions.append(isotonic_regression)
+                predictions = isotonic_regression.predict(isotonic_X)
 
-            predictions = isotonic_regression.predict(isotonic_X)
+            self.train_predictions_ = predictions
 
-            score = r2_score(predictions, y)
+            score = r2_score(y, predictions)
+            self.train_scores_.append(score)
             logging.info(
                 "IsotonicBoostRegressor.fit() score %.6f after %d models",
                 score,
                 iboost + 1,
             )
+
+            error = None
+            if validation:
+                # validation predictions are updated one stage at a time.
+                val_delta = delta_estimator.predict(X_val)
+                if iboost == 0:
+                    val_predictions = val_delta
+                else:
+                    val_predictions = isotonic_regression.predict(
+                        column_stack((val_predictions, val_delta))
+                    )
+
+                error = _weighted_mse(y_val, val_predictions, w_val)
+                self.validation_errors_.append(error)
+
+            if self.checkpoint_dir is not None:
+                checkpoint.save_stage(
+                    self.checkpoint_dir,
+                    iboost,
+                    (delta_estimator, isotonic_regression, error),
+                    predictions,
+                    score,
+                )
+
+            if validation:
+                if error < best_error - self.tol:
+                    best_error = error
+                    best_stages = iboost + 1
+                    best_predictions = predictions
+                elif iboost + 1 - best_stages >= self.n_iter_no_change:
+                    logging.info(
+                        "IsotonicBoostRegressor.fit() stopping after %d models",
+                        iboost + 1,
+                    )
+                    break
+
             if score >= 1.0:
                 break
 
-    def predict(self, X):
-        predictions = 0
-        for iboost in range(len(self.estimators_)):
-            previous_predictions = predictions
+        if validation and best_stages < len(self.estimators_):
+            # truncate to the stage with the best validation error.
+            if best_predictions is None:
+                best_predictions = self.predict(X, n_stages=best_stages)
+            self.estimators_[best_stages:] = []
+            self.isotonic_regressions[max(best_stages - 1, 0) :] = []
+            self.train_predictions_ = best_predictions
+            self.train_scores_[best_stages:] = []
+
+        return self
+
+    def _resume_checkpoint(self, n):
+        """Helper function loading the stages completed in checkpoint_dir,
+        up to n_estimators. Saved training predictions are dropped unless
+        there are n of them. Returns the validation error saved with each
+        stage, None for stages fitted without early stopping.
+        """
+
+        (stages, predictions, scores) = checkpoint.load_stages(self.checkpoint_dir)
+        if len(stages) > self.n_estimators:
+            (stages, predictions) = (stages[: self.n_estimators], None)
+        if predictions is not None and len(predictions) != n:
+            predictions = None
+
+        if stages:
+            logging.info(
+                "IsotonicBoostRegressor.fit() resuming after %d models", len(stages)
+            )
+
+        self.estimators_ = [e for (e, _, _) in stages]
+        self.isotonic_regressions = [r for (_, r, _) in stages[1:]]
+        self.train_predictions_ = predictions
+        self.train_scores_ = scores[: len(stages)]
+
+        return [error for (_, _, error) in stages]
+
+    def _subsample_rows(self, i, n):
+        """Helper function returning the sorted rows fitting stage i, or
+        None for all rows.
+        """
+
+        if self.subsample >= 1.0:
+            return None
+
+        # seeding each stage from its index lets warm started and resumed
+        # fits draw the same rows as one uninterrupted fit.
+        if isinstance(self.random_state, Integral):
+            rng = RandomState([self.random_state, i])
+        else:
+            rng = check_random_state(self.random_state)
+
+        size = max(int(round(self.subsample * n)), 1)
+        return sort(rng.choice(n, size=size, replace=False))
+
+    def _split_validation(self, X, y, sample_weight):
+        """Helper function holding out validation_fraction of the training
+        data. Returns (X, y, sample_weight, (X_val, y_val, w_val)).
+        """
+
+        if sample_weight is None:
+            sample_weight = ones(len(y))
+
+        (X, X_val, y, y_val, sample_weight, w_val) = train_test_split(
+            X,
+            y,
+            asarray(sample_weight, dtype=float),
+            test_size=self.validation_fraction,
+            random_state=self.random_state,
+        )
+
+        return (X, y, sample_weight, (X_val, y_val, w_val))
 
-            delta_predictions = self.estimators_[iboost].predict(X)
+    def staged_predict(self, X):
+        """Return predictions for X after each stage.
+
+        Each stage reuses the predictions of the previous stage, so
+        predicting after every stage costs the same as predicting after
+        the last one.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples, n_features)
+            Data to predict.
+
+        Models loaded by load_model predict with the compiled chain, so
+        stages pruned by compile only clip their input.
+
+        Yields
+        ------
+        y_pred : ndarray of shape (n_samples,)
+            Predictions after each stage, starting with the initial
+            model.
+        """
+
+        return self._staged_predict(X, len(self.estimators_))
+
+    def _staged_predict(self, X, n_stages):
+        """Helper function yielding predictions for X after each of the
+        first n_stages stages.
+        """
+
+        if self.isotonic_regressions is None:
+            # models loaded by load_model only keep the compiled chain.
+            yield from self._staged_predict_chain(X, n_stages)
+            return
+
+        estimators = self.estimators_[:n_stages]
+        if _effective_n_jobs(self.n_jobs) > 1:
+            deltas = iter(self._predict_estimators(X, estimators))
+        else:
+            deltas = (e.predict(X) for e in estimators)
+
+        predictions = None
+        for (iboost, delta_predictions) in enumerate(deltas):
             if iboost == 0:
                 predictions = delta_predictions
             else:
                 predictions = self.isotonic_regressions[iboost - 1].predict(
-                    hstack((previous_predictions, delta_predictions))
+                    column_stack((predictions, delta_predictions))
                 )
 
+            yield predictions
+
+    def predict(self, X, n_stages=None):
+        """Predict X using the first n_stages stages.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples, n_features)
+            Data to predict.
+        n_stages : int, default=None
+            Number of stages to use, counting the initial model. Defaults
+            to all stages, using the compiled chain if compile was called.
+
+        Returns
+        -------
+        y_pred : ndarray of shape (n_samples,)
+            Predictions after n_stages stages.
+        """
+
+        if n_stages is None:
+            if self.chain_ is not None:
+                return self._predict_chain(X)
+            n_stages = len(self.estimators_)
+        if n_stages < 1 or n_stages > len(self.estimators_):
+            raise ValueError("n_stages must be between 1 and the number of stages")
+
+        for predictions in self._staged_predict(X, n_stages):
+            pass
+
+        return predictions
+
+    def compile(self, tol=0.0):
+        """Flatten the combiners into one PiecewiseBilinearChain used by
+        predict.
+
+        Combiners changing the previous predictions by at most tol are
+        pruned to clipping them, and their base estimators are skipped.
+        Fitting again discards the compiled chain.
+
+        Parameters
+        ----------
+        tol : float, default=0.0
+            Largest change of a pruned combiner's output.
+
+        Returns
+        -------
+        self : object
+            Compiled model.
+        """
+
+        self.chain_ = PiecewiseBilinearChain(
+            [r.f_.__self__ for r in self.isotonic_regressions], tol=tol
+        )
+
+        return self
+
+    def _predict_chain(self, X):
+        """Helper function predicting X with the compiled chain."""
+
+        for predictions in self._staged_predict_chain(X, len(self.estimators_)):
+            pass
+
         return predictions
+
+    def _staged_predict_chain(self, X, n_stages):
+        """Helper function yielding predictions for X with the compiled
+        chain after each of the first n_stages stages.
+        """
+
+        kept = [True] + list(self.chain_.kept[: n_stages - 1])
+        estimators = [e for (e, k) in zip(self.estimators_, kept) if k]
+        deltas = iter(self._predict_estimators(X, estimators))
+
+        xs = next(deltas)
+        ys = [next(deltas) if k else None for k in kept[1:]]
+
+        yield xs
+        yield from islice(self.chain_.staged_interpolate_array(xs, ys), n_stages - 1)
+
+    def _predict_estimators(self, X, estimators):
+        """Helper function predicting X with each base estimator, in a
+        pool of n_jobs threads if n_jobs is set.
+        """
+
+        n_jobs = _effective_n_jobs(self.n_jobs)
+        if n_jobs <= 1 or len(estimators) <= 1:
+            return [e.predict(X) for e in estimators]
+
+        with concurrent.futures.ThreadPoolExecutor(n_jobs) as executor:
+            return list(executor.map(lambda e: e.predict(X), estimators))
@@ -0,0 +1,301 @@
+# isotonicgrid.py
+
+# Dense array solvers for 2D isotonic regression on complete grids.
+#
+# Cell (i, j) of a grid is dominated by every cell (i', j') with i' >= i
+# and j' >= j, so regressed values must be non-decreasing along both
+# axes.
+
+import time
+
+import numpy
+
+# alternating projections stop at this gap relative to the weighted
+# variance of the values, or after this many iterations, by default.
+_DYKSTRA_TOL = 1e-6
+_DYKSTRA_MAX_ITER = 1000
+
+# rows regressed together in one PAVA pass are shifted apart, losing up
+# to log2 of this many bits of precision.
+_GRID_ROW_CHUNK = 256
+
+
+def _regress_isotonic_grid_binary(a_errors, b_errors):
+    """Helper function used for L2 regression on grids. Returns a
+    boolean grid marking the cells regressed to the higher of two
+    values.
+
+    a_errors[i, j] and b_errors[i, j] are the errors from regressing
+    cell (i, j) to the lower and higher value respectively.
+
+    The cells using the higher value form an upset, so each row i is
+    described by a threshold t_i where cells j >= t_i use the higher
+    value, and the thresholds are non-increasing in i. Ties are broken
+    towards the lowest thresholds, so a partition with a single level
+    set is never split.
+    """
+
+    (n_x, n_y) = a_errors.shape
+
+    # row_errors[i, t] is the error of row i using threshold t.
+
+    zeros = numpy.zeros((n_x, 1))
+    a_prefix = numpy.hstack((zeros, numpy.cumsum(a_errors, axis=1)))
+    b_suffix = numpy.hstack((numpy.cumsum(b_errors[:, ::-1], axis=1)[:, ::-1], zeros))
+    row_errors = a_prefix + b_suffix
+
+    # min_error[i, t] is the minimum error of rows 0..i where row i
+    # uses threshold t, so earlier rows use thresholds >= t.
+
+    min_error = numpy.empty_like(row_errors)
+    min_error[0] = row_errors[0]
+    for i in range(1, n_x):
+        suffix_min = numpy.minimum.accumulate(min_error[i - 1, ::-1])[::-1]
+        min_error[i] = row_errors[i] + suffix_min
+
+    # reverse error optimization to get thresholds. errors summed in
+    # different orders may differ by rounding, so near ties are
+    # treated as ties.
+
+    tolerance = 1e-9 * (a_errors.sum() + b_errors.sum())
+
+    thresholds = numpy.empty(n_x, dtype=int)
+    t_min = 0
+    for i in range(n_x - 1, -1, -1):
+        candidates = min_error[i, t_min:]
+        t_min += int(numpy.argmax(candidates <= candidates.min() + tolerance))
+        thresholds[i] = t_min
+
+    return numpy.arange(n_y)[numpy.newaxis, :] >= thresholds[:, numpy.newaxis]
+
+
+def regress_isotonic_grid_l2(values, weights=None):
+    """Weighted L2 isotonic regression of a complete grid.
+
+    Follows the same partitioning approach as regress_isotonic_2d_l2,
+    but each binary split is solved by a dynamic program over grid
+    rows using dense arrays.
+
+    Parameters
+    ----------
+    values : array-like of shape (n_x, n_y)
+        Value of each grid cell.
+    weights : array-like of shape (n_x, n_y), default=None
+        Positive weight of each grid cell. Defaults to 1.
+
+    Returns
+    -------
+    regressed : ndarray of shape (n_x, n_y)
+        Regressed value of each grid cell.
+    """
+
+    values = numpy.asarray(values, dtype=float)
+    if weights is None:
+        weights = numpy.ones_like(values)
+    weights = numpy.asarray(weights, dtype=float)
+
+    if values.ndim != 2 or values.size <= 0:
+        raise ValueError("values must be a non-empty 2D array")
+    if weights.shape != values.shape:
+        raise ValueError("weights must match the shape of values")
+    if not (weights > 0.0).all():
+        raise ValueError("weights must be positive")
+
+    n_y = values.shape[1]
+    flat_values = values.ravel()
+    flat_weights = weights.ravel()
+
+    regressed = numpy.empty_like(flat_values)
+
+    # partitions are arrays of flat cell indexes.
+    partition_queue = [numpy.arange(flat_values.size)]
+    while partition_queue:
+        cells = partition_queue.pop()
+
+        partition_values = flat_values[cells]
+        partition_weights = flat_weights[cells]
+        partition_norm = (partition_values * partition_weights).sum() / (
+            partition_weights.sum()
+        )
+
+        if partition_values.min() == partition_values.max():
+            # single value, so no more splits possible.
+            regressed[cells] = partition_values[0]
+            continue
+
+        # restrict the binary problem to the rows and columns touching
+        # this partition. cells outside the partition get zero errors
+        # either way, so they do not change the optimal upset within
+        # the partition.
+
+        (cell_rows, cell_cols) = numpy.divmod(cells, n_y)
+        (rows, sub_rows) = numpy.unique(cell_rows, return_inverse=True)
+        (cols, sub_cols) = numpy.unique(cell_cols, return_inverse=True)
+
+        # epsilon-partitioning as in regress_isotonic_2d_l2.
+        deltas = partition_weights * (partition_values - partition_norm)
+
+        a_errors = numpy.zeros((len(rows), len(cols)))
+        b_errors = numpy.zeros((len(rows), len(cols)))
+        a_errors[sub_rows, sub_cols] = numpy.maximum(deltas, 0.0)
+        b_errors[sub_rows, sub_cols] = numpy.maximum(-deltas, 0.0)
+
+        high = _regress_isotonic_grid_binary(a_errors, b_errors)[sub_rows, sub_cols]
+
+        n_high = numpy.count_nonzero(high)
+        if n_high == 0 or n_high == len(cells):
+            # no more splits
+            regressed[cells] = partition_norm
+            continue
+
+        partition_queue.append(cells[~high])
+        partition_queue.append(cells[high])
+
+    return regressed.reshape(values.shape)
+
+
+def _regress_isotonic_grid_rows(values, weights):
+    """Helper function for weighted L2 isotonic regression of each grid
+    row separately. Rows are scaled to [0, 1] and regressed in compiled
+    PAVA passes over chunks of rows, shifted apart so that no level set
+    spans two rows. Chunking bounds the precision lost to the shifts
+    independently of the grid size.
+    """
+
+    from sklearn.isotonic import isotonic_regression
+
+    (n_x, n_y) = values.shape
+
+    lows = values.min(axis=1, keepdims=True)
+    spans = values.max(axis=1, keepdims=True) - lows
+    spans[spans <= 0.0] = 1.0
+    scaled = (values - lows) / spans
+
+    regressed = numpy.empty_like(scaled)
+    offsets = 2.0 * numpy.arange(min(n_x, _GRID_ROW_CHUNK))[:, numpy.newaxis]
+    for start in range(0, n_x, _GRID_ROW_CHUNK):
+        chunk = slice(start, start + _GRID_ROW_CHUNK)
+        shift = offsets[: len(scaled[chunk])]
+        regressed[chunk] = (
+            isotonic_regression(
+                (scaled[chunk] + shift).ravel(), sample_weight=weights[chunk].ravel()
+            ).reshape((-1, n_y))
+            - shift
+        )
+
+    return regressed * spans + lows
+
+
+def regress_isotonic_grid_l2_dykstra(
+    values, weights=None, *, tol=None, max_iter=None, deadline=None
+):
+    """Approximate weighted L2 isotonic regression of a grid by Dykstra's
+    alternating projections.
+
+    Each iteration projects onto grids with isotonic rows, and then
+    onto grids with isotonic columns, using vectorized PAVA. The
+    iterates are made isotonic by averaging their running maximums and
+    minimums along rows, and compared with the lower bound given by
+    the Dykstra corrections to bound their excess error.
+
+    Empty cells only carry order constraints. They are weighted like
+    an average cell, but pulled towards their own current value each
+    iteration, so they do not bias the regression.
+
+    Parameters
+    ----------
+    values : array-like of shape (n_x, n_y)
+        Value of each grid cell.
+    weights : array-like of shape (n_x, n_y), default=None
+        Non-negative weight of each grid cell. Defaults to 1. Cells with
+        zero weight are empty.
+    tol : float, default=None
+        Stop once the gap is at most tol. Defaults to 1e-6 times the
+        weighted variance of the values.
+    max_iter : int, default=None
+        Maximum number of iterations. Defaults to 1000.
+    deadline : float, default=None
+        time.monotonic() value after which no more iterations start.
+
+    Returns
+    -------
+    regressed : ndarray of shape (n_x, n_y)
+        Isotonic regressed value of each grid cell.
+    gaps : list of float
+        Bound after each iteration on how much the weighted mean
+        squared error of regressed exceeds the optimum.
+    """
+
+    values = numpy.asarray(values, dtype=float)
+    if weights is None:
+        weights = numpy.ones_like(values)
+    weights = numpy.asarray(weights, dtype=float)
+
+    if values.ndim != 2 or values.size <= 0:
+        raise ValueError("values must be a non-empty 2D array")
+    if weights.shape != values.shape:
+        raise ValueError("weights must match the shape of values")
+    if (weights < 0.0).any() or not (weights > 0.0).any():
+        raise ValueError("weights must be non-negative with a positive total")
+
+    occupied = weights > 0.0
+    total_weight = weights.sum()
+    values = numpy.where(occupied, values, 0.0)
+    mean = (values * weights).sum() / total_weight
+    (v_min, v_max) = (values[occupied].min(), values[occupied].max())
+
+    if tol is None:
+        tol = _DYKSTRA_TOL * (weights * (values - mean) ** 2).sum() / total_weight
+    if max_iter is None:
+        max_iter = _DYKSTRA_MAX_ITER
+
+    pava_weights = numpy.where(occupied, weights, total_weight / occupied.sum())
+
+    # Dykstra keeps targets == current + row_corrections + col_corrections,
+    # where targets are the values of occupied cells.
+    targets = numpy.where(occupied, values, mean)
+    current = targets.copy()
+    row_corrections = numpy.zeros_like(values)
+    col_corrections = numpy.zeros_like(values)
+
+    regressed = numpy.full_like(values, mean)
+    gaps = []
+    while len(gaps) < max_iter:
+        if deadline is not None and gaps and time.monotonic() > deadline:
+            break
+
+        rows = _regress_isotonic_grid_rows(current + row_corrections, pava_weights)
+        row_corrections += current - rows
+
+        current = _regress_isotonic_grid_rows(
+            (rows + col_corrections).T, pava_weights.T
+        ).T
+        col_corrections += rows - current
+
+        # columns are isotonic, and running maximums and minimums along
+        # rows keep them that way while making rows isotonic too. the
+        # running maximums along both axes fix rounding errors.
+        lower = numpy.maximum.accumulate(current, axis=1)
+        upper = numpy.minimum.accumulate(current[:, ::-1], axis=1)[:, ::-1]
+        regressed = (lower + upper) / 2.0
+        regressed = numpy.maximum.accumulate(regressed, axis=0)
+        regressed = numpy.maximum.accumulate(regressed, axis=1)
+
+        # empty cells are pulled towards their current value instead.
+        corrections = row_corrections + col_corrections
+        targets = numpy.where(occupied, targets, current)
+        current = numpy.where(occupied, current, targets - corrections)
+
+        # the corrections are dual feasible, so this lower bounds the
+        # optimal sum of half squared errors. optimal values are between
+        # v_min and v_max, which bounds the terms of empty cells.
+        empty_bounds = numpy.minimum(corrections * v_min, corrections * v_max)
+        lower_bound = (weights * (corrections * values - corrections ** 2 / 2.0)).sum()
+        lower_bound += (pava_weights * empty_bounds)[~occupied].sum()
+        upper_bound = (weights * (regressed - values) ** 2).sum() / 2.0
+
+        gaps.append(max(2.0 * (upper_bound - lower_bound) / total_weight, 0.0))
+        if gaps[-1] <= tol:
+            break
+
+    return (regressed, gaps)
@@ -1,17 +1,23 @@
 # isotonickd.py
 
 import logging
+from numbers import Integral
 
 from numpy import asarray
+from numpy import sort
 from numpy import vectorize
+from numpy.random import RandomState
 from sklearn.base import RegressorMixin
 from sklearn.base import TransformerMixin
 from sklearn.base import check_array
 from sklearn.metrics import r2_score
+from sklearn.utils import check_random_state
 
+from . import checkpoint
 from .isotonic1d import regress_isotonic_1d
 from .isotonic2d import regress_isotonic_2d
 from .isotonicreduce import reduce_isotonic_l2
+from .piecewise import PiecewiseBilinearChain
 from .piecewise import PiecewiseLinear
 
 
@@ -24,19 +30,61 @@ class IsotonicKdRegression(RegressorMixin, TransformerMixin):
     https://github.com/scikit-learn/scikit-learn/blob/main/sklearn/isotonic.py
     """
 
-    def __init__(self, n_estimators=None, n_values=None):
+    def __init__(
+        self,
+        n_estimators=None,
+        n_values=None,
+        subsample=1.0,
+        random_state=None,
+        checkpoint_dir=None,
+    ):
+        # subsample = fraction of rows, sampled without replacement, used
+        #   to fit each 2D regression. all rows are still predicted.
+        # random_state = controls the subsamples. an int seeds each 2D
+        #   regression from its index, so resumed fits draw the same
+        #   rows as uninterrupted ones.
+        # checkpoint_dir = if set, save each completed 2D regression in
+        #   this directory with the training prediction and score after
+        #   it, and resume fitting after the last saved one. the
+        #   training data must be the same as in the interrupted fit.
+
         self.fs = None
         self.rs = None
+        self.chain_ = None
         self.k = None
         self.n_estimators = n_estimators
         self.n_values = n_values
+        self.subsample = subsample
+        self.random_state = random_state
+        self.checkpoint_dir = checkpoint_dir
+
+    def _subsample_rows(self, i, n):
+        """Helper function returning the sorted rows fitting 2D regression
+        i, or all rows.
+        """
+
+        if self.subsample >= 1.0:
+            return slice(None)
+
+        # seeding each stage from its index lets resumed fits draw the
+        # same rows as one uninterrupted fit.
+        if isinstance(self.random_state, Integral):
+            rng = RandomState([self.random_state, i])
+        else:
+            rng = check_random_state(self.random_state)
+
+        size = max(int(round(self.subsample * n)), 1)
+        return sort(rng.choice(n, size=size, replace=False))
 
     def fit(self, X, y, sample_weight=None):
         # TODO: shape checks
         X = check_array(X)
         y = check_array(y, ensure_2d=False)
+        if not 0.0 < self.subsample <= 1.0:
+            raise ValueError("subsample must be in (0, 1]")
 
         self.fs = []
+        self.chain_ = None
         self.k = X.shape[1]
 
         if self.k == 0:
@@ -75,69 +123,118 @@ class IsotonicKdRegression(RegressorMixin, TransformerMixin):
                     del X
                     X = X_original
 
-            self.fs.append(
-                regress_isotonic_2d(
-                    xs=X[:, 0],
-                    ys=X[:, 1],
-                    vs=list(y),
-                    ws=sample_weight,
-                    n_values=self.n_values,
-                )
-            )
-            if len(y) <= 1:
-                # degenerate case - just one sample, so stop immediately
-                # LATER: move this earlier
-                return
-
-            previous_prediction = [self.fs[0](*r) for r in zip(X[:, 0], X[:, 1])]
+            ws = None if sample_weight is None else asarray(sample_weight)
 
+            previous_prediction = None
             training_scores = []
-            training_scores.append(r2_score(y, previous_prediction))
-            logging.warning(
-                "IsotonicKdRegression.fit() score %.6f after initial model",
-                training_scores[0],
-            )
+            if self.checkpoint_dir is not None:
+                (self.fs, previous_prediction, training_scores) = self._load_checkpoint(
+                    X
+                )
 
-            for i in range(1, self.n_estimators):
-                current_input = X[:, (i + 1) % self.k]
+            if not self.fs:
+                rows = self._subsample_rows(0, len(y))
                 self.fs.append(
                     regress_isotonic_2d(
-                        xs=previous_prediction,
-                        ys=current_input,
-                        vs=y,
-                        ws=sample_weight,
+                        xs=X[rows, 0],
+                        ys=X[rows, 1],
+                        vs=list(y[rows]),
+                        ws=None if ws is None else ws[rows],
                         n_values=self.n_values,
                     )
                 )
+                if len(y) <= 1:
+                    # degenerate case - just one sample, so stop immediately
+                    # LATER: move this earlier
+                    return
+
+                previous_prediction = self.fs[0].__self__.interpolate_array(
+                    X[:, 0], X[:, 1]
+                )
 
-                previous_prediction = [
-                    self.fs[-1](*r) for r in zip(previous_prediction, current_input)
-                ]
                 training_scores.append(r2_score(y, previous_prediction))
                 logging.warning(
-                    "IsotonicKdRegression.fit() score %.6f after %d models",
-                    training_scores[-1],
-                    len(self.fs),
+                    "IsotonicKdRegression.fit() score %.6f after initial model",
+                    training_scores[0],
                 )
+                self._save_checkpoint(0, previous_prediction, training_scores[0])
+
+            for i in range(1, self.n_estimators):
+                if i >= len(self.fs):
+                    current_input = X[:, (i + 1) % self.k]
+                    rows = self._subsample_rows(i, len(y))
+                    self.fs.append(
+                        regress_isotonic_2d(
+                            xs=previous_prediction[rows],
+                            ys=current_input[rows],
+                            vs=y[rows],
+                            ws=None if ws is None else ws[rows],
+                            n_values=self.n_values,
+                        )
+                    )
 
-                if training_scores[-1] >= 1.0:
+                    previous_prediction = self.fs[-1].__self__.interpolate_array(
+                        previous_prediction, current_input
+                    )
+                    training_scores.append(r2_score(y, previous_prediction))
+                    logging.warning(
+                        "IsotonicKdRegression.fit() score %.6f after %d models",
+                        training_scores[-1],
+                        len(self.fs),
+                    )
+                    self._save_checkpoint(i, previous_prediction, training_scores[-1])
+
+                # stages resumed from a checkpoint replay these checks.
+                if training_scores[i] >= 1.0:
+                    self.fs[i + 1 :] = []
                     logging.warning(
                         "IsotonicKdRegression.fit() stopping after %d models",
                         len(self.fs),
                     )
                     break
 
-                if len(training_scores) >= self.k + 1:
+                if i >= self.k:
                     # check if the last round through input columns improved the score
-                    if training_scores[-1] <= training_scores[-1 - self.k]:
+                    if training_scores[i] <= training_scores[i - self.k]:
                         # training score did not improve, so drop the last round of models
-                        self.fs[-self.k :] = []
+                        self.fs[i + 1 - self.k :] = []
                         logging.warning(
                             "IsotonicKdRegression.fit() rolling back to first %d models",
                             len(self.fs),
                         )
                         break
 
+    def _load_checkpoint(self, X):
+        """Helper function loading the stages completed in checkpoint_dir,
+        up to n_estimators. Returns (fs, prediction, scores) where
+        prediction is the training prediction after the last stage.
+        """
+
+        (fs, prediction, scores) = checkpoint.load_stages(self.checkpoint_dir)
+        if len(fs) > self.n_estimators:
+            (fs, prediction) = (fs[: self.n_estimators], None)
+            scores = scores[: len(fs)]
+
+        if fs and (prediction is None or len(prediction) != X.shape[0]):
+            prediction = fs[0].__self__.interpolate_array(X[:, 0], X[:, 1])
+            for i in range(1, len(fs)):
+                prediction = fs[i].__self__.interpolate_array(
+                    prediction, X[:, (i + 1) % self.k]
+                )
+
+        if fs:
+            logging.warning(
+                "IsotonicKdRegression.fit() resuming after %d models", len(fs)
+            )
+
+        return (fs, prediction, scores)
+
+    def _save_checkpoint(self, i, prediction, score):
+        """Helper function saving stage i to checkpoint_dir, if set."""
+
+        if self.checkpoint_dir is not None:
+            checkpoint.save_stage(self.checkpoint_dir, i, self.fs[i], prediction, score)
+
     def predict(self, T):
         """Predict new data by bilinear interpolation.
 
@@ -153,6 +250,50 @@ class IsotonicKdRegression(RegressorMixin, TransformerMixin):
         """
         return self.transform(T)
 
+    def predict_one(self, *features):
+        """Predict one point without input validation.
+
+        Returns the same value as predict for the row of features,
+        walking the fitted chain directly with much less overhead for a
+        single point.
+
+        Parameters
+        ----------
+        *features : float
+            The k features of the point.
+
+        Returns
+        -------
+        y_pred : float
+            Predicted value.
+        """
+
+        if len(features) != self.k:
+            raise ValueError("wrong shape")
+
+        if self.k == 1:
+            return float(self.fs[0](features[0]))
+
+        if self.rs:
+            features = [f.pyfunc(t) if f else t for (f, t) in zip(self.rs, features)]
+
+        if self.chain_ is not None:
+            ys = [features[(i + 1) % self.k] for i in range(len(self.chain_))]
+            return float(self.chain_.interpolate(features[0], ys))
+
+        prediction = self.fs[0](features[0], features[1])
+        for i in range(1, len(self.fs)):
+            prediction = self.fs[i](prediction, features[(i + 1) % self.k])
+
+        return float(prediction)
+
+    def predict_row(self, row):
+        """Predict one row without input validation, like
+        predict_one(*row).
+        """
+
+        return self.predict_one(*row)
+
     def transform(self, T):
         """Transform new data by bilinear interpolation.
 
@@ -181,6 +322,10 @@ class IsotonicKdRegression(RegressorMixin, TransformerMixin):
                 if f:
                     T[:, i] = f(T[:, i])
 
+        if self.chain_ is not None:
+            ys = [T[:, (i + 1) % self.k] for i in range(len(self.chain_))]
+            return self.chain_.interpolate_array(T[:, 0], ys)
+
         prediction = [self.fs[0](x, y) for (x, y) in zip(T[:, 0], T[:, 1])]
 
         for i in range(1, len(self.fs)):
@@ -189,3 +334,27 @@ class IsotonicKdRegression(RegressorMixin, TransformerMixin):
             prediction = [f(x, y) for (x, y) in zip(prediction, current_input)]
 
         return asarray(prediction)
+
+    def compile(self, tol=0.0):
+        """Flatten the chain of 2D regressions into one
+        PiecewiseBilinearChain used by predict.
+
+        Regressions changing the previous prediction by at most tol are
+        pruned to clipping it. 1D models have nothing to compile. Fitting
+        again discards the compiled chain.
+
+        Parameters
+        ----------
+        tol : float, default=0.0
+            Largest change of a pruned regression's output.
+
+        Returns
+        -------
+        self : object
+            Compiled model.
+        """
+
+        if self.k > 1:
+            self.chain_ = PiecewiseBilinearChain([f.__self__ for f in self.fs], tol=tol)
+
+        return self
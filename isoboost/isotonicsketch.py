@@ -0,0 +1,637 @@
+# isotonicsketch.py
+
+# Mergeable sufficient statistics for L2 isotonic regression.
+#
+# L2 isotonic regressions only depend on the total weight w and total
+# v * w at each distinct vertex, so these can be aggregated separately
+# for shards of the training data, merged, and fit once.
+#
+# Bounded sketches also track the total v * v * w, and compact
+# neighboring vertexes into centroids covering disjoint ranges of
+# coordinates. The within-centroid sum of squares measures the error
+# added by replacing the inputs of each centroid with their weighted
+# mean.
+
+from numpy import add
+from numpy import arange
+from numpy import asarray
+from numpy import bincount
+from numpy import concatenate
+from numpy import empty
+from numpy import flatnonzero
+from numpy import inf
+from numpy import lexsort
+from numpy import load
+from numpy import maximum
+from numpy import nextafter
+from numpy import ones
+from numpy import repeat
+from numpy import savez
+from numpy import searchsorted
+from numpy import tile
+from numpy import unique
+from numpy import where
+from numpy import zeros
+
+from .isotonic1d import regress_isotonic_1d
+from .isotonic2d import regress_isotonic_2d_l2
+from .piecewise import PiecewiseBilinear
+
+
+def _aggregate(coords, sums, weights, squares):
+    """
+    Helper function combining vertexes with the same coordinates.
+    Returns sorted distinct vertexes with their total statistics.
+    """
+
+    (distinct, index) = unique(coords, axis=0, return_inverse=True)
+    index = index.reshape(-1)
+
+    return (
+        distinct,
+        distinct.copy(),
+        bincount(index, sums, minlength=len(distinct)),
+        bincount(index, weights, minlength=len(distinct)),
+        bincount(index, squares, minlength=len(distinct)),
+    )
+
+
+def _split_intervals(lows, highs, weights):
+    """
+    Helper function assigning intervals to disjoint, ordered groups.
+    Returns (rows, groups, fractions, group_lows, group_highs) where
+    row rows[k] puts fractions[k] of its statistics into group
+    groups[k].
+
+    Intervals contained in another interval join it whole. Intervals
+    partially overlapping others are split where they overlap, sharing
+    their statistics in proportion to the lengths covered, as if their
+    inputs were spread evenly over their ranges. Groups never overlap
+    or touch, so overlapping inputs never collapse into one group.
+    """
+
+    # keep intervals not contained in an earlier one, ordered by low
+    # and then by decreasing high. the rest join the last kept interval.
+    order = lexsort((-highs, lows))
+    sorted_highs = highs[order]
+    kept = concatenate(
+        ([True], sorted_highs[1:] > maximum.accumulate(sorted_highs)[:-1])
+    )
+
+    owners = empty(len(lows), dtype=int)
+    owners[order] = kept.cumsum() - 1
+
+    # kept lows and highs are both strictly increasing.
+    kept_lows = lows[order][kept]
+    kept_highs = sorted_highs[kept]
+    kept_weights = bincount(owners, weights, minlength=len(kept_lows))
+    lengths = kept_highs - kept_lows
+
+    # units alternate between the cut points and the gaps between them.
+    # each unit is covered by a contiguous range of kept intervals.
+    cuts = unique(concatenate((kept_lows, kept_highs)))
+    n_units = 2 * len(cuts) - 1
+    unit_lows = cuts[arange(n_units) // 2]
+    unit_highs = cuts[(arange(n_units) + 1) // 2]
+
+    firsts = searchsorted(kept_highs, unit_highs, side="left")
+    ends = searchsorted(kept_lows, unit_lows, side="right")
+    covered = flatnonzero(ends > firsts)
+    counts = (ends - firsts)[covered]
+
+    # (unit, interval) pairs with the fraction of the interval in the unit.
+    pair_units = repeat(covered, counts)
+    pair_rows = firsts[pair_units] + (
+        arange(counts.sum()) - repeat(counts.cumsum() - counts, counts)
+    )
+    pair_lengths = lengths[pair_rows]
+    pair_fractions = where(
+        pair_lengths > 0.0,
+        (unit_highs - unit_lows)[pair_units]
+        / where(pair_lengths > 0.0, pair_lengths, 1.0),
+        1.0,
+    )
+
+    # neighboring units covered by the same intervals form one group,
+    # and groups without weight, like points where intervals touch,
+    # join the group before them.
+    unit_weights = bincount(
+        pair_units, kept_weights[pair_rows] * pair_fractions, minlength=n_units
+    )[covered]
+    changed = (firsts[covered][1:] != firsts[covered][:-1]) | (
+        ends[covered][1:] != ends[covered][:-1]
+    )
+    runs = concatenate(([0], changed.cumsum()))
+    is_start = bincount(runs, unit_weights) > 0.0
+    is_start[0] = True
+    unit_groups = (is_start.cumsum() - 1)[runs]
+
+    starts = flatnonzero(concatenate(([True], unit_groups[1:] != unit_groups[:-1])))
+    group_starts = covered[starts]
+    group_ends = covered[concatenate((starts[1:] - 1, [len(covered) - 1]))]
+
+    # gaps between cuts exclude the cuts themselves.
+    group_lows = where(
+        group_starts % 2 == 0,
+        cuts[group_starts // 2],
+        nextafter(cuts[group_starts // 2], inf),
+    )
+    group_highs = where(
+        group_ends % 2 == 0,
+        cuts[group_ends // 2],
+        nextafter(cuts[(group_ends + 1) // 2], -inf),
+    )
+
+    # combine pairs by interval and group, and expand them to the rows
+    # owned by each interval.
+    pair_groups = unit_groups[searchsorted(covered, pair_units)]
+    (keys, index) = unique(
+        pair_rows * len(group_lows) + pair_groups, return_inverse=True
+    )
+    key_fractions = bincount(index.reshape(-1), pair_fractions, minlength=len(keys))
+    (key_rows, key_groups) = (keys // len(group_lows), keys % len(group_lows))
+
+    key_starts = searchsorted(key_rows, arange(len(kept_lows)))
+    key_counts = (
+        searchsorted(key_rows, arange(len(kept_lows)), side="right") - key_starts
+    )
+    rows = repeat(arange(len(lows)), key_counts[owners])
+    keys = repeat(key_starts[owners], key_counts[owners]) + (
+        arange(len(rows))
+        - repeat(key_counts[owners].cumsum() - key_counts[owners], key_counts[owners])
+    )
+
+    return (rows, key_groups[keys], key_fractions[keys], group_lows, group_highs)
+
+
+def _merge_starts(sums, weights, excess):
+    """
+    Helper function choosing adjacent rows to merge, preferring merges
+    adding the least sum of squares. sums and weights are 1D or 2D
+    arrays, and rows are merged across all columns. Returns the indexes
+    starting each row after merging up to excess pairs.
+    """
+
+    if sums.ndim == 1:
+        (sums, weights) = (sums[:, None], weights[:, None])
+
+    # merging means a and b with weights wa and wb adds
+    # wa * wb / (wa + wb) * (a - b) ** 2 to the sum of squares.
+    (sa, sb) = (sums[:-1], sums[1:])
+    (wa, wb) = (weights[:-1], weights[1:])
+    both = (wa > 0.0) & (wb > 0.0)
+
+    costs = zeros(wa.shape)
+    (wa, wb) = (wa[both], wb[both])
+    costs[both] = wa * wb / (wa + wb) * (sa[both] / wa - sb[both] / wb) ** 2
+    costs = costs.sum(axis=1)
+
+    # local minima never overlap, and always include the cheapest merge.
+    padded = concatenate(([inf], costs, [inf]))
+    candidates = flatnonzero((costs < padded[:-2]) & (costs <= padded[2:]))
+    candidates = candidates[costs[candidates].argsort(kind="stable")[:excess]]
+
+    merged = zeros(len(sums), dtype=bool)
+    merged[candidates + 1] = True
+
+    return flatnonzero(~merged)
+
+
+def _compact_axis(lows, highs, sums, weights, squares, max_size):
+    """
+    Helper function merging adjacent rows of sorted statistics until
+    at most max_size rows remain. Statistics may be 1D or 2D arrays.
+    Also returns the merged row of each original row.
+    """
+
+    groups = arange(len(lows))
+    while len(lows) > max_size:
+        starts = _merge_starts(sums, weights, len(lows) - max_size)
+
+        is_start = zeros(len(lows), dtype=bool)
+        is_start[starts] = True
+        groups = (is_start.cumsum() - 1)[groups]
+
+        lows = lows[starts]
+        highs = maximum.reduceat(highs, starts)
+        sums = add.reduceat(sums, starts)
+        weights = add.reduceat(weights, starts)
+        squares = add.reduceat(squares, starts)
+
+    return (lows, highs, sums, weights, squares, groups)
+
+
+def _split_statistics(rows, groups, fractions, n_groups, *columns):
+    """
+    Helper function summing the shares of statistics columns assigned
+    to each group by _split_intervals.
+    """
+
+    return tuple(
+        bincount(groups, c[rows] * fractions, minlength=n_groups) for c in columns
+    )
+
+
+def _compact_1d(lows, highs, sums, weights, squares, max_size):
+    """
+    Helper function splitting centroids into disjoint groups, and then
+    merging adjacent groups until at most max_size remain.
+    """
+
+    (rows, groups, fractions, group_lows, group_highs) = _split_intervals(
+        lows[:, 0], highs[:, 0], weights
+    )
+
+    (lows, highs, sums, weights, squares, _) = _compact_axis(
+        group_lows,
+        group_highs,
+        *_split_statistics(
+            rows, groups, fractions, len(group_lows), sums, weights, squares
+        ),
+        max_size,
+    )
+
+    return (lows[:, None], highs[:, None], sums, weights, squares)
+
+
+def _split_axis(lows, highs, sums, weights, squares, max_size):
+    """
+    Helper function splitting one axis of 2d centroids into disjoint
+    bins, merging adjacent bins by their totals until at most max_size
+    remain. Returns (rows, bins, fractions, bin_lows, bin_highs) like
+    _split_intervals.
+    """
+
+    (rows, groups, fractions, bin_lows, bin_highs) = _split_intervals(
+        lows, highs, weights
+    )
+
+    (bin_lows, bin_highs, _, _, _, merged) = _compact_axis(
+        bin_lows,
+        bin_highs,
+        *_split_statistics(
+            rows, groups, fractions, len(bin_lows), sums, weights, squares
+        ),
+        max_size,
+    )
+
+    return (rows, merged[groups], fractions, bin_lows, bin_highs)
+
+
+def _compact_2d(lows, highs, sums, weights, squares, max_size):
+    """
+    Helper function splitting cells into a grid of disjoint x and y
+    bins, and then merging adjacent rows and columns of the grid until
+    there are at most max_size bins along each axis.
+    """
+
+    # too many bins are first merged by their totals over the other
+    # axis to limit the size of the grid.
+    (x_rows, x_bins, x_fractions, x_lows, x_highs) = _split_axis(
+        lows[:, 0], highs[:, 0], sums, weights, squares, 2 * max_size
+    )
+    (y_rows, y_bins, y_fractions, y_lows, y_highs) = _split_axis(
+        lows[:, 1], highs[:, 1], sums, weights, squares, 2 * max_size
+    )
+
+    # pair each x share of a cell with each y share of the same cell.
+    # rows are sorted within both.
+    y_starts = searchsorted(y_rows, arange(len(weights)))
+    y_counts = bincount(y_rows, minlength=len(weights))
+    counts = y_counts[x_rows]
+    x_pairs = repeat(arange(len(x_rows)), counts)
+    y_pairs = repeat(y_starts[x_rows], counts) + (
+        arange(counts.sum()) - repeat(counts.cumsum() - counts, counts)
+    )
+
+    shape = (len(x_lows), len(y_lows))
+    (sums, weights, squares) = (
+        c.reshape(shape)
+        for c in _split_statistics(
+            x_rows[x_pairs],
+            x_bins[x_pairs] * shape[1] + y_bins[y_pairs],
+            x_fractions[x_pairs] * y_fractions[y_pairs],
+            shape[0] * shape[1],
+            sums,
+            weights,
+            squares,
+        )
+    )
+
+    (x_lows, x_highs, sums, weights, squares, _) = _compact_axis(
+        x_lows, x_highs, sums, weights, squares, max_size
+    )
+    (y_lows, y_highs, sums, weights, squares, _) = _compact_axis(
+        y_lows, y_highs, sums.T, weights.T, squares.T, max_size
+    )
+    (sums, weights, squares) = (sums.T, weights.T, squares.T)
+
+    (x_cells, y_cells) = (weights > 0.0).nonzero()
+
+    return (
+        concatenate((x_lows[x_cells, None], y_lows[y_cells, None]), axis=1),
+        concatenate((x_highs[x_cells, None], y_highs[y_cells, None]), axis=1),
+        sums[x_cells, y_cells],
+        weights[x_cells, y_cells],
+        squares[x_cells, y_cells],
+    )
+
+
+class IsotonicSketch:
+    """Mergeable per-vertex statistics for L2 isotonic regression.
+
+    Keeps the total weight and weighted value at each distinct x value
+    (ndim=1) or (x, y) vertex (ndim=2). Sketches built from separate
+    chunks of data can be merged, saved and loaded, and fit exactly as
+    if all the data was fit at once.
+
+    If max_size is set, the sketch uses bounded memory by merging
+    neighboring vertexes into centroids covering disjoint ranges of
+    coordinates, choosing merges adding the least sum of squares. With
+    ndim=1 at most max_size centroids are kept. With ndim=2 the
+    vertexes are merged into a grid with at most max_size bins along
+    each axis. error_bound() bounds how much the training error of
+    fit() exceeds the optimal training error over all the data added.
+
+    Merged sketches of interleaved shards have centroids with
+    overlapping ranges. These are split where they overlap, assuming
+    their inputs are spread evenly over their ranges, so the statistics
+    and error_bound() are approximate after such merges.
+
+    Parameters
+    ----------
+    ndim : int, default=1
+        Number of independent variables, 1 or 2.
+    max_size : int, default=None
+        Maximum number of centroids for ndim=1, or maximum number of
+        bins along each axis for ndim=2.
+    """
+
+    def __init__(self, ndim=1, max_size=None):
+        if ndim not in (1, 2):
+            raise ValueError("ndim must be 1 or 2")
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be positive")
+
+        self.ndim = ndim
+        self.max_size = max_size
+
+        # each vertex or centroid covers coordinates from lows to highs.
+        self.lows = empty((0, ndim))
+        self.highs = empty((0, ndim))
+
+        # sum(v * w), sum(w) and sum(v * v * w) for each centroid.
+        self.sums = empty(0)
+        self.weights = empty(0)
+        self.squares = empty(0)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def update(self, X, y, sample_weight=None):
+        """Add a chunk of training data to the sketch.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples, ndim)
+            Training data. May be 1D if ndim=1.
+        y : array-like of shape (n_samples,)
+            Training target.
+        sample_weight : array-like of shape (n_samples,), default=None
+            Weights. Defaults to 1.
+
+        Returns
+        -------
+        self : IsotonicSketch
+        """
+
+        X = asarray(X, dtype=float)
+        if X.ndim == 1 and self.ndim == 1:
+            X = X.reshape((-1, 1))
+        if X.ndim != 2 or X.shape[1] != self.ndim:
+            raise ValueError("wrong shape")
+
+        y = asarray(y, dtype=float)
+        ws = ones(len(y)) if sample_weight is None else asarray(sample_weight, float)
+        if len(X) != len(y) or len(y) != len(ws):
+            raise ValueError("input lengths do not match")
+
+        # zero weights do not change the regression.
+        keep = ws != 0.0
+        (X, y, ws) = (X[keep], y[keep], ws[keep])
+
+        return self._combine(X, X, y * ws, ws, y * y * ws)
+
+    def merge(self, other):
+        """Add the data of another sketch to this sketch.
+
+        Parameters
+        ----------
+        other : IsotonicSketch
+            Sketch with the same number of dimensions. Sketches with
+            centroids can only be merged into sketches with max_size.
+
+        Returns
+        -------
+        self : IsotonicSketch
+        """
+
+        if other.ndim != self.ndim:
+            raise ValueError("sketch dimensions do not match")
+        if self.max_size is None and (other.lows != other.highs).any():
+            raise ValueError("cannot merge centroids into an exact sketch")
+
+        return self._combine(
+            other.lows, other.highs, other.sums, other.weights, other.squares
+        )
+
+    def _combine(self, lows, highs, sums, weights, squares):
+        combined = (
+            concatenate((self.lows, lows)),
+            concatenate((self.highs, highs)),
+            concatenate((self.sums, sums)),
+            concatenate((self.weights, weights)),
+            concatenate((self.squares, squares)),
+        )
+
+        if len(combined[3]) <= 0:
+            pass
+        elif self.max_size is None:
+            combined = _aggregate(combined[0], *combined[2:])
+        elif self.ndim == 1:
+            combined = _compact_1d(*combined, self.max_size)
+        else:
+            combined = _compact_2d(*combined, self.max_size)
+
+        (self.lows, self.highs, self.sums, self.weights, self.squares) = combined
+
+        return self
+
+    def compaction_error(self):
+        """Return the weighted mean squared error from replacing the data
+        in each centroid with its weighted mean. This includes the spread
+        of repeated values at a single vertex even without compaction.
+        """
+
+        total_weight = self.weights.sum()
+        if total_weight <= 0.0:
+            return 0.0
+
+        within = self.squares - self.sums ** 2 / self.weights
+
+        return float(maximum(within, 0.0).sum() / total_weight)
+
+    def save(self, file):
+        """Save the sketch to a file or file name in numpy .npz format."""
+
+        savez(
+            file,
+            lows=self.lows,
+            highs=self.highs,
+            sums=self.sums,
+            weights=self.weights,
+            squares=self.squares,
+            max_size=asarray(self.max_size or 0),
+        )
+
+    @classmethod
+    def load(cls, file):
+        """Load a sketch saved by save()."""
+
+        with load(file) as data:
+            lows = data["lows"]
+
+            sketch = cls(ndim=lows.shape[1], max_size=int(data["max_size"]) or None)
+            sketch.lows = lows
+            sketch.highs = data["highs"]
+            sketch.sums = data["sums"]
+            sketch.weights = data["weights"]
+            sketch.squares = data["squares"]
+
+        return sketch
+
+    def fit(self, **kwargs):
+        """Fit an isotonic regression to the sketched data.
+
+        With ndim=1, each centroid covering a range of x values is fit
+        as two inputs with half its weight at both ends of the range.
+        Equal adjacent inputs always end up in the same level set, so
+        the regression is constant over the range. With ndim=2, each
+        centroid is fit as one input at the middle of its cell. Bounded
+        2d sketches then use the value at the middle of each grid cell
+        over the whole cell.
+
+        Parameters
+        ----------
+        **kwargs
+            Passed to regress_isotonic_1d or regress_isotonic_2d_l2.
+
+        Returns
+        -------
+        f : callable
+            Output function like the one returned by the regression.
+        """
+
+        if len(self) <= 0:
+            raise ValueError("cannot fit empty sketch")
+
+        vs = self.sums / self.weights
+
+        if self.ndim == 1:
+            (lows, highs) = (self.lows[:, 0], self.highs[:, 0])
+
+            ranged = highs > lows
+            xs = concatenate((lows, highs[ranged]))
+            ws = where(ranged, self.weights / 2.0, self.weights)
+            ws = concatenate((ws, self.weights[ranged] / 2.0))
+
+            return regress_isotonic_1d(xs, concatenate((vs, vs[ranged])), ws, **kwargs)
+
+        middles = (self.lows + self.highs) / 2.0
+        f = regress_isotonic_2d_l2(
+            middles[:, 0], middles[:, 1], vs, self.weights, **kwargs
+        )
+        if self.max_size is None:
+            return f
+
+        # evaluate the regression at the middle of every grid cell, and
+        # use that value at all four corners of the cell, so the output
+        # is constant on each cell.
+        ((x_lows, x_highs, _), (y_lows, y_highs, _)) = self._grid()
+        x_middles = (x_lows + x_highs) / 2.0
+        y_middles = (y_lows + y_highs) / 2.0
+        values = f.__self__.interpolate_array(
+            repeat(x_middles, len(y_middles)), tile(y_middles, len(x_middles))
+        ).reshape((len(x_middles), len(y_middles)))
+
+        x_edges = unique(concatenate((x_lows, x_highs)))
+        y_edges = unique(concatenate((y_lows, y_highs)))
+        x_bins = searchsorted(x_lows, x_edges, side="right") - 1
+        y_bins = searchsorted(y_lows, y_edges, side="right") - 1
+
+        return PiecewiseBilinear.from_arrays(
+            x_edges,
+            arange(len(x_edges) + 1) * len(y_edges),
+            tile(y_edges, len(x_edges)),
+            values[x_bins][:, y_bins].ravel(),
+        ).interpolate
+
+    def _grid(self):
+        """
+        Helper function returning the (lows, highs, bins) of the
+        disjoint bins along each axis of a bounded 2d sketch, where bins
+        gives the bin of each centroid.
+        """
+
+        axes = []
+        for axis in range(2):
+            lows = unique(self.lows[:, axis])
+            bins = searchsorted(lows, self.lows[:, axis])
+            highs = zeros(len(lows))
+            maximum.at(highs, bins, self.highs[:, axis])
+            axes.append((lows, highs, bins))
+
+        return axes
+
+    def error_bound(self):
+        """Return a bound on how much the weighted mean squared training
+        error of fit(), with default arguments, exceeds the optimal
+        training error over all the data added.
+
+        Exact sketches fit optimally, and bounded 1d sketches exceed the
+        optimum by at most compaction_error(). fit() is constant on each
+        cell of bounded 2d sketches, so its error is compaction_error()
+        plus its error on the cell means. The optimal regression, averaged
+        over each cell, is only ordered between cells in strictly larger
+        bins along both axes, or along an axis with a single value per
+        bin. The regression of the cell means under only those orderings
+        has no more error than the optimum, and the bound is the
+        difference.
+
+        Inputs are assumed spread evenly over centroid ranges where
+        merged centroids partially overlapped, so the bound is then
+        approximate.
+        """
+
+        if self.max_size is None or len(self) <= 0:
+            return 0.0
+        if self.ndim == 1:
+            return self.compaction_error()
+
+        vs = self.sums / self.weights
+        middles = (self.lows + self.highs) / 2.0
+        fitted = self.fit().__self__.interpolate_array(middles[:, 0], middles[:, 1])
+        upper = (self.weights * (vs - fitted) ** 2).sum()
+
+        # map cells to coordinates ordered exactly like the orderings
+        # above. cells sharing a ranged bin get incomparable coordinates.
+        ((x_lows, x_highs, x_bins), (y_lows, y_highs, y_bins)) = self._grid()
+        scale = 1.0 / (max(len(x_lows), len(y_lows)) + 1)
+        xs = x_bins - scale * y_bins * (x_highs > x_lows)[x_bins]
+        ys = y_bins - scale * x_bins * (y_highs > y_lows)[y_bins]
+        relaxed = regress_isotonic_2d_l2(xs, ys, vs, self.weights)
+        lower = (
+            self.weights * (vs - relaxed.__self__.interpolate_array(xs, ys)) ** 2
+        ).sum()
+
+        return self.compaction_error() + max(upper - lower, 0.0) / self.weights.sum()
@@ -0,0 +1,269 @@
+# modelfile.py
+
+# Flat model files for sharing fitted models between processes.
+#
+# A model file starts with an 8 byte magic string, the length of a JSON
+# header as an 8 byte little endian integer, and the header. The header
+# gives the kind of model, its scalar attributes, and the dtype, shape
+# and offset of each array. The arrays follow, each aligned to 64 bytes.
+#
+# load_model maps the file read-only by default, so the arrays of the
+# loaded model are views of the page cache, shared by every process
+# loading the same file.
+
+import json
+import mmap
+import pickle
+
+from numpy import asarray
+from numpy import dtype
+from numpy import frombuffer
+from numpy import prod
+from numpy import uint8
+from numpy import vectorize
+
+from .piecewise import PiecewiseBilinear
+from .piecewise import PiecewiseBilinearChain
+from .piecewise import PiecewiseLinear
+
+_MAGIC = b"ISOBOOST"
+_VERSION = 1
+_ALIGNMENT = 64
+
+
+def _prefixed(prefix, arrays):
+    """
+    Helper function prefixing the names of a dict of arrays.
+    """
+
+    return {prefix + name: a for (name, a) in arrays.items()}
+
+
+def _unprefixed(prefix, arrays):
+    """
+    Helper function selecting the arrays with names starting with
+    prefix, and removing the prefix.
+    """
+
+    return {
+        name[len(prefix) :]: a
+        for (name, a) in arrays.items()
+        if name.startswith(prefix)
+    }
+
+
+def _flatten(model):
+    """
+    Helper function returning (kind, attributes, arrays) describing a
+    model.
+    """
+
+    if isinstance(
+        getattr(model, "__self__", None), (PiecewiseLinear, PiecewiseBilinear)
+    ):
+        (kind, attributes, arrays) = _flatten(model.__self__)
+        return (kind, dict(attributes, bound=True), arrays)
+
+    if isinstance(model, PiecewiseLinear):
+        return ("piecewise_linear", {}, model.to_arrays())
+    if isinstance(model, PiecewiseBilinear):
+        return ("piecewise_bilinear", {}, model.to_arrays())
+    if isinstance(model, PiecewiseBilinearChain):
+        return ("piecewise_bilinear_chain", {}, model.to_arrays())
+
+    # the estimators import sklearn, so only import them for estimators.
+    from .isotonic1dmodel import Isotonic1dRegression
+    from .isotonic2dmodel import Isotonic2dRegression
+    from .isotonicboost import IsotonicBoostRegressor
+    from .isotonickd import IsotonicKdRegression
+
+    if isinstance(model, Isotonic1dRegression):
+        attributes = {"n_values": model.n_values}
+        return ("isotonic_1d", attributes, model.piecewise().to_arrays())
+
+    if isinstance(model, Isotonic2dRegression):
+        attributes = {"n_values": model.n_values, "max_bins": model.max_bins}
+        return ("isotonic_2d", attributes, model.f_.__self__.to_arrays())
+
+    if isinstance(model, IsotonicKdRegression):
+        attributes = {"k": model.k, "n_values": model.n_values}
+        if model.k == 1:
+            return ("isotonic_kd", attributes, model.fs[0].__self__.to_arrays())
+
+        chain = model.chain_
+        if chain is None:
+            chain = PiecewiseBilinearChain([f.__self__ for f in model.fs])
+
+        arrays = chain.to_arrays()
+        for (i, r) in enumerate(model.rs or []):
+            if r is not None:
+                arrays.update(_prefixed("r%d_" % i, r.pyfunc.__self__.to_arrays()))
+
+        return ("isotonic_kd", attributes, arrays)
+
+    if isinstance(model, IsotonicBoostRegressor):
+        chain = model.chain_
+        if chain is None:
+            chain = PiecewiseBilinearChain(
+                [r.f_.__self__ for r in model.isotonic_regressions]
+            )
+
+        # base estimators are arbitrary objects, so they are pickled.
+        arrays = chain.to_arrays()
+        arrays["estimators"] = frombuffer(
+            pickle.dumps(model.estimators_, protocol=pickle.HIGHEST_PROTOCOL),
+            dtype=uint8,
+        )
+
+        return ("isotonic_boost", {}, arrays)
+
+    raise ValueError("cannot save %s" % type(model).__name__)
+
+
+def _unflatten(kind, attributes, arrays):
+    """
+    Helper function rebuilding a model from (kind, attributes, arrays)
+    returned by _flatten.
+    """
+
+    if kind == "piecewise_linear":
+        f = PiecewiseLinear.from_arrays(**arrays)
+        return f.interpolate if attributes.get("bound") else f
+    if kind == "piecewise_bilinear":
+        f = PiecewiseBilinear.from_arrays(**arrays)
+        return f.interpolate if attributes.get("bound") else f
+    if kind == "piecewise_bilinear_chain":
+        return PiecewiseBilinearChain.from_arrays(**arrays)
+
+    if kind == "isotonic_1d":
+        from .isotonic1dmodel import Isotonic1dRegression
+
+        model = Isotonic1dRegression(n_values=attributes["n_values"])
+        model.f_ = PiecewiseLinear.from_arrays(**arrays).interpolate
+        return model
+
+    if kind == "isotonic_2d":
+        from .isotonic2dmodel import Isotonic2dRegression
+
+        model = Isotonic2dRegression(
+            n_values=attributes["n_values"], max_bins=attributes["max_bins"]
+        )
+        model.f_ = PiecewiseBilinear.from_arrays(**arrays).interpolate
+        return model
+
+    if kind == "isotonic_kd":
+        from .isotonickd import IsotonicKdRegression
+
+        model = IsotonicKdRegression(n_values=attributes["n_values"])
+        model.k = attributes["k"]
+        if model.k == 1:
+            model.fs = [PiecewiseLinear.from_arrays(**arrays).interpolate]
+            return model
+
+        rs = [_unprefixed("r%d_" % i, arrays) for i in range(model.k)]
+        if any(rs):
+            model.rs = [
+                vectorize(PiecewiseLinear.from_arrays(**r).interpolate) if r else None
+                for r in rs
+            ]
+
+        names = ("stage_starts", "row_xs", "row_starts", "point_ys", "point_vs")
+        names += ("clip_lows", "clip_highs")
+        model.chain_ = PiecewiseBilinearChain.from_arrays(
+            **{name: arrays[name] for name in names}
+        )
+        return model
+
+    if kind == "isotonic_boost":
+        from .isotonicboost import IsotonicBoostRegressor
+
+        arrays = dict(arrays)
+        model = IsotonicBoostRegressor()
+        model.estimators_ = pickle.loads(arrays.pop("estimators").tobytes())
+        model.isotonic_regressions = None
+        model.chain_ = PiecewiseBilinearChain.from_arrays(**arrays)
+        return model
+
+    raise ValueError("unknown model kind %r" % kind)
+
+
+def save_model(model, path):
+    # model = fitted model to save. one of Isotonic1dRegression,
+    #   Isotonic2dRegression, IsotonicKdRegression,
+    #   IsotonicBoostRegressor, PiecewiseLinear, PiecewiseBilinear,
+    #   PiecewiseBilinearChain, or an output function returned by the
+    #   regress_isotonic_* functions.
+    # path = file to write.
+    #
+    # kD and boosted models are saved as their compiled chain, compiling
+    # exactly if compile was not called. the base estimators of boosted
+    # models are pickled into one byte array. unlike the chain, each
+    # process loading the file unpickles its own copy of them, so they
+    # are not shared between processes.
+
+    (kind, attributes, arrays) = _flatten(model)
+
+    header = {"version": _VERSION, "kind": kind, "attributes": attributes}
+    header["arrays"] = []
+    offset = 0
+    for (name, a) in arrays.items():
+        a = asarray(a)
+        header["arrays"].append(
+            {"name": name, "dtype": a.dtype.str, "shape": a.shape, "offset": offset}
+        )
+        offset += -(-a.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+    encoded = json.dumps(header).encode("utf-8")
+    start = -(-(len(_MAGIC) + 8 + len(encoded)) // _ALIGNMENT) * _ALIGNMENT
+
+    with open(path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        f.write(b"\0" * (start - f.tell()))
+
+        for a in arrays.values():
+            a = asarray(a)
+            f.write(a.tobytes())
+            f.write(b"\0" * (-a.nbytes % _ALIGNMENT))
+
+
+def load_model(path, *, mmap_mode="r"):
+    # path = file written by save_model.
+    # mmap_mode = "r" to map the file read-only and use views of it as
+    #   the model arrays, or None to read the file into memory.
+    #
+    # returns the saved model, ready to predict. fitting state that is
+    # not needed to predict, like training statistics and the separate
+    # combiners of boosted models, is not restored.
+
+    if mmap_mode not in ("r", None):
+        raise ValueError("mmap_mode must be 'r' or None")
+
+    with open(path, "rb") as f:
+        if mmap_mode == "r":
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = f.read()
+
+    if buffer[: len(_MAGIC)] != _MAGIC:
+        raise ValueError("not a model file")
+
+    length = int.from_bytes(buffer[len(_MAGIC) : len(_MAGIC) + 8], "little")
+    header = json.loads(bytes(buffer[len(_MAGIC) + 8 : len(_MAGIC) + 8 + length]))
+    if header["version"] != _VERSION:
+        raise ValueError("unsupported model file version %r" % header["version"])
+
+    start = -(-(len(_MAGIC) + 8 + length) // _ALIGNMENT) * _ALIGNMENT
+
+    arrays = {}
+    for entry in header["arrays"]:
+        shape = tuple(entry["shape"])
+        arrays[entry["name"]] = frombuffer(
+            buffer,
+            dtype=dtype(entry["dtype"]),
+            count=int(prod(shape)),
+            offset=start + entry["offset"],
+        ).reshape(shape)
+
+    return _unflatten(header["kind"], header["attributes"], arrays)
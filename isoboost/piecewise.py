@@ -2,6 +2,18 @@
 
 from bisect import bisect_right
 
+from numpy import argsort
+from numpy import asarray
+from numpy import concatenate
+from numpy import diff
+from numpy import empty
+from numpy import flatnonzero
+from numpy import int64
+from numpy import maximum
+from numpy import minimum
+from numpy import searchsorted
+from numpy import where
+
 
 class PiecewiseLinear:
     def __init__(self, points):
@@ -12,6 +24,27 @@ class PiecewiseLinear:
 
         (self.ys, self.vs) = zip(*points)
 
+    @classmethod
+    def from_arrays(cls, ys, vs):
+        """Return a PiecewiseLinear using arrays of sorted distinct
+        coordinates and their values as is, without copying them.
+        """
+
+        f = cls.__new__(cls)
+        (f.ys, f.vs) = (ys, vs)
+
+        return f
+
+    def to_arrays(self):
+        """Return a dict of flat arrays describing this function, for
+        from_arrays.
+        """
+
+        return {
+            "ys": asarray(self.ys, dtype=float),
+            "vs": asarray(self.vs, dtype=float),
+        }
+
     def interpolate(self, y):
         i = bisect_right(self.ys, y)
         if i == 0:
@@ -27,6 +60,55 @@ class PiecewiseLinear:
         else:
             return self.vs[i - 1]
 
+    def interpolate_array(self, ys):
+        """Vectorized interpolate() returning the same values for an array
+        of points.
+        """
+
+        ys = asarray(ys, dtype=float)
+        knots = asarray(self.ys, dtype=float)
+        values = asarray(self.vs, dtype=float)
+
+        i = searchsorted(knots, ys, side="right")
+        output = values[maximum(i - 1, 0)]
+
+        inner = (i > 0) & (i < len(knots))
+        j = i[inner]
+        (y0, y1) = (knots[j - 1], knots[j])
+        (v0, v1) = (values[j - 1], values[j])
+        output[inner] = v0 + (v1 - v0) * (ys[inner] - y0) / (y1 - y0)
+
+        return output
+
+
+class _FlatRows:
+    """
+    Sequence of PiecewiseLinear rows stored in flat arrays, with row i
+    covering ys[starts[i]:starts[i+1]]. Rows are views created on
+    access.
+    """
+
+    def __init__(self, starts, ys, vs):
+        self.starts = starts
+        self.ys = ys
+        self.vs = vs
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("row index out of range")
+
+        (start, end) = (self.starts[i], self.starts[i + 1])
+
+        return PiecewiseLinear.from_arrays(self.ys[start:end], self.vs[start:end])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
 
 class PiecewiseBilinear:
     def __init__(self, points):
@@ -56,6 +138,36 @@ class PiecewiseBilinear:
         self.xs.append(curr_x)
         self.yvs.append(PiecewiseLinear(zip(curr_ys, curr_vs)))
 
+    @classmethod
+    def from_arrays(cls, row_xs, row_starts, point_ys, point_vs):
+        """Return a PiecewiseBilinear using flat arrays as is, without
+        copying them. Row i has x coordinate row_xs[i], and points
+        point_ys[row_starts[i]:row_starts[i+1]] with values from
+        point_vs.
+        """
+
+        f = cls.__new__(cls)
+        f.xs = row_xs
+        f.yvs = _FlatRows(row_starts, point_ys, point_vs)
+
+        return f
+
+    def to_arrays(self):
+        """Return a dict of flat arrays describing this function, for
+        from_arrays.
+        """
+
+        row_starts = [0]
+        for row in self.yvs:
+            row_starts.append(row_starts[-1] + len(row.ys))
+
+        return {
+            "row_xs": asarray(self.xs, dtype=float),
+            "row_starts": asarray(row_starts, dtype=int64),
+            "point_ys": concatenate([asarray(row.ys, dtype=float) for row in self.yvs]),
+            "point_vs": concatenate([asarray(row.vs, dtype=float) for row in self.yvs]),
+        }
+
     def interpolate(self, x, y):
         i = bisect_right(self.xs, x)
         if i == 0:
@@ -70,3 +182,263 @@ class PiecewiseBilinear:
             return v0 + (v1 - v0) * (x - x0) / (x1 - x0)
         else:
             return self.yvs[i - 1].interpolate(y)
+
+    def interpolate_array(self, xs, ys):
+        """Vectorized interpolate() returning the same values for arrays
+        of points.
+        """
+
+        xs = asarray(xs, dtype=float)
+        ys = asarray(ys, dtype=float)
+        knots = asarray(self.xs, dtype=float)
+
+        i = searchsorted(knots, xs, side="right")
+        lower = maximum(i - 1, 0)
+        inner = (i > 0) & (i < len(knots))
+
+        v0 = self._interpolate_rows(lower, ys)
+        output = v0
+
+        j = i[inner]
+        (x0, x1) = (knots[j - 1], knots[j])
+        v0 = v0[inner]
+        v1 = self._interpolate_rows(j, ys[inner])
+        output[inner] = v0 + (v1 - v0) * (xs[inner] - x0) / (x1 - x0)
+
+        return output
+
+    def _interpolate_rows(self, rows, ys):
+        """
+        Helper function interpolating ys[k] within row rows[k].
+        """
+
+        output = empty(len(ys))
+        if len(ys) <= 0:
+            return output
+
+        # group points by row
+        order = argsort(rows, kind="stable")
+        sorted_rows = rows[order]
+        bounds = [0] + (flatnonzero(diff(sorted_rows)) + 1).tolist() + [len(rows)]
+
+        for (start, end) in zip(bounds[:-1], bounds[1:]):
+            indexes = order[start:end]
+            row = self.yvs[sorted_rows[start]]
+            output[indexes] = row.interpolate_array(ys[indexes])
+
+        return output
+
+
+def _search_segments(knots, lows, highs, values):
+    """
+    Helper function searching each value within its own segment of
+    sorted knots. Returns like searchsorted(..., side="right") on
+    knots[lows[k]:highs[k]], offset by lows[k].
+    """
+
+    lows = lows.copy()
+    highs = highs.copy()
+    last = max(len(knots) - 1, 0)
+
+    active = lows < highs
+    while active.any():
+        middles = (lows + highs) // 2
+        right = active & (knots[minimum(middles, last)] <= values)
+        lows = where(right, middles + 1, lows)
+        highs = where(active & ~right, middles, highs)
+        active = lows < highs
+
+    return lows
+
+
+class PiecewiseBilinearChain:
+    """Chain of PiecewiseBilinear stages flattened into contiguous arrays.
+
+    The first stage maps (xs, ys[0]) to values, and each later stage s
+    maps (values, ys[s]) to new values. Stages changing their first
+    input by at most tol are pruned, and only clip it to the range of
+    their knots instead.
+    """
+
+    def __init__(self, stages, tol=0.0):
+        stage_starts = [0]
+        row_xs = []
+        row_starts = [0]
+        point_ys = []
+        point_vs = []
+        clip_lows = []
+        clip_highs = []
+
+        for stage in stages:
+            clip_lows.append(stage.xs[0])
+            clip_highs.append(stage.xs[-1])
+
+            # within the knot range, f(x, y) - x is linear in x between
+            # rows and piecewise linear in y within rows, so the largest
+            # change is at a knot.
+            change = max(
+                abs(v - x) for (x, row) in zip(stage.xs, stage.yvs) for v in row.vs
+            )
+            if change > tol:
+                for (x, row) in zip(stage.xs, stage.yvs):
+                    row_xs.append(x)
+                    point_ys.extend(row.ys)
+                    point_vs.extend(row.vs)
+                    row_starts.append(len(point_ys))
+
+            stage_starts.append(len(row_xs))
+
+        self.stage_starts = asarray(stage_starts, dtype=int64)
+        self.row_xs = asarray(row_xs, dtype=float)
+        self.row_starts = asarray(row_starts, dtype=int64)
+        self.point_ys = asarray(point_ys, dtype=float)
+        self.point_vs = asarray(point_vs, dtype=float)
+        self.clip_lows = asarray(clip_lows, dtype=float)
+        self.clip_highs = asarray(clip_highs, dtype=float)
+
+    @classmethod
+    def from_arrays(
+        cls, stage_starts, row_xs, row_starts, point_ys, point_vs, clip_lows, clip_highs
+    ):
+        """Return a PiecewiseBilinearChain using flat arrays as returned
+        by to_arrays as is, without copying them.
+        """
+
+        chain = cls.__new__(cls)
+        chain.stage_starts = stage_starts
+        chain.row_xs = row_xs
+        chain.row_starts = row_starts
+        chain.point_ys = point_ys
+        chain.point_vs = point_vs
+        chain.clip_lows = clip_lows
+        chain.clip_highs = clip_highs
+
+        return chain
+
+    def to_arrays(self):
+        """Return a dict of the flat arrays describing this chain, for
+        from_arrays.
+        """
+
+        return {
+            "stage_starts": self.stage_starts,
+            "row_xs": self.row_xs,
+            "row_starts": self.row_starts,
+            "point_ys": self.point_ys,
+            "point_vs": self.point_vs,
+            "clip_lows": self.clip_lows,
+            "clip_highs": self.clip_highs,
+        }
+
+    def __len__(self):
+        return len(self.clip_lows)
+
+    @property
+    def kept(self):
+        """Boolean array flagging the stages that were not pruned."""
+
+        return self.stage_starts[1:] > self.stage_starts[:-1]
+
+    def _interpolate_row(self, row, y):
+        """
+        Helper function interpolating y within one row.
+        """
+
+        (low, high) = (self.row_starts[row], self.row_starts[row + 1])
+        i = bisect_right(self.point_ys, y, low, high)
+        if i == low:
+            return self.point_vs[low]
+        elif i < high:
+            (y0, y1) = (self.point_ys[i - 1], self.point_ys[i])
+            (v0, v1) = (self.point_vs[i - 1], self.point_vs[i])
+            return v0 + (v1 - v0) * (y - y0) / (y1 - y0)
+        else:
+            return self.point_vs[high - 1]
+
+    def _interpolate_rows(self, rows, ys):
+        """
+        Helper function interpolating ys[k] within row rows[k].
+        """
+
+        (lows, highs) = (self.row_starts[rows], self.row_starts[rows + 1])
+        i = _search_segments(self.point_ys, lows, highs, ys)
+        lower = maximum(i - 1, lows)
+        upper = minimum(i, highs - 1)
+
+        output = self.point_vs[lower]
+        inner = lower != upper
+        (y0, y1) = (self.point_ys[lower[inner]], self.point_ys[upper[inner]])
+        (v0, v1) = (output[inner], self.point_vs[upper[inner]])
+        output[inner] = v0 + (v1 - v0) * (ys[inner] - y0) / (y1 - y0)
+
+        return output
+
+    def interpolate(self, x, ys):
+        """Evaluate the chain for one point, returning the same value as
+        interpolate_array without allocating arrays.
+        """
+
+        output = x
+        for s in range(len(self)):
+            (start, end) = (self.stage_starts[s], self.stage_starts[s + 1])
+            if start == end:
+                output = min(max(output, self.clip_lows[s]), self.clip_highs[s])
+                continue
+
+            i = bisect_right(self.row_xs, output, start, end)
+            if i == start:
+                output = self._interpolate_row(start, ys[s])
+            elif i < end:
+                (x0, x1) = (self.row_xs[i - 1], self.row_xs[i])
+                v0 = self._interpolate_row(i - 1, ys[s])
+                v1 = self._interpolate_row(i, ys[s])
+                output = v0 + (v1 - v0) * (output - x0) / (x1 - x0)
+            else:
+                output = self._interpolate_row(end - 1, ys[s])
+
+        return output
+
+    def interpolate_array(self, xs, ys):
+        """Evaluate the chain for arrays of points, matching the stages
+        evaluated one after another with PiecewiseBilinear.interpolate
+        for stages that were not pruned.
+
+        ys[s] is the second input of stage s. It is not used, and may be
+        None, if stage s was pruned.
+        """
+
+        output = asarray(xs, dtype=float)
+        for output in self.staged_interpolate_array(xs, ys):
+            pass
+
+        return output
+
+    def staged_interpolate_array(self, xs, ys):
+        """Yield the output of each stage of interpolate_array in turn.
+        Each stage is only evaluated once its output is requested, so
+        ys only needs entries for the stages evaluated.
+        """
+
+        output = asarray(xs, dtype=float)
+        for s in range(len(self)):
+            (start, end) = (self.stage_starts[s], self.stage_starts[s + 1])
+            if start == end:
+                output = output.clip(self.clip_lows[s], self.clip_highs[s])
+                yield output
+                continue
+
+            stage_ys = asarray(ys[s], dtype=float)
+            i = searchsorted(self.row_xs[start:end], output, side="right")
+            lower = maximum(i - 1, 0)
+            inner = (i > 0) & (i < end - start)
+
+            v0 = self._interpolate_rows(start + lower, stage_ys)
+
+            j = i[inner]
+            (x0, x1) = (self.row_xs[start + j - 1], self.row_xs[start + j])
+            v1 = self._interpolate_rows(start + j, stage_ys[inner])
+            v0_inner = v0[inner]
+            v0[inner] = v0_inner + (v1 - v0_inner) * (output[inner] - x0) / (x1 - x0)
+
+            output = v0
+            yield output
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import subprocess
+import sys
+import unittest
+
+import isoboost
+
+
+class ImportsTestCase(unittest.TestCase):
+    """
+    Test the package imports the regression functions without sklearn and
+    the estimators on first access.
+    """
+
+    def run_python(self, code):
+        return subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True, text=True
+        ).stdout.split()
+
+    def test_00_functions_without_sklearn(self):
+        code = "\n".join(
+            [
+                "import sys",
+                "import isoboost",
+                "f = isoboost.regress_isotonic_1d([0.0, 1.0, 2.0], [0.0, 2.0, 1.0])",
+                "print(f(1.0))",
+                "print('sklearn' in sys.modules)",
+                "isoboost.IsotonicKdRegression",
+                "print('sklearn' in sys.modules)",
+            ]
+        )
+        self.assertEqual(self.run_python(code), ["1.5", "False", "True"])
+
+    def test_01_estimators(self):
+        for name in isoboost.__all__:
+            with self.subTest(name=name):
+                self.assertTrue(callable(getattr(isoboost, name)))
+                self.assertIn(name, dir(isoboost))
+
+        # estimators moved out of the function modules stay importable there.
+        from isoboost.isotonic1d import Isotonic1dRegression
+        from isoboost.isotonic2d import Isotonic2dRegression
+
+        self.assertIs(Isotonic1dRegression, isoboost.Isotonic1dRegression)
+        self.assertIs(Isotonic2dRegression, isoboost.Isotonic2dRegression)
+
+        with self.assertRaises(AttributeError):
+            isoboost.NoSuchRegression
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
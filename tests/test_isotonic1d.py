@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 
+import itertools
+import os
+import random
+import tempfile
 import unittest
+import unittest.mock
 
+import numpy
+
+from isoboost import Isotonic1dRegression
+from isoboost import Isotonic1dStreamingRegression
 from isoboost import regress_isotonic_1d
+from isoboost import regress_isotonic_1d_external
 
 
 class Isotonic1dTestCase(unittest.TestCase):
@@ -157,6 +167,295 @@ class Isotonic1dTestCase(unittest.TestCase):
         self.check_generic(inputs, output)
 
 
+class Isotonic1dL1TestCase(unittest.TestCase):
+    """
+    Test L1 regression against a dynamic program over input values.
+    """
+
+    def optimal_error(self, inputs):
+        # optimal L1 regressions only use input values.
+        levels = sorted(set(v for (_, v, _) in inputs))
+
+        groups = {}
+        for (x, v, w) in inputs:
+            groups.setdefault(x, []).append((v, w))
+
+        # best[j] = least error so far with the last value <= levels[j]
+        best = [0.0] * len(levels)
+        for x in sorted(groups):
+            errors = [
+                best[j] + sum(w * abs(v - levels[j]) for (v, w) in groups[x])
+                for j in range(len(levels))
+            ]
+            best = list(itertools.accumulate(errors, min))
+
+        return best[-1]
+
+    def check_l1(self, inputs):
+        f = regress_isotonic_1d(*zip(*inputs), p=1)
+
+        xs = sorted(set(x for (x, _, w) in inputs if w > 0.0))
+        for i in range(len(xs) - 1):
+            with self.subTest(x=xs[i]):
+                self.assertLessEqual(f(xs[i]), f(xs[i + 1]))
+
+        actual = sum(w * abs(v - f(x)) for (x, v, w) in inputs)
+        self.assertAlmostEqual(
+            actual, self.optimal_error([r for r in inputs if r[2] > 0.0])
+        )
+
+    def test_00_simple(self):
+        f = regress_isotonic_1d([0, 1, 2, 3], [1.0, 5.0, 2.0, 3.0], p=1)
+
+        self.assertEqual(f(0), 1.0)
+        self.assertEqual(f(1), 2.0)
+        self.assertEqual(f(2), 2.0)
+        self.assertEqual(f(3), 3.0)
+
+    def test_01_weighted_median(self):
+        f = regress_isotonic_1d([0, 1, 2], [3.0, 2.0, 0.0], [1.0, 3.0, 1.0], p=1)
+
+        for x in (0, 1, 2):
+            with self.subTest(x=x):
+                self.assertEqual(f(x), 2.0)
+
+    def test_02_random(self):
+        rng = random.Random(3700)
+        for _ in range(50):
+            n = rng.randint(1, 30)
+            inputs = [
+                (
+                    rng.randint(0, 10),
+                    rng.randint(0, 5) + rng.choice((0.0, rng.random())),
+                    rng.choice((0.0, 0.5, 1.0, 2.0, 3.0)),
+                )
+                for _ in range(n)
+            ]
+            if any(w > 0.0 for (_, _, w) in inputs):
+                self.check_l1(inputs)
+
+    def test_03_not_implemented(self):
+        with self.assertRaises(NotImplementedError):
+            regress_isotonic_1d([0, 1], [1.0, 0.0], p=1, n_values=1)
+        with self.assertRaises(ValueError):
+            regress_isotonic_1d([0, 1], [1.0, 0.0], p=3)
+
+
+class Isotonic1dExternalTestCase(unittest.TestCase):
+    """
+    Test out-of-core fitting against the in-memory regression.
+    """
+
+    def make_inputs(self, seed, n):
+        rng = numpy.random.default_rng(seed)
+
+        xs = rng.integers(0, n // 3, n).astype(float)
+        vs = xs / n + rng.random(n)
+        ws = rng.choice((0.0, 0.5, 1.0, 2.0), n)
+
+        return (xs, vs, ws)
+
+    def check_external(self, inputs, actual):
+        expected = regress_isotonic_1d(*inputs)
+
+        for x in numpy.unique(inputs[0][inputs[2] > 0.0]):
+            with self.subTest(x=x):
+                self.assertAlmostEqual(actual(x), expected(x))
+
+    def test_00_in_memory(self):
+        inputs = self.make_inputs(3600, 500)
+
+        self.check_external(inputs, regress_isotonic_1d_external(*inputs))
+
+    def test_01_runs(self):
+        inputs = self.make_inputs(3610, 500)
+
+        self.check_external(
+            inputs, regress_isotonic_1d_external(*inputs, chunk_size=50)
+        )
+
+    def test_02_merge_passes(self):
+        inputs = self.make_inputs(3620, 3000)
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_external(
+                inputs,
+                regress_isotonic_1d_external(
+                    *inputs, chunk_size=20, temp_dir=directory
+                ),
+            )
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_03_npy_files(self):
+        inputs = self.make_inputs(3630, 1000)
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for (name, a) in zip(("xs", "vs", "ws"), inputs):
+                paths.append(os.path.join(directory, name + ".npy"))
+                numpy.save(paths[-1], a)
+
+            f = regress_isotonic_1d_external(*paths, chunk_size=64)
+            self.check_external(inputs, f)
+
+            f = regress_isotonic_1d_external(paths[0], paths[1], chunk_size=64)
+            self.check_external(inputs[:2] + (numpy.ones(1000),), f)
+
+    def test_04_mismatch(self):
+        with self.assertRaises(ValueError):
+            regress_isotonic_1d_external([1.0, 2.0], [1.0])
+        with self.assertRaises(ValueError):
+            regress_isotonic_1d_external([1.0], [1.0], chunk_size=0)
+
+
+class Isotonic1dRegressionTestCase(unittest.TestCase):
+    """
+    Test incremental fitting with Isotonic1dRegression.
+    """
+
+    def check_partial_fit(self, batches):
+        model = Isotonic1dRegression()
+
+        seen = []
+        for batch in batches:
+            model.partial_fit(*zip(*batch))
+            seen.extend(batch)
+
+            expected = regress_isotonic_1d(*zip(*seen))
+            test_xs = sorted(set(r[0] for r in seen))
+            test_xs += [test_xs[0] - 1.0, test_xs[-1] + 1.0]
+
+            for (x, v) in zip(test_xs, model.predict(test_xs)):
+                with self.subTest(n=len(seen), x=x):
+                    self.assertAlmostEqual(v, expected(x))
+
+    def test_00_fit(self):
+        model = Isotonic1dRegression(n_values=2)
+        model.fit([[1.0], [2.0], [3.0], [4.0]], [1.1, 1.2, 1.3, 1.4])
+
+        self.assertEqual(list(model.predict([0.5, 2.5, 4.5])), [1.15, 1.25, 1.35])
+
+    def test_01_appends(self):
+        self.check_partial_fit([[(float(x), float(x % 3), 1.0)] for x in range(30)])
+
+    def test_02_interior(self):
+        rng = random.Random(3200)
+        batches = [[(float(x), rng.random(), 1.0) for x in range(0, 100, 2)]]
+        for _ in range(30):
+            batches.append(
+                [
+                    (rng.randint(-5, 105) * 0.5, rng.random() * 3.0, rng.random())
+                    for _ in range(rng.randint(1, 3))
+                ]
+            )
+
+        self.check_partial_fit(batches)
+
+    def test_03_large_batches(self):
+        rng = random.Random(3201)
+        batches = [
+            [(rng.random(), rng.random(), 1.0) for _ in range(rng.randint(1, 20))]
+            for _ in range(10)
+        ]
+
+        self.check_partial_fit(batches)
+
+    def test_04_few_buckets(self):
+        # appends and small interior updates repair a few buckets without
+        # rebuilding all of them.
+        xs = [float(x) for x in range(2000)]
+        model = Isotonic1dRegression()
+        model.fit(xs, [float(x // 250) for x in range(2000)])
+        self.assertEqual(len(model.bucket_sums_), 8)
+
+        with unittest.mock.patch.object(
+            model, "_rebuild", wraps=model._rebuild
+        ) as rebuild:
+            model.partial_fit([2000.0], [8.0])
+            model.partial_fit([10.5], [0.0])
+            self.assertEqual(rebuild.call_count, 0)
+
+        expected = regress_isotonic_1d(
+            xs + [2000.0, 10.5], [float(x // 250) for x in range(2000)] + [8.0, 0.0]
+        )
+        for (x, v) in zip(xs, model.predict(xs)):
+            self.assertAlmostEqual(v, expected(x))
+
+
+class Isotonic1dStreamingRegressionTestCase(unittest.TestCase):
+    """
+    Test streaming calibration with Isotonic1dStreamingRegression.
+    """
+
+    def check_ticks(self, model, ticks):
+        rng = random.Random(3300)
+
+        seen = []
+        for i in range(ticks):
+            batch = [
+                (rng.randint(0, 20) * 0.5, rng.random() * 3.0, rng.random() + 0.5)
+                for _ in range(rng.randint(0, 4))
+            ]
+            if batch:
+                model.partial_fit(*zip(*batch))
+            else:
+                model.partial_fit([], [])
+            seen.append(batch)
+
+            # reference fit with explicitly decayed weights
+            if model.window is not None:
+                seen = seen[-model.window :]
+            decay = model.decay or 1.0
+            inputs = [
+                (x, v, w * decay ** (len(seen) - 1 - t))
+                for (t, batch) in enumerate(seen)
+                for (x, v, w) in batch
+            ]
+            if not inputs:
+                continue
+
+            expected = regress_isotonic_1d(*zip(*inputs))
+
+            test_xs = [x * 0.25 for x in range(-1, 43)]
+            for (x, v) in zip(test_xs, model.predict(test_xs)):
+                with self.subTest(i=i, x=x):
+                    self.assertAlmostEqual(v, expected(x))
+
+    def test_00_decay(self):
+        self.check_ticks(Isotonic1dStreamingRegression(decay=0.8), 40)
+
+    def test_01_window(self):
+        self.check_ticks(Isotonic1dStreamingRegression(window=5), 40)
+
+    def test_02_decay_window(self):
+        self.check_ticks(Isotonic1dStreamingRegression(decay=0.5, window=10), 40)
+
+    def test_03_piecewise_cached(self):
+        model = Isotonic1dStreamingRegression(window=2)
+        model.partial_fit([0.0, 1.0], [1.0, 2.0])
+
+        piecewise = model.piecewise()
+        self.assertIs(model.piecewise(), piecewise)
+        self.assertEqual(piecewise.interpolate(0.5), 1.5)
+
+        model.partial_fit([1.0], [0.0])
+        model.partial_fit([], [])
+        self.assertIsNot(model.piecewise(), piecewise)
+        self.assertEqual(list(model.predict([0.0, 1.0])), [0.0, 0.0])
+
+    def test_04_long_decay(self):
+        # x values not seen for long are dropped instead of their weights
+        # underflowing to 0.
+        for window in (None, 2000):
+            model = Isotonic1dStreamingRegression(decay=0.5, window=window)
+            model.partial_fit([0.0, 2.0], [0.0, 2.0])
+            for i in range(3000):
+                model.partial_fit([1.0], [1.0 + i % 2])
+
+            self.assertEqual(model.xs_, [1.0])
+            self.assertAlmostEqual(model.predict([1.0])[0], 5.0 / 3.0)
+
+
 ############################################################
 # startup handling #########################################
 ############################################################
@@ -1,11 +1,19 @@
 #!/usr/bin/env python3
 
+import random
 import unittest
+import unittest.mock
+
+import numpy
+from sklearn.isotonic import isotonic_regression
 
 from isoboost import Isotonic2dRegression
 from isoboost import regress_isotonic_2d
 from isoboost import regress_isotonic_2d_l1
 from isoboost import regress_isotonic_2d_l2
+from isoboost.isotonic2d import _build_output_function
+from isoboost.isotonic2d import _weighted_error
+from isoboost.isotonicgrid import _regress_isotonic_grid_rows
 
 
 class Isotonic2dBase(object):
@@ -215,6 +223,192 @@ class Isotonic2dTestCase(Isotonic2dL2TestCase):
         return regress_isotonic_2d(*zip(*training_data), n_values=n_values)
 
 
+class Isotonic2dBinnedTestCase(Isotonic2dL2TestCase):
+    """
+    Test regress_isotonic_2d with enough bins to be exact.
+    """
+
+    def fit(self, training_data, *, n_values=None):
+        return regress_isotonic_2d(
+            *zip(*training_data), n_values=n_values, max_bins=1000
+        )
+
+    def test_30_binned_stats(self):
+        xs = [x for x in range(8) for y in range(8)]
+        ys = [y for x in range(8) for y in range(8)]
+        vs = [x * y % 5 for x in range(8) for y in range(8)]
+
+        (f, stats) = regress_isotonic_2d(xs, ys, vs, max_bins=3, return_stats=True)
+
+        self.assertEqual(stats["n_cells"], 9)
+
+        expected_error = sum((v - f(x, y)) ** 2 for (x, y, v) in zip(xs, ys, vs))
+        expected_error /= len(vs)
+        self.assertAlmostEqual(stats["error"], expected_error)
+
+    def test_31_exact_stats(self):
+        (f, stats) = regress_isotonic_2d(
+            [0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [2.0, 1.0, 3.0], return_stats=True
+        )
+
+        self.assertNotIn("n_cells", stats)
+        self.assertAlmostEqual(stats["error"], (0.25 + 0.25 + 0.0) / 3.0)
+
+    def test_32_error_computed_once(self):
+        data = ([0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [2.0, 1.0, 3.0])
+
+        with unittest.mock.patch(
+            "isoboost.isotonic2d._weighted_error", wraps=_weighted_error
+        ) as error:
+            regress_isotonic_2d(*data)
+            self.assertEqual(error.call_count, 0)
+
+            regress_isotonic_2d(*data, return_stats=True)
+            self.assertEqual(error.call_count, 1)
+
+            regress_isotonic_2d(*data, max_bins=2, return_stats=True)
+            self.assertEqual(error.call_count, 2)
+
+    def test_33_estimator_stats(self):
+        X = [(0.0, 0.0), (0.0, 1.0), (1.0, 0.0)]
+        y = [2.0, 1.0, 3.0]
+
+        with unittest.mock.patch(
+            "isoboost.isotonic2d._weighted_error", wraps=_weighted_error
+        ) as error:
+            model = Isotonic2dRegression()
+            model.fit(X, y)
+            self.assertEqual(error.call_count, 0)
+            self.assertIsNone(model.stats_)
+
+            model = Isotonic2dRegression(max_bins=2)
+            model.fit(X, y)
+            self.assertEqual(error.call_count, 1)
+            self.assertIn("error", model.stats_)
+
+
+class Isotonic2dCoarseTestCase(Isotonic2dL2TestCase):
+    """
+    Test regress_isotonic_2d_l2 seeded by a coarse regression.
+    """
+
+    def fit(self, training_data, *, n_values=None):
+        return regress_isotonic_2d_l2(
+            *zip(*training_data), n_values=n_values, coarse_bins=2
+        )
+
+    def test_30_matches_exact(self):
+        rng = random.Random(2900)
+        for _ in range(10):
+            xs = [rng.random() for _ in range(60)]
+            ys = [rng.random() for _ in range(60)]
+            vs = [rng.expovariate(1.0) * (x + y) for (x, y) in zip(xs, ys)]
+
+            expected = regress_isotonic_2d_l2(xs, ys, vs)
+            actual = regress_isotonic_2d_l2(xs, ys, vs, coarse_bins=4)
+
+            for (x, y) in zip(xs, ys):
+                self.assertAlmostEqual(actual(x, y), expected(x, y))
+
+
+class Isotonic2dTolTestCase(Isotonic2dL2TestCase):
+    """
+    Test regress_isotonic_2d_l2 with a tolerance below the test precision.
+    """
+
+    def fit(self, training_data, *, n_values=None):
+        return regress_isotonic_2d_l2(*zip(*training_data), n_values=n_values, tol=1e-9)
+
+    def test_30_gap(self):
+        rng = random.Random(3000)
+        for tol in (0.5, 0.1, 0.01):
+            xs = [rng.random() for _ in range(100)]
+            ys = [rng.random() for _ in range(100)]
+            vs = [x + y + rng.random() for (x, y) in zip(xs, ys)]
+
+            (_, exact) = regress_isotonic_2d(xs, ys, vs, return_stats=True)
+            (f, stats) = regress_isotonic_2d(xs, ys, vs, tol=tol, return_stats=True)
+
+            with self.subTest(tol=tol):
+                self.assertGreaterEqual(stats["error"], exact["error"] - 1e-12)
+                self.assertLessEqual(
+                    stats["error"], exact["error"] + stats["gap"] + 1e-12
+                )
+                self.assertLessEqual(stats["gap"], tol ** 2 / 4.0)
+
+                # still isotonic
+                for (x0, y0) in zip(xs, ys):
+                    for (x1, y1) in zip(xs, ys):
+                        if x0 <= x1 and y0 <= y1:
+                            self.assertLessEqual(f(x0, y0), f(x1, y1))
+
+    def test_31_exact_gap(self):
+        (_, stats) = regress_isotonic_2d_l2(
+            [0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [2.0, 1.0, 3.0], return_stats=True
+        )
+
+        self.assertEqual(stats["gap"], 0.0)
+        self.assertAlmostEqual(stats["error"], (0.25 + 0.25 + 0.0) / 3.0)
+
+
+class Isotonic2dRoundsTestCase(Isotonic2dL2TestCase):
+    """
+    Test regress_isotonic_2d_l2 with enough rounds to be exact.
+    """
+
+    def fit(self, training_data, *, n_values=None):
+        return regress_isotonic_2d_l2(
+            *zip(*training_data), n_values=n_values, max_rounds=1000
+        )
+
+    def test_30_rounds(self):
+        rng = random.Random(3100)
+        xs = [rng.random() for _ in range(100)]
+        ys = [rng.random() for _ in range(100)]
+        vs = [x + y + rng.random() for (x, y) in zip(xs, ys)]
+
+        (_, exact) = regress_isotonic_2d(xs, ys, vs, return_stats=True)
+        self.assertEqual(exact["n_open_partitions"], 0)
+
+        last_error = None
+        for max_rounds in range(exact["n_rounds"] + 1):
+            (f, stats) = regress_isotonic_2d(
+                xs, ys, vs, max_rounds=max_rounds, return_stats=True
+            )
+
+            with self.subTest(max_rounds=max_rounds):
+                self.assertEqual(stats["n_rounds"], max_rounds)
+                self.assertLessEqual(
+                    stats["error"], exact["error"] + stats["gap"] + 1e-12
+                )
+                if last_error is not None:
+                    self.assertLessEqual(stats["error"], last_error + 1e-12)
+                last_error = stats["error"]
+
+                # still isotonic
+                for (x0, y0) in zip(xs, ys):
+                    for (x1, y1) in zip(xs, ys):
+                        if x0 <= x1 and y0 <= y1:
+                            self.assertLessEqual(f(x0, y0), f(x1, y1))
+
+        self.assertAlmostEqual(last_error, exact["error"])
+        self.assertEqual(stats["n_open_partitions"], 0)
+
+    def test_31_no_time(self):
+        (f, stats) = regress_isotonic_2d_l2(
+            [0.0, 0.0, 1.0],
+            [0.0, 1.0, 0.0],
+            [2.0, 1.0, 3.0],
+            time_budget=0.0,
+            return_stats=True,
+        )
+
+        self.assertEqual(stats["n_open_partitions"], 1)
+        self.assertAlmostEqual(f(0.0, 0.0), 2.0)
+        self.assertAlmostEqual(f(1.0, 0.0), 2.0)
+        self.assertAlmostEqual(stats["gap"], 3.0 * (3.0 - 1.0) ** 2 / 4.0 / 3.0)
+
+
 class Isotonic2dRegressionTestCase(Isotonic2dTestCase):
     """
     Test Isotonic2dRegression.
@@ -226,6 +420,156 @@ class Isotonic2dRegressionTestCase(Isotonic2dTestCase):
 
         return lambda x, y: model.predict([(x, y)])[0]
 
+    def test_40_transform(self):
+        # vectorized interpolation matches the output function exactly.
+        rng = random.Random(4140)
+        X = [(rng.randint(0, 9), rng.random()) for _ in range(200)]
+        v = [x + y + rng.random() for (x, y) in X]
+
+        model = Isotonic2dRegression()
+        model.fit(X, v)
+
+        T = [(rng.uniform(-1.0, 10.0), rng.uniform(-0.1, 1.1)) for _ in range(300)]
+        T += X
+        expected = [model.f_(x, y) for (x, y) in T]
+        self.assertEqual(model.transform(T).tolist(), expected)
+
+
+class Isotonic2dOutputTestCase(unittest.TestCase):
+    """
+    Test output functions reproduce the regressed values.
+    """
+
+    def test_00_level_set_end(self):
+        # the value carried from (0, 3) is replaced by a larger value at
+        # (1, 3) right after the level set of 1 ending at (1, 2).
+        regressed = {
+            (0.0, 0.0): 0.0,
+            (0.0, 3.0): 1.0,
+            (1.0, 1.0): 1.0,
+            (1.0, 2.0): 1.0,
+            (1.0, 3.0): 2.0,
+        }
+
+        f = _build_output_function(regressed)
+        for ((x, y), v) in regressed.items():
+            with self.subTest(x=x, y=y):
+                self.assertEqual(f(x, y), v)
+
+    def test_01_random_level_sets(self):
+        # isotonic values with few levels make long level sets, whose
+        # ends are often replaced by values carried from previous rows.
+        rng = random.Random(3920)
+        for _ in range(200):
+            n = rng.randint(1, 30)
+            points = set((rng.randint(0, 5), rng.randint(0, 5)) for _ in range(n))
+            levels = {(x, y): (x + y + rng.randint(0, 1)) // 3 for (x, y) in points}
+            regressed = {
+                (float(x1), float(y1)): float(
+                    max(v for ((x0, y0), v) in levels.items() if x0 <= x1 and y0 <= y1)
+                )
+                for (x1, y1) in points
+            }
+
+            f = _build_output_function(regressed)
+            for ((x, y), v) in regressed.items():
+                with self.subTest(regressed=regressed, x=x, y=y):
+                    self.assertEqual(f(x, y), v)
+
+
+class Isotonic2dDykstraTestCase(unittest.TestCase):
+    """
+    Test regress_isotonic_2d_l2 with alternating projections.
+    """
+
+    def test_00_matches_exact(self):
+        rng = random.Random(3910)
+        for _ in range(10):
+            n = rng.randint(1, 40)
+            xs = [rng.randint(0, 6) for _ in range(n)]
+            ys = [rng.randint(0, 6) for _ in range(n)]
+            vs = [x + y + 10.0 * rng.random() for (x, y) in zip(xs, ys)]
+            ws = [rng.choice((0.5, 1.0, 2.0)) for _ in range(n)]
+
+            expected = regress_isotonic_2d_l2(xs, ys, vs, ws)
+            actual = regress_isotonic_2d_l2(
+                xs, ys, vs, ws, method="dykstra", tol=1e-12, max_rounds=100000
+            )
+
+            for (x, y) in zip(xs, ys):
+                with self.subTest(x=x, y=y):
+                    self.assertAlmostEqual(actual(x, y), expected(x, y), places=4)
+
+    def test_01_gap(self):
+        rng = random.Random(3900)
+        xs = [rng.randint(0, 20) for _ in range(300)]
+        ys = [rng.randint(0, 20) for _ in range(300)]
+        vs = [x + y + 10.0 * rng.random() for (x, y) in zip(xs, ys)]
+
+        (_, exact) = regress_isotonic_2d(xs, ys, vs, return_stats=True)
+
+        for max_rounds in (1, 10, 100):
+            (f, stats) = regress_isotonic_2d(
+                xs, ys, vs, method="dykstra", max_rounds=max_rounds, return_stats=True
+            )
+
+            with self.subTest(max_rounds=max_rounds):
+                self.assertEqual(stats["n_rounds"], len(stats["gaps"]))
+                self.assertLessEqual(stats["n_rounds"], max_rounds)
+                self.assertEqual(stats["gap"], stats["gaps"][-1])
+                self.assertLessEqual(
+                    stats["error"], exact["error"] + stats["gap"] + 1e-9
+                )
+
+                # still isotonic
+                for (x0, y0) in zip(xs, ys):
+                    for (x1, y1) in zip(xs, ys):
+                        if x0 <= x1 and y0 <= y1:
+                            self.assertLessEqual(f(x0, y0), f(x1, y1) + 1e-12)
+
+    def test_02_unsupported(self):
+        with self.assertRaises(ValueError):
+            regress_isotonic_2d_l2([0.0], [0.0], [1.0], method="other")
+        with self.assertRaises(NotImplementedError):
+            regress_isotonic_2d_l2([0.0], [0.0], [1.0], method="dykstra", coarse_bins=2)
+        with self.assertRaises(NotImplementedError):
+            regress_isotonic_2d([0.0], [0.0], [1.0], p=1, method="dykstra")
+
+    def test_03_row_precision(self):
+        # many rows far apart in value must not lose precision to the
+        # shifts keeping their level sets apart.
+        rng = numpy.random.default_rng(3930)
+        values = rng.random((2000, 20)) * 1e-3
+        values += 1e3 * numpy.arange(2000)[:, numpy.newaxis]
+        weights = rng.random((2000, 20)) + 0.1
+
+        regressed = _regress_isotonic_grid_rows(values, weights)
+        for (row, v, w) in zip(regressed, values, weights):
+            numpy.testing.assert_allclose(
+                row, isotonic_regression(v, sample_weight=w), rtol=0.0, atol=1e-8
+            )
+
+
+class Isotonic2dPredictOneTestCase(unittest.TestCase):
+    """
+    Test Isotonic2dRegression.predict_one matches predict exactly.
+    """
+
+    def test_00_matches_predict(self):
+        rng = random.Random(5000)
+        X = [(rng.random(), rng.random()) for _ in range(200)]
+        v = [x + y + rng.random() for (x, y) in X]
+
+        model = Isotonic2dRegression()
+        model.fit(X, v)
+
+        T = [(rng.uniform(-0.1, 1.1), rng.uniform(-0.1, 1.1)) for _ in range(200)]
+        expected = model.predict(T)
+        for ((x, y), e) in zip(T, expected):
+            with self.subTest(x=x, y=y):
+                self.assertEqual(model.predict_one(x, y), e)
+                self.assertEqual(model.predict_row((x, y)), e)
+
 
 ############################################################
 # startup handling #########################################
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+from isoboost import regress_isotonic_2d_grid
+from isoboost.isotonic2d import _regress_isotonic_2d_l2_grid
+from isoboost.isotonic2d import _regress_isotonic_2d_l2_partition
+
+
+class Isotonic2dGridTestCase(unittest.TestCase):
+    """
+    Test case for the complete grid fast path.
+    """
+
+    def check_matches_partition(self, inputs):
+        expected = _regress_isotonic_2d_l2_partition(inputs)
+        actual = _regress_isotonic_2d_l2_grid(inputs)
+
+        self.assertEqual(set(actual.keys()), set(expected.keys()))
+        for k in expected:
+            with self.subTest(k=k):
+                self.assertAlmostEqual(actual[k], expected[k])
+
+    def test_00_singleton_row(self):
+        self.check_matches_partition([(0.0, 0.0, 2.0, 1.0), (0.0, 1.0, 1.0, 3.0)])
+
+    def test_01_random(self):
+        rng = random.Random(2609)
+        for _ in range(50):
+            n_x = rng.randint(1, 6)
+            n_y = rng.randint(1, 6)
+            inputs = [
+                (x, y, rng.random(), rng.choice((1.0, rng.random() + 0.1)))
+                for x in range(n_x)
+                for y in range(n_y)
+            ]
+            self.check_matches_partition(inputs)
+
+    def test_02_random_levels(self):
+        """Few distinct input values produce many ties in the binary splits.
+        """
+
+        rng = random.Random(2610)
+        for _ in range(50):
+            n_x = rng.randint(1, 6)
+            n_y = rng.randint(1, 6)
+            inputs = [
+                (x, y, float(rng.randint(0, 2)), 1.0)
+                for x in range(n_x)
+                for y in range(n_y)
+            ]
+            self.check_matches_partition(inputs)
+
+    def test_10_explicit_grid(self):
+        vs = [[1.0, 0.0, 2.0], [0.0, 3.0, 5.0]]
+        ws = [[1.0, 1.0, 1.0], [1.0, 1.0, 2.0]]
+
+        f = regress_isotonic_2d_grid(vs, ws, xs=[10.0, 20.0], ys=[1.0, 2.0, 3.0])
+
+        self.assertAlmostEqual(f(10.0, 1.0), 1.0 / 3.0)
+        self.assertAlmostEqual(f(10.0, 2.0), 1.0 / 3.0)
+        self.assertAlmostEqual(f(10.0, 3.0), 2.0)
+        self.assertAlmostEqual(f(20.0, 1.0), 1.0 / 3.0)
+        self.assertAlmostEqual(f(20.0, 2.0), 3.0)
+        self.assertAlmostEqual(f(20.0, 3.0), 5.0)
+
+    def test_11_explicit_grid_reduced(self):
+        f = regress_isotonic_2d_grid([[0.0, 1.0], [1.0, 2.0]], n_values=1)
+
+        for x in (0, 1):
+            for y in (0, 1):
+                with self.subTest(x=x, y=y):
+                    self.assertAlmostEqual(f(x, y), 1.0)
+
+    def test_12_bad_coordinates(self):
+        with self.assertRaises(ValueError):
+            regress_isotonic_2d_grid([[0.0, 1.0]], xs=[0.0, 1.0])
+        with self.assertRaises(ValueError):
+            regress_isotonic_2d_grid([[0.0, 1.0]], ys=[1.0, 0.0])
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
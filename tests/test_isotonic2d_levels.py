@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import math
+import random
+import unittest
+
+from isoboost import regress_isotonic_2d_l2
+from isoboost.isotonic2d import _prune_extreme_levels
+from isoboost.isotonic2d import _regress_isotonic_2d_l2_partition
+
+
+class Isotonic2dLevelsTestCase(unittest.TestCase):
+    """
+    Test case for the few level fast path.
+    """
+
+    def check_matches_partition(self, inputs):
+        expected = _regress_isotonic_2d_l2_partition(inputs)
+        actual = _regress_isotonic_2d_l2_partition(inputs, few_levels=True)
+
+        self.assertEqual(set(actual.keys()), set(expected.keys()))
+        for k in expected:
+            with self.subTest(k=k):
+                self.assertAlmostEqual(actual[k], expected[k])
+
+    def test_00_prune(self):
+        inputs = [
+            (0.0, 0.0, 0.0, 1.0),
+            (0.0, 1.0, 1.0, 1.0),
+            (1.0, 0.0, 1.0, 1.0),
+            (1.0, 1.0, 0.0, 1.0),
+            (2.0, 2.0, 1.0, 1.0),
+        ]
+
+        (pruned, remaining) = _prune_extreme_levels(inputs)
+
+        self.assertEqual(pruned, {(0.0, 0.0): 0.0, (2.0, 2.0): 1.0})
+        self.assertEqual(remaining, inputs[1:4])
+
+    def test_01_prune_single_level(self):
+        inputs = [(0.0, 1.0, 2.0, 1.0), (1.0, 0.0, 2.0, 3.0)]
+
+        (pruned, remaining) = _prune_extreme_levels(inputs)
+
+        self.assertEqual(pruned, {(0.0, 1.0): 2.0, (1.0, 0.0): 2.0})
+        self.assertEqual(remaining, [])
+
+    def test_02_random_sparse(self):
+        rng = random.Random(2701)
+        for _ in range(100):
+            vertexes = {
+                (float(rng.randint(0, 8)), float(rng.randint(0, 8))): (
+                    float(rng.randint(0, 2)),
+                    rng.choice((1.0, rng.random() + 0.1)),
+                )
+                for _ in range(rng.randint(1, 30))
+            }
+            inputs = [(x, y, v, w) for ((x, y), (v, w)) in vertexes.items()]
+            self.check_matches_partition(inputs)
+
+    def test_03_binary_labels(self):
+        rng = random.Random(2702)
+
+        vertexes = {}
+        for _ in range(300):
+            x = rng.random()
+            y = rng.random()
+            p = 1.0 / (1.0 + math.exp(-4.0 * (x + y - 1.0)))
+            vertexes[(x, y)] = 1.0 if rng.random() < p else 0.0
+
+        inputs = [(x, y, v, 1.0) for ((x, y), v) in vertexes.items()]
+        self.check_matches_partition(inputs)
+
+    def test_10_binary_labels_duplicates(self):
+        # duplicate vertexes with mixed labels
+        f = regress_isotonic_2d_l2(
+            [0.0, 0.0, 0.0, 1.0, 1.0], [0.0, 0.0, 0.0, 1.0, 1.0], [1, 0, 0, 1, 1]
+        )
+
+        self.assertAlmostEqual(f(0.0, 0.0), 1.0 / 3.0)
+        self.assertAlmostEqual(f(1.0, 1.0), 1.0)
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
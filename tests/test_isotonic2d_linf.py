@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import math
+import random
+import unittest
+from unittest import mock
+
+from isoboost import regress_isotonic_2d
+from isoboost import regress_isotonic_2d_linf
+
+
+class Isotonic2dLinfTestCase(unittest.TestCase):
+    """
+    Test L-infinity regression against the error forced by pairs of
+    inputs.
+    """
+
+    def check_linf(self, inputs):
+        f = regress_isotonic_2d_linf(*zip(*inputs))
+
+        # zero weights do not constrain the regression.
+        inputs = [r for r in inputs if r[3] > 0.0]
+
+        # any pair with t below u and v_t > v_u forces this error.
+        optimal = 0.0
+        for (xt, yt, vt, wt) in inputs:
+            for (xu, yu, vu, wu) in inputs:
+                if xt <= xu and yt <= yu:
+                    optimal = max(optimal, (vt - vu) / (1.0 / wt + 1.0 / wu))
+
+        for (xt, yt, _, _) in inputs:
+            for (xu, yu, _, _) in inputs:
+                if xt <= xu and yt <= yu:
+                    with self.subTest(t=(xt, yt), u=(xu, yu)):
+                        self.assertLessEqual(f(xt, yt), f(xu, yu))
+
+        actual = max(w * abs(v - f(x, y)) for (x, y, v, w) in inputs)
+        self.assertAlmostEqual(actual, optimal)
+
+    def test_00_simple(self):
+        f = regress_isotonic_2d(
+            [0.0, 0.0, 1.0, 1.0], [0.0, 1.0, 0.0, 1.0], [0.0, 3.0, 1.0, 2.0], p=math.inf
+        )
+
+        self.assertEqual(f(0.0, 0.0), 0.0)
+        self.assertEqual(f(0.0, 1.0), 2.5)
+        self.assertEqual(f(1.0, 0.0), 1.0)
+        self.assertEqual(f(1.0, 1.0), 2.5)
+
+    def test_01_random(self):
+        rng = random.Random(3800)
+        for _ in range(50):
+            n = rng.randint(1, 40)
+            inputs = [
+                (rng.randint(0, 5), rng.randint(0, 5), rng.random(), 1.0)
+                for _ in range(n)
+            ]
+            self.check_linf(inputs)
+
+    def test_02_random_weighted(self):
+        rng = random.Random(3810)
+        for _ in range(50):
+            n = rng.randint(1, 40)
+            inputs = [
+                (
+                    rng.randint(0, 5),
+                    rng.randint(0, 5),
+                    rng.random(),
+                    rng.choice((0.0, 0.5, 1.0, 3.0, rng.random() + 0.1)),
+                )
+                for _ in range(n)
+            ]
+            if any(w > 0.0 for (_, _, _, w) in inputs):
+                self.check_linf(inputs)
+
+    def test_03_bisection(self):
+        # the fallback after too many passes finds the same error.
+        rng = random.Random(3830)
+        for passes in (0, 1):
+            with mock.patch("isoboost.isotonic2d._LINF_PASSES", passes):
+                for _ in range(30):
+                    n = rng.randint(1, 40)
+                    inputs = [
+                        (
+                            rng.randint(0, 5),
+                            rng.randint(0, 5),
+                            rng.random(),
+                            rng.choice((0.0, 0.5, 1.0, 3.0, rng.random() + 0.1)),
+                        )
+                        for _ in range(n)
+                    ]
+                    if any(w > 0.0 for (_, _, _, w) in inputs):
+                        self.check_linf(inputs)
+
+    def test_04_not_implemented(self):
+        with self.assertRaises(NotImplementedError):
+            regress_isotonic_2d([0.0], [0.0], [1.0], p=math.inf, n_values=1)
+        with self.assertRaises(ValueError):
+            regress_isotonic_2d([0.0], [0.0], [1.0], p=3)
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
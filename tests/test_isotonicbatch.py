@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+from isoboost import regress_isotonic_1d
+from isoboost import regress_isotonic_1d_batch
+from isoboost import regress_isotonic_2d_l2
+from isoboost import regress_isotonic_2d_l2_batch
+
+
+class IsotonicBatchTestCase(unittest.TestCase):
+    """
+    Test batches against separate regressions of each group.
+    """
+
+    def make_inputs(self, seed, n_groups, n):
+        rng = random.Random(seed)
+
+        groups = [rng.randrange(n_groups) for _ in range(n)]
+        xs = [rng.randint(0, 9) for _ in range(n)]
+        ys = [rng.randint(0, 9) for _ in range(n)]
+        vs = [
+            g * 100.0 + x + y + rng.random() * 8.0 for (g, x, y) in zip(groups, xs, ys)
+        ]
+        ws = [rng.choice((0.0, 0.5, 1.0, 2.0)) for _ in range(n)]
+
+        return (groups, xs, ys, vs, ws)
+
+    def check_batch(self, batch, expected, groups, queries):
+        self.assertEqual(sorted(batch), sorted(expected))
+        for g in expected:
+            self.assertIn(g, batch)
+            for q in queries:
+                with self.subTest(g=g, q=q):
+                    self.assertAlmostEqual(batch[g](*q), expected[g](*q))
+
+        predicted = batch.predict(groups, *zip(*queries))
+        for (g, q, p) in zip(groups, queries, predicted):
+            with self.subTest(g=g, q=q):
+                self.assertAlmostEqual(p, expected[g](*q))
+
+    def test_00_1d(self):
+        (groups, xs, _, vs, ws) = self.make_inputs(4000, 30, 500)
+
+        expected = {}
+        for g in set(groups):
+            keep = [i for i in range(len(xs)) if groups[i] == g and ws[i] > 0.0]
+            if keep:
+                expected[g] = regress_isotonic_1d(
+                    [xs[i] for i in keep], [vs[i] for i in keep], [ws[i] for i in keep]
+                )
+
+        batch = regress_isotonic_1d_batch(groups, xs, vs, ws)
+        self.assertEqual(batch.ndim, 1)
+
+        rng = random.Random(4001)
+        queries = [(rng.uniform(-1.0, 10.0),) for _ in range(200)]
+        query_groups = [rng.choice(sorted(expected)) for _ in queries]
+        self.check_batch(batch, expected, query_groups, queries)
+
+    def test_01_1d_string_groups(self):
+        batch = regress_isotonic_1d_batch(
+            ["b", "a", "b", "a", "c"], [1, 1, 2, 2, 1], [3.0, 1.0, 1.0, 2.0, 5.0]
+        )
+
+        self.assertEqual(list(batch), ["a", "b", "c"])
+        self.assertEqual(batch["a"](1.5), 1.5)
+        self.assertEqual(batch["b"](1.5), 2.0)
+        self.assertEqual(list(batch.predict(["c", "a"], [0.0, 3.0])), [5.0, 2.0])
+
+    def test_02_2d(self):
+        (groups, xs, ys, vs, ws) = self.make_inputs(4020, 8, 300)
+
+        expected = {}
+        for g in set(groups):
+            keep = [i for i in range(len(xs)) if groups[i] == g and ws[i] > 0.0]
+            if keep:
+                expected[g] = regress_isotonic_2d_l2(
+                    [xs[i] for i in keep],
+                    [ys[i] for i in keep],
+                    [vs[i] for i in keep],
+                    [ws[i] for i in keep],
+                )
+
+        rng = random.Random(4021)
+        queries = [
+            (rng.uniform(-1.0, 10.0), rng.uniform(-1.0, 10.0)) for _ in range(50)
+        ]
+        query_groups = [rng.choice(sorted(expected)) for _ in queries]
+
+        for n_jobs in (None, 2):
+            with self.subTest(n_jobs=n_jobs):
+                batch = regress_isotonic_2d_l2_batch(
+                    groups, xs, ys, vs, ws, n_jobs=n_jobs
+                )
+                self.assertEqual(batch.ndim, 2)
+                self.check_batch(batch, expected, query_groups, queries)
+
+    def test_03_errors(self):
+        batch = regress_isotonic_1d_batch([1, 2], [1.0, 2.0], [1.0, 2.0], [1.0, 0.0])
+
+        self.assertNotIn(2, batch)
+        with self.assertRaises(KeyError):
+            batch[2]
+        with self.assertRaises(ValueError):
+            batch.predict([2], [1.0])
+        with self.assertRaises(ValueError):
+            batch.predict([1], [1.0], [1.0])
+        with self.assertRaises(ValueError):
+            regress_isotonic_1d_batch([1, 2], [1.0], [1.0, 2.0])
+        with self.assertRaises(ValueError):
+            regress_isotonic_2d_l2_batch([1], [1.0], [1.0], [1.0], n_jobs=0)
+
+        self.assertEqual(len(regress_isotonic_1d_batch([], [], [])), 0)
+
+    def test_04_1d_mixed_scales(self):
+        # one wide group must not cost the narrow groups their precision.
+        rng = random.Random(4040)
+        (groups, xs, vs) = ([], [], [])
+        for g in range(1000):
+            scale = 1e6 if g == 0 else 1e-6
+            for x in range(20):
+                groups.append(g)
+                xs.append(float(x))
+                vs.append(rng.random() * scale)
+
+        batch = regress_isotonic_1d_batch(groups, xs, vs)
+        for g in (0, 1, 500, 999):
+            expected = regress_isotonic_1d(
+                xs[g * 20 : g * 20 + 20], vs[g * 20 : g * 20 + 20]
+            )
+            scale = 1e6 if g == 0 else 1e-6
+            for x in range(20):
+                with self.subTest(g=g, x=x):
+                    self.assertAlmostEqual(
+                        batch[g](float(x)) / scale, expected(float(x)) / scale, places=9
+                    )
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
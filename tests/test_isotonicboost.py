@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import numpy
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+from sklearn.tree import DecisionTreeRegressor
+
+from isoboost import IsotonicBoostRegressor
+
+
+class IsotonicBoostTestCase(unittest.TestCase):
+    """
+    Test boosting with decision trees on a small problem.
+    """
+
+    def make_data(self, seed, n=300):
+        rng = numpy.random.default_rng(seed)
+
+        X = rng.random((n, 3))
+        y = numpy.sin(4.0 * X[:, 0]) + X[:, 1] * X[:, 2] + rng.normal(0.0, 0.1, n)
+
+        return (X, y)
+
+    def make_model(self, n_estimators=5):
+        return IsotonicBoostRegressor(
+            DecisionTreeRegressor(max_depth=2, random_state=0),
+            n_estimators=n_estimators,
+        )
+
+    def test_00_fit(self):
+        (X, y) = self.make_data(4100)
+
+        model = self.make_model()
+        model.fit(X, y)
+
+        self.assertEqual(len(model.estimators_), 5)
+        self.assertEqual(len(model.isotonic_regressions), 4)
+        self.assertEqual(model.predict(X).shape, y.shape)
+
+    def test_01_staged_predict(self):
+        (X, y) = self.make_data(4110)
+        (T, _) = self.make_data(4111, n=50)
+
+        model = self.make_model()
+        model.fit(X, y)
+
+        staged = list(model.staged_predict(T))
+        self.assertEqual(len(staged), len(model.estimators_))
+        numpy.testing.assert_array_equal(staged[-1], model.predict(T))
+        for k in range(1, len(staged) + 1):
+            with self.subTest(k=k):
+                numpy.testing.assert_array_equal(
+                    staged[k - 1], model.predict(T, n_stages=k)
+                )
+
+        # training error never increases with more stages.
+        errors = [((p - y) ** 2).mean() for p in model.staged_predict(X)]
+        for k in range(1, len(errors)):
+            with self.subTest(k=k):
+                self.assertLessEqual(errors[k], errors[k - 1] + 1e-12)
+
+    def test_02_n_stages_range(self):
+        (X, y) = self.make_data(4120)
+
+        model = self.make_model(n_estimators=2)
+        model.fit(X, y)
+
+        for n_stages in (0, 3):
+            with self.assertRaises(ValueError):
+                model.predict(X, n_stages=n_stages)
+
+    def test_03_warm_start(self):
+        (X, y) = self.make_data(4130)
+
+        cold = self.make_model(n_estimators=5)
+        cold.fit(X, y)
+
+        warm = self.make_model(n_estimators=2)
+        warm.set_params(warm_start=True)
+        warm.fit(X, y)
+        first = list(warm.estimators_)
+
+        warm.set_params(n_estimators=5)
+        warm.fit(X, y)
+        self.assertEqual(len(warm.estimators_), 5)
+        self.assertEqual(warm.estimators_[:2], first)
+        numpy.testing.assert_array_equal(warm.predict(X), cold.predict(X))
+
+        warm.set_params(n_estimators=3)
+        with self.assertRaises(ValueError):
+            warm.fit(X, y)
+
+    def test_04_early_stopping(self):
+        (X, y) = self.make_data(4140)
+
+        model = IsotonicBoostRegressor(
+            DecisionTreeRegressor(max_depth=6, random_state=0),
+            n_estimators=30,
+            n_iter_no_change=3,
+            tol=0.0,
+            random_state=0,
+        )
+        model.fit(X, y)
+
+        errors = model.validation_errors_
+        best = errors.index(min(errors)) + 1
+        self.assertLess(len(errors), 30)
+        self.assertEqual(len(errors), best + 3)
+        self.assertEqual(len(model.estimators_), best)
+        self.assertEqual(len(model.isotonic_regressions), best - 1)
+
+        # held out predictions after the best stage match the recorded error.
+        (_, X_val, _, y_val) = train_test_split(X, y, test_size=0.1, random_state=0)
+        self.assertAlmostEqual(((model.predict(X_val) - y_val) ** 2).mean(), errors[-4])
+
+    def test_05_subsample(self):
+        (X, y) = self.make_data(4150)
+
+        model = self.make_model()
+        model.set_params(subsample=0.5, random_state=0)
+        model.fit(X, y)
+
+        for estimator in model.estimators_:
+            self.assertEqual(estimator.tree_.n_node_samples[0], 150)
+        self.assertEqual(len(model.train_predictions_), 300)
+        numpy.testing.assert_array_equal(model.train_predictions_, model.predict(X))
+
+        again = self.make_model()
+        again.set_params(subsample=0.5, random_state=0)
+        numpy.testing.assert_array_equal(again.fit(X, y).predict(X), model.predict(X))
+
+        model.set_params(subsample=1.5)
+        with self.assertRaises(ValueError):
+            model.fit(X, y)
+
+    def test_06_compile(self):
+        (X, y) = self.make_data(4160)
+        (T, _) = self.make_data(4161, n=100)
+
+        model = self.make_model(n_estimators=8)
+        model.fit(X, y)
+        expected = model.predict(T)
+
+        model.compile()
+        self.assertTrue(model.chain_.kept.all())
+        numpy.testing.assert_array_equal(model.predict(T), expected)
+        numpy.testing.assert_array_equal(model.predict(T, n_stages=8), expected)
+
+        # pruning everything only clips the initial predictions.
+        model.compile(tol=numpy.inf)
+        self.assertFalse(model.chain_.kept.any())
+        initial = model.predict(T, n_stages=1)
+        lows = model.chain_.clip_lows
+        highs = model.chain_.clip_highs
+        for (low, high) in zip(lows, highs):
+            initial = initial.clip(low, high)
+        numpy.testing.assert_array_equal(model.predict(T), initial)
+
+        model.fit(X, y)
+        self.assertIsNone(model.chain_)
+
+    def test_07_n_jobs(self):
+        (X, y) = self.make_data(4170)
+        (T, _) = self.make_data(4171, n=100)
+
+        model = self.make_model()
+        model.fit(X, y)
+        expected = list(model.staged_predict(T))
+
+        model.set_params(n_jobs=2)
+        for (actual, e) in zip(model.staged_predict(T), expected):
+            numpy.testing.assert_array_equal(actual, e)
+        numpy.testing.assert_array_equal(model.predict(T, n_stages=3), expected[2])
+        numpy.testing.assert_array_equal(model.compile().predict(T), expected[-1])
+
+    def test_08_checkpoint(self):
+        (X, y) = self.make_data(4180)
+
+        cold = self.make_model(n_estimators=6)
+        cold.fit(X, y)
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            model = self.make_model(n_estimators=3)
+            model.set_params(checkpoint_dir=checkpoint_dir)
+            model.fit(X, y)
+
+            # simulate preemption after two stages.
+            os.remove(os.path.join(checkpoint_dir, "stage-00002.pkl"))
+
+            resumed = self.make_model(n_estimators=6)
+            resumed.set_params(checkpoint_dir=checkpoint_dir)
+            resumed.fit(X, y)
+
+            self.assertEqual(
+                sorted(os.listdir(checkpoint_dir)),
+                ["predictions-00005.npy"] + ["stage-%05d.pkl" % i for i in range(6)],
+            )
+
+        self.assertEqual(len(resumed.train_scores_), 6)
+        numpy.testing.assert_array_equal(resumed.train_predictions_, cold.predict(X))
+        numpy.testing.assert_array_equal(resumed.predict(X), cold.predict(X))
+
+    def test_09_base_estimator(self):
+        (X, y) = self.make_data(4190)
+
+        model = IsotonicBoostRegressor(
+            base_estimator=DecisionTreeRegressor(max_depth=2, random_state=0),
+            n_estimators=5,
+        )
+        with self.assertWarns(FutureWarning):
+            model.fit(X, y)
+
+        expected = self.make_model()
+        expected.fit(X, y)
+        numpy.testing.assert_array_equal(model.predict(X), expected.predict(X))
+
+        self.assertIn("base_estimator", clone(model).get_params())
+
+        with self.assertRaises(ValueError):
+            model.set_params(estimator=DecisionTreeRegressor()).fit(X, y)
+
+    def test_10_combiner_inputs(self):
+        (X, y) = self.make_data(4200)
+
+        model = self.make_model(n_estimators=2)
+        model.fit(X, y)
+
+        # the combiner regresses pairs of previous and new predictions.
+        (initial, combined) = model.staged_predict(X)
+        pairs = numpy.column_stack((initial, model.estimators_[1].predict(X)))
+        numpy.testing.assert_array_equal(
+            model.isotonic_regressions[0].predict(pairs), combined
+        )
+        self.assertLess(((combined - y) ** 2).mean(), ((initial - y) ** 2).mean())
+
+    def test_11_warm_start_subsample(self):
+        (X, y) = self.make_data(4210)
+
+        cold = self.make_model(n_estimators=6)
+        cold.set_params(subsample=0.5, random_state=1)
+        cold.fit(X, y)
+
+        warm = self.make_model(n_estimators=3)
+        warm.set_params(subsample=0.5, random_state=1, warm_start=True)
+        warm.fit(X, y)
+        warm.set_params(n_estimators=6)
+        warm.fit(X, y)
+
+        numpy.testing.assert_array_equal(warm.predict(X), cold.predict(X))
+
+    def test_12_warm_start_new_data(self):
+        (X, y) = self.make_data(4220)
+        (X2, y2) = self.make_data(4221)
+
+        warm = self.make_model(n_estimators=2)
+        warm.set_params(warm_start=True)
+        warm.fit(X, y)
+
+        # the same number of different rows must not reuse predictions.
+        warm.set_params(n_estimators=4)
+        warm.fit(X2, y2)
+        numpy.testing.assert_array_equal(warm.train_predictions_, warm.predict(X2))
+
+    def test_13_checkpoint_subsample(self):
+        (X, y) = self.make_data(4230)
+
+        cold = self.make_model(n_estimators=6)
+        cold.set_params(subsample=0.5, random_state=1)
+        cold.fit(X, y)
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            model = self.make_model(n_estimators=3)
+            model.set_params(
+                subsample=0.5, random_state=1, checkpoint_dir=checkpoint_dir
+            )
+            model.fit(X, y)
+
+            # saved predictions for other rows are predicted again.
+            numpy.save(os.path.join(checkpoint_dir, "predictions-00002.npy"), y[:10])
+
+            resumed = self.make_model(n_estimators=6)
+            resumed.set_params(
+                subsample=0.5, random_state=1, checkpoint_dir=checkpoint_dir
+            )
+            resumed.fit(X, y)
+
+        numpy.testing.assert_array_equal(resumed.train_predictions_, cold.predict(X))
+        numpy.testing.assert_array_equal(resumed.predict(X), cold.predict(X))
+
+    def test_14_checkpoint_early_stopping(self):
+        (X, y) = self.make_data(4140)
+
+        def make_model(checkpoint_dir):
+            return IsotonicBoostRegressor(
+                DecisionTreeRegressor(max_depth=6, random_state=0),
+                n_estimators=30,
+                n_iter_no_change=3,
+                tol=0.0,
+                random_state=0,
+                checkpoint_dir=checkpoint_dir,
+            )
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            cold = make_model(checkpoint_dir)
+            cold.fit(X, y)
+            n_saved = len(cold.validation_errors_)
+            self.assertLess(len(cold.estimators_), n_saved)
+
+            # simulate preemption before the last stage, and after it.
+            for n_removed in (1, 0):
+                for i in range(n_saved - n_removed, n_saved):
+                    os.remove(os.path.join(checkpoint_dir, "stage-%05d.pkl" % i))
+
+                resumed = make_model(checkpoint_dir)
+                resumed.fit(X, y)
+
+                with self.subTest(n_removed=n_removed):
+                    self.assertEqual(len(resumed.estimators_), len(cold.estimators_))
+                    self.assertEqual(
+                        resumed.validation_errors_, cold.validation_errors_
+                    )
+                    numpy.testing.assert_array_equal(
+                        resumed.train_predictions_, cold.train_predictions_
+                    )
+                    numpy.testing.assert_array_equal(
+                        resumed.predict(X), cold.predict(X)
+                    )
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
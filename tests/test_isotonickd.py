@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+import os
+import random
+import tempfile
 import unittest
 
 from isoboost import IsotonicKdRegression
@@ -139,6 +142,129 @@ class IsotonicKdRegressionTest(unittest.TestCase):
             n_values=1,
         )
 
+    def test_12_subsample(self):
+        data_range = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+        X = [(x, y, z) for x in data_range for y in data_range for z in data_range]
+        v = [sum(r) for r in X]
+
+        predictions = []
+        for _ in range(2):
+            regressor = IsotonicKdRegression(subsample=0.5, random_state=1200)
+            regressor.fit(X, v)
+            predictions.append(list(regressor.predict(X)))
+
+        self.assertEqual(predictions[0], predictions[1])
+        self.assertGreater(regressor.score(X, v), 0.8)
+
+        with self.assertRaises(ValueError):
+            IsotonicKdRegression(subsample=0.0).fit(X, v)
+
+    def test_13_compile(self):
+        data_range = (0.0, 0.25, 0.5, 0.75, 1.0)
+        X = [
+            (x, y, z, x * y - z)
+            for x in data_range
+            for y in data_range
+            for z in data_range
+            for _ in range(2)
+        ]
+        v = [x * x + y + z * z for (x, y, z, _) in X]
+
+        regressor = IsotonicKdRegression()
+        regressor.fit(X, v)
+        expected = list(regressor.predict(X))
+
+        regressor.compile()
+        self.assertEqual(len(regressor.chain_), len(regressor.fs))
+        self.assertEqual(list(regressor.predict(X)), expected)
+
+    def test_14_checkpoint(self):
+        data_range = (0.0, 0.25, 0.5, 0.75, 1.0)
+        X = [
+            (x, y, z, x * y - z)
+            for x in data_range
+            for y in data_range
+            for z in data_range
+        ]
+        v = [x * x + y + z * z + 0.1 * w for (x, y, z, w) in X]
+
+        expected = IsotonicKdRegression()
+        expected.fit(X, v)
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            regressor = IsotonicKdRegression(checkpoint_dir=checkpoint_dir)
+            regressor.fit(X, v)
+            n_saved = len(
+                [
+                    name
+                    for name in os.listdir(checkpoint_dir)
+                    if name.startswith("stage")
+                ]
+            )
+            self.assertGreater(n_saved, 1)
+
+            # simulate preemption before the last stage.
+            os.remove(os.path.join(checkpoint_dir, "stage-%05d.pkl" % (n_saved - 1)))
+
+            resumed = IsotonicKdRegression(checkpoint_dir=checkpoint_dir)
+            resumed.fit(X, v)
+
+        self.assertEqual(len(resumed.fs), len(expected.fs))
+        self.assertEqual(list(resumed.predict(X)), list(expected.predict(X)))
+
+    def test_15_predict_one(self):
+        rng = random.Random(5010)
+        X = [[rng.random() for _ in range(3)] for _ in range(200)]
+        v = [x * y + z + 0.1 * rng.random() for (x, y, z) in X]
+        T = [[rng.uniform(-0.1, 1.1) for _ in range(3)] for _ in range(100)]
+
+        for n_values in (None, 10):
+            regressor = IsotonicKdRegression(n_values=n_values)
+            regressor.fit(X, v)
+
+            for tol in (None, 0.0, 0.05):
+                if tol is not None:
+                    regressor.compile(tol=tol)
+
+                expected = regressor.predict(T)
+                for (row, e) in zip(T, expected):
+                    with self.subTest(n_values=n_values, tol=tol, row=row):
+                        self.assertEqual(regressor.predict_one(*row), e)
+                        self.assertEqual(regressor.predict_row(row), e)
+
+        regressor = IsotonicKdRegression()
+        regressor.fit([r[:1] for r in X], v)
+        for (row, e) in zip(T, regressor.predict([r[:1] for r in T])):
+            self.assertEqual(regressor.predict_one(row[0]), e)
+
+        with self.assertRaises(ValueError):
+            regressor.predict_one(0.0, 0.0)
+
+    def test_16_checkpoint_subsample(self):
+        rng = random.Random(4700)
+        X = [[rng.random() for _ in range(3)] for _ in range(200)]
+        v = [x * y + z + 0.1 * rng.random() for (x, y, z) in X]
+
+        expected = IsotonicKdRegression(subsample=0.5, random_state=1)
+        expected.fit(X, v)
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            regressor = IsotonicKdRegression(
+                n_estimators=2,
+                subsample=0.5,
+                random_state=1,
+                checkpoint_dir=checkpoint_dir,
+            )
+            regressor.fit(X, v)
+
+            resumed = IsotonicKdRegression(
+                subsample=0.5, random_state=1, checkpoint_dir=checkpoint_dir
+            )
+            resumed.fit(X, v)
+
+        self.assertEqual(len(resumed.fs), len(expected.fs))
+        self.assertEqual(list(resumed.predict(X)), list(expected.predict(X)))
+
 
 ############################################################
 # startup handling #########################################
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import io
+import random
+import unittest
+
+import numpy
+
+from isoboost import IsotonicSketch
+from isoboost import regress_isotonic_1d
+from isoboost import regress_isotonic_2d_l2
+
+
+class IsotonicSketchTestCase(unittest.TestCase):
+    """
+    Test fitting from merged sketches.
+    """
+
+    def make_chunks(self, ndim, seed):
+        rng = random.Random(seed)
+
+        chunks = []
+        for _ in range(5):
+            n = rng.randint(1, 20)
+            X = [[rng.randint(0, 6) for _ in range(ndim)] for _ in range(n)]
+            y = [sum(r) + rng.random() * 4.0 for r in X]
+            w = [rng.choice((0.0, 0.5, 1.0, 2.0)) for _ in range(n)]
+            chunks.append((X, y, w))
+
+        return chunks
+
+    def check_sketch(self, sketch, chunks):
+        X = [r for (c, _, _) in chunks for r in c]
+        y = [v for (_, c, _) in chunks for v in c]
+        w = [v for (_, _, c) in chunks for v in c]
+
+        keep = [i for i in range(len(w)) if w[i] > 0.0]
+        if sketch.ndim == 1:
+            expected = regress_isotonic_1d(
+                [X[i][0] for i in keep], [y[i] for i in keep], [w[i] for i in keep]
+            )
+        else:
+            expected = regress_isotonic_2d_l2(
+                [X[i][0] for i in keep],
+                [X[i][1] for i in keep],
+                [y[i] for i in keep],
+                [w[i] for i in keep],
+            )
+
+        actual = sketch.fit()
+        self.assertEqual(len(sketch), len(set(tuple(X[i]) for i in keep)))
+
+        for r in X:
+            with self.subTest(r=r):
+                self.assertAlmostEqual(actual(*r), expected(*r))
+
+    def test_00_chunks(self):
+        for ndim in (1, 2):
+            chunks = self.make_chunks(ndim, 3400 + ndim)
+
+            sketch = IsotonicSketch(ndim=ndim)
+            for chunk in chunks:
+                sketch.update(*chunk)
+
+            self.check_sketch(sketch, chunks)
+
+    def test_01_merge(self):
+        for ndim in (1, 2):
+            chunks = self.make_chunks(ndim, 3410 + ndim)
+
+            sketch = IsotonicSketch(ndim=ndim)
+            for chunk in chunks:
+                sketch.merge(IsotonicSketch(ndim=ndim).update(*chunk))
+
+            self.check_sketch(sketch, chunks)
+
+    def test_02_save_load(self):
+        chunks = self.make_chunks(2, 3420)
+
+        sketch = IsotonicSketch(ndim=2)
+        for chunk in chunks:
+            sketch.update(*chunk)
+
+        buffer = io.BytesIO()
+        sketch.save(buffer)
+        buffer.seek(0)
+
+        self.check_sketch(IsotonicSketch.load(buffer), chunks)
+
+    def test_03_1d_inputs(self):
+        sketch = IsotonicSketch().update([1.0, 2.0, 2.0], [3.0, 1.0, 2.0])
+
+        f = sketch.fit()
+        self.assertEqual(f(1.0), 2.0)
+        self.assertEqual(f(2.0), 2.0)
+
+    def test_04_mismatch(self):
+        with self.assertRaises(ValueError):
+            IsotonicSketch(ndim=2).update([1.0, 2.0], [1.0, 2.0])
+        with self.assertRaises(ValueError):
+            IsotonicSketch(ndim=1).merge(IsotonicSketch(ndim=2))
+        with self.assertRaises(ValueError):
+            IsotonicSketch(ndim=3)
+        with self.assertRaises(ValueError):
+            IsotonicSketch(max_size=0)
+        with self.assertRaises(ValueError):
+            IsotonicSketch().merge(IsotonicSketch(max_size=1).update([1, 2], [1, 2]))
+
+    def test_10_bounded_1d(self):
+        rng = random.Random(3500)
+
+        xs = [rng.random() for _ in range(500)]
+        vs = [x + rng.random() for x in xs]
+        ws = [rng.choice((0.5, 1.0, 2.0)) for _ in xs]
+
+        def error(f):
+            return sum(w * (v - f(x)) ** 2 for (x, v, w) in zip(xs, vs, ws)) / sum(ws)
+
+        optimal = error(regress_isotonic_1d(xs, vs, ws))
+
+        for max_size in (1, 7, 40):
+            with self.subTest(max_size=max_size):
+                sketch = IsotonicSketch(max_size=max_size)
+                for i in range(0, len(xs), 60):
+                    sketch.merge(
+                        IsotonicSketch(max_size=max_size).update(
+                            xs[i : i + 60], vs[i : i + 60], ws[i : i + 60]
+                        )
+                    )
+
+                self.assertLessEqual(len(sketch), max_size)
+                self.assertAlmostEqual(sketch.weights.sum(), sum(ws))
+                self.assertLessEqual(
+                    error(sketch.fit()), optimal + sketch.compaction_error() + 1e-9
+                )
+
+    def test_11_bounded_1d_exact(self):
+        chunks = self.make_chunks(1, 3510)
+
+        sketch = IsotonicSketch(max_size=100)
+        exact = IsotonicSketch()
+        for chunk in chunks:
+            sketch.update(*chunk)
+            exact.update(*chunk)
+
+        self.check_sketch(sketch, chunks)
+        self.assertAlmostEqual(sketch.compaction_error(), exact.compaction_error())
+
+    def test_12_bounded_2d(self):
+        rng = random.Random(3520)
+
+        sketch = IsotonicSketch(ndim=2, max_size=5)
+        for _ in range(4):
+            X = [[rng.random(), rng.random()] for _ in range(200)]
+            sketch.update(X, [x + y for (x, y) in X])
+
+            self.assertLessEqual(len(sketch), 25)
+            self.assertAlmostEqual(sketch.weights.sum(), 200.0 * (_ + 1))
+
+        f = sketch.fit()
+        self.assertLess(f(0.0, 0.0), f(1.0, 1.0))
+        self.assertGreater(sketch.compaction_error(), 0.0)
+
+    def test_13_merge_shards(self):
+        rng = random.Random(3530)
+
+        for (ndim, max_size, n) in ((1, 100, 2000), (2, 10, 200)):
+            shards = []
+            for _ in range(10):
+                X = [[rng.random() for _ in range(ndim)] for _ in range(n)]
+                shards.append((X, [sum(r) + rng.gauss(0.0, 0.3) for r in X]))
+
+            streamed = IsotonicSketch(ndim=ndim, max_size=max_size)
+            merged = IsotonicSketch(ndim=ndim, max_size=max_size)
+            for (i, shard) in enumerate(shards):
+                streamed.update(*shard)
+                merged.merge(
+                    IsotonicSketch(ndim=ndim, max_size=max_size).update(*shard)
+                )
+
+                # interleaved shards must not collapse into a few centroids.
+                with self.subTest(ndim=ndim, i=i):
+                    self.assertLessEqual(len(merged), max_size ** ndim)
+                    self.assertGreaterEqual(len(merged), 0.7 * max_size ** ndim)
+
+            with self.subTest(ndim=ndim):
+                self.assertAlmostEqual(merged.weights.sum(), 10.0 * n)
+                self.assertLess(
+                    merged.compaction_error(), 1.25 * streamed.compaction_error()
+                )
+
+                # centroid ranges stay disjoint along each axis.
+                for axis in range(ndim):
+                    lows = numpy.unique(merged.lows[:, axis])
+                    highs = numpy.unique(merged.highs[:, axis])
+                    self.assertEqual(len(lows), len(highs))
+                    self.assertTrue((lows[1:] > highs[:-1]).all())
+
+    def test_14_bounded_2d_error(self):
+        rng = random.Random(3540)
+
+        X = [[rng.random(), rng.random()] for _ in range(300)]
+        y = [x0 + x1 + rng.gauss(0.0, 0.3) for (x0, x1) in X]
+
+        def error(f):
+            return sum((v - f(*r)) ** 2 for (r, v) in zip(X, y)) / len(y)
+
+        optimal = error(regress_isotonic_2d_l2([r[0] for r in X], [r[1] for r in X], y))
+
+        for max_size in (2, 5):
+            with self.subTest(max_size=max_size):
+                sketch = IsotonicSketch(ndim=2, max_size=max_size)
+                for i in range(0, len(X), 50):
+                    sketch.update(X[i : i + 50], y[i : i + 50])
+
+                f = sketch.fit()
+                for (low, high) in zip(sketch.lows, sketch.highs):
+                    middle = (low + high) / 2.0
+                    for corner in ((low[0], high[1]), (high[0], low[1]), high, low):
+                        self.assertAlmostEqual(f(*corner), f(*middle))
+
+                self.assertGreaterEqual(sketch.error_bound(), sketch.compaction_error())
+                self.assertLessEqual(error(f), optimal + sketch.error_bound() + 1e-9)
+
+        self.assertEqual(IsotonicSketch(ndim=2).update(X, y).error_bound(), 0.0)
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import tempfile
+import unittest
+
+import numpy
+from sklearn.tree import DecisionTreeRegressor
+
+from isoboost import Isotonic1dRegression
+from isoboost import Isotonic2dRegression
+from isoboost import IsotonicBoostRegressor
+from isoboost import IsotonicKdRegression
+from isoboost import load_model
+from isoboost import regress_isotonic_1d
+from isoboost import regress_isotonic_2d
+from isoboost import save_model
+
+
+class ModelFileTestCase(unittest.TestCase):
+    """
+    Test models loaded from model files predict exactly like the saved
+    models.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def round_trip(self, model):
+        path = os.path.join(self.directory.name, "model.bin")
+        save_model(model, path)
+
+        return (load_model(path), load_model(path, mmap_mode=None))
+
+    def make_data(self, seed, n, k):
+        rng = numpy.random.default_rng(seed)
+
+        X = rng.random((n, k))
+        y = X.sum(axis=1) + numpy.sin(5.0 * X[:, 0]) + rng.normal(0.0, 0.1, n)
+
+        return (X, y)
+
+    def test_00_functions(self):
+        rng = random.Random(4800)
+        xs = [rng.random() for _ in range(100)]
+        ys = [rng.random() for _ in range(100)]
+        vs = [x + y + rng.random() for (x, y) in zip(xs, ys)]
+
+        f1 = regress_isotonic_1d(xs, vs)
+        f2 = regress_isotonic_2d(xs, ys, vs)
+        queries = [(rng.uniform(-0.1, 1.1), rng.uniform(-0.1, 1.1)) for _ in range(200)]
+
+        for loaded in self.round_trip(f1):
+            for (x, _) in queries:
+                self.assertEqual(loaded(x), f1(x))
+        for loaded in self.round_trip(f1.__self__):
+            for (x, _) in queries:
+                self.assertEqual(loaded.interpolate(x), f1(x))
+
+        for loaded in self.round_trip(f2):
+            for (x, y) in queries:
+                self.assertEqual(loaded(x, y), f2(x, y))
+            numpy.testing.assert_array_equal(
+                loaded.__self__.interpolate_array(*zip(*queries)),
+                f2.__self__.interpolate_array(*zip(*queries)),
+            )
+
+    def test_01_estimators(self):
+        (X, y) = self.make_data(4810, 200, 3)
+        (T, _) = self.make_data(4811, 100, 3)
+
+        models = [
+            Isotonic1dRegression(),
+            Isotonic2dRegression(),
+            IsotonicKdRegression(),
+            IsotonicKdRegression(n_values=20),
+            IsotonicBoostRegressor(
+                DecisionTreeRegressor(max_depth=3, random_state=0), n_estimators=4
+            ),
+        ]
+        for model in models:
+            columns = {"Isotonic1dRegression": 1, "Isotonic2dRegression": 2}
+            k = columns.get(type(model).__name__, 3)
+            model.fit(X[:, :k], y)
+
+            for loaded in self.round_trip(model):
+                with self.subTest(model=model):
+                    numpy.testing.assert_array_equal(
+                        loaded.predict(T[:, :k]), model.predict(T[:, :k])
+                    )
+
+    def test_02_mmap(self):
+        (X, y) = self.make_data(4820, 200, 2)
+
+        model = Isotonic2dRegression()
+        model.fit(X, y)
+
+        (mapped, read) = self.round_trip(model)
+        for loaded in (mapped, read):
+            xs = loaded.f_.__self__.xs
+            self.assertFalse(xs.flags.owndata)
+            self.assertFalse(xs.flags.writeable)
+
+    def test_03_boost_stages(self):
+        (X, y) = self.make_data(4830, 200, 3)
+        (T, _) = self.make_data(4831, 100, 3)
+
+        model = IsotonicBoostRegressor(
+            DecisionTreeRegressor(max_depth=3, random_state=0), n_estimators=4
+        )
+        model.fit(X, y)
+        expected = list(model.staged_predict(T))
+
+        for loaded in self.round_trip(model):
+            staged = list(loaded.staged_predict(T))
+            self.assertEqual(len(staged), len(expected))
+            for k in range(1, len(expected) + 1):
+                with self.subTest(k=k):
+                    numpy.testing.assert_array_equal(staged[k - 1], expected[k - 1])
+                    numpy.testing.assert_array_equal(
+                        loaded.predict(T, n_stages=k), expected[k - 1]
+                    )
+
+    def test_04_errors(self):
+        path = os.path.join(self.directory.name, "model.bin")
+
+        with self.assertRaises(ValueError):
+            save_model(object(), path)
+
+        with open(path, "wb") as f:
+            f.write(b"not a model file")
+        with self.assertRaises(ValueError):
+            load_model(path)
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+from isoboost.piecewise import PiecewiseBilinear
+from isoboost.piecewise import PiecewiseBilinearChain
+from isoboost.piecewise import PiecewiseLinear
+
+
+class PiecewiseTestCase(unittest.TestCase):
+    """
+    Test vectorized interpolation matches scalar interpolation exactly.
+    """
+
+    def test_00_linear_array(self):
+        rng = random.Random(2800)
+
+        f = PiecewiseLinear([(0.0, 1.0), (0.5, 1.5), (2.0, 1.7), (3.0, 4.0)])
+
+        ys = [rng.uniform(-1.0, 4.0) for _ in range(1000)] + [0.0, 0.5, 2.0, 3.0]
+        actual = f.interpolate_array(ys)
+        for (y, v) in zip(ys, actual):
+            with self.subTest(y=y):
+                self.assertEqual(v, f.interpolate(y))
+
+    def test_01_bilinear_array(self):
+        rng = random.Random(2801)
+
+        points = [
+            (x, y, rng.random())
+            for x in range(5)
+            for y in sorted(rng.sample(range(10), rng.randint(1, 4)))
+        ]
+        f = PiecewiseBilinear(points)
+
+        xs = [rng.uniform(-1.0, 6.0) for _ in range(1000)] + [0.0, 2.0, 4.0]
+        ys = [rng.uniform(-1.0, 11.0) for _ in range(1000)] + [0.0, 3.0, 9.0]
+        actual = f.interpolate_array(xs, ys)
+        for (x, y, v) in zip(xs, ys, actual):
+            with self.subTest(x=x, y=y):
+                self.assertEqual(v, f.interpolate(x, y))
+
+    def test_02_empty_array(self):
+        f = PiecewiseBilinear([(0.0, 0.0, 1.0)])
+
+        self.assertEqual(len(f.interpolate_array([], [])), 0)
+
+    def make_bilinear(self, rng, change=1.0):
+        return PiecewiseBilinear(
+            [
+                (x, y, x + change * rng.random())
+                for x in sorted(rng.sample(range(10), rng.randint(1, 5)))
+                for y in sorted(rng.sample(range(10), rng.randint(1, 4)))
+            ]
+        )
+
+    def test_03_chain(self):
+        rng = random.Random(2803)
+
+        stages = [self.make_bilinear(rng) for _ in range(6)]
+        chain = PiecewiseBilinearChain(stages)
+        self.assertEqual(len(chain), 6)
+        self.assertTrue(chain.kept.all())
+
+        xs = [rng.uniform(-1.0, 11.0) for _ in range(500)]
+        ys = [[rng.uniform(-1.0, 11.0) for _ in xs] for _ in stages]
+        actual = chain.interpolate_array(xs, ys)
+        for (k, v) in enumerate(actual):
+            expected = xs[k]
+            for (stage, stage_ys) in zip(stages, ys):
+                expected = stage.interpolate(expected, stage_ys[k])
+            with self.subTest(k=k):
+                self.assertEqual(v, expected)
+
+    def test_04_chain_pruning(self):
+        rng = random.Random(2804)
+
+        stages = [self.make_bilinear(rng, change) for change in (1.0, 0.01, 1.0)]
+        chain = PiecewiseBilinearChain(stages, tol=0.05)
+        self.assertEqual(list(chain.kept), [True, False, True])
+
+        xs = [rng.uniform(-1.0, 11.0) for _ in range(500)]
+        ys = [[rng.uniform(-1.0, 11.0) for _ in xs] for _ in stages]
+        middle = stages[1]
+        clipped = PiecewiseBilinearChain(stages[:1]).interpolate_array(xs, ys[:1])
+        for (k, v) in enumerate(clipped):
+            with self.subTest(k=k):
+                clip = min(max(v, middle.xs[0]), middle.xs[-1])
+                self.assertLessEqual(abs(middle.interpolate(v, ys[1][k]) - clip), 0.01)
+
+        actual = chain.interpolate_array(xs, [ys[0], None, ys[2]])
+        for (k, v) in enumerate(actual):
+            clip = min(max(clipped[k], middle.xs[0]), middle.xs[-1])
+            with self.subTest(k=k):
+                self.assertEqual(v, stages[2].interpolate(clip, ys[2][k]))
+
+
+############################################################
+# startup handling #########################################
+############################################################
+
+if __name__ == "__main__":
+    unittest.main()